@@ -0,0 +1,104 @@
+# bam_coverage.py
+"""
+Reads per-base depth straight from an indexed BAM/CRAM with `samtools depth`, so no bedgraph has to be
+made or stored for the low-depth mask.
+Every contig is read by its own `samtools depth -aa -r contig` (the index lets samtools jump to the contig),
+and the output is parsed a block at a time, so one contig can be read per worker and nothing but the
+current block is held in memory. Positions samtools leaves out anyway (a contig without reads, the tail
+after the last read) are given depth 0 from the contig length, so they are masked instead of read as reference.
+samtools depth leaves out unmapped, secondary, QC-failed and duplicate reads, so depths can be a little
+lower than those of bedtools genomecov, which counts every alignment.
+"""
+
+import os
+import tempfile
+import subprocess
+
+import numpy as np
+
+from merge_contigs_bed import read_blocks, parse_ints, NEWLINE, TAB
+
+
+def find_index(bam):
+    '''
+    Output:
+        path to the .bai/.csi/.crai index of bam (next to it, with or without the .bam/.cram extension), or None
+    '''
+    stem = os.path.splitext(bam)[0]
+    for path in (bam + '.bai', bam + '.csi', bam + '.crai', stem + '.bai', stem + '.crai'):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def find_alignment(ad, sample):
+    '''
+    Output:
+        path to aligned_{sample}.bam/.cram or {sample}.bam/.cram in directory ad, None if there is none
+    '''
+    for name in (f'aligned_{sample}.bam', f'aligned_{sample}.cram', f'{sample}.bam', f'{sample}.cram'):
+        path = os.path.join(ad, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def parse_depth_block(block):
+    '''
+    Args:
+        block: bytes of complete `samtools depth` lines (contig, 1 index position, depth)
+    Output:
+        (positions, depths) int64 arrays
+    '''
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_end = np.flatnonzero(buf == NEWLINE)
+    tabs = np.flatnonzero(buf == TAB)
+    if len(tabs) != 2 * len(line_end):
+        raise ValueError('samtools depth lines need 3 tab separated columns')
+    tabs = tabs.reshape(-1, 2)
+    return parse_ints(buf, tabs[:, 0] + 1, tabs[:, 1]), parse_ints(buf, tabs[:, 1] + 1, line_end)
+
+
+def depth_chunks(bam, contig, length, offset=0, reference=None, chunk_bytes=1<<24):
+    '''
+    reads the depth of every position of one contig
+    Args:
+        bam: path to a sorted and indexed BAM/CRAM
+        contig: contig name
+        length: contig length, positions up to it that samtools does not print are depth 0
+        offset: number added to the contig's positions (see contig_offsets.py)
+        reference: reference fasta, needed for CRAM files whose reference can't be found otherwise
+        chunk_bytes: roughly how much samtools output is parsed per block
+    Output:
+        yields (starts, ends, depth) numpy arrays in bedgraph coordinates (0 index start, 1 index end), one line per base
+        and one depth 0 line for every run of positions samtools left out
+    '''
+    cmd = ['samtools', 'depth', '-aa', '-r', contig]
+    if reference != None:
+        cmd += ['--reference', reference]
+    cmd.append(bam)
+    #next position samtools should print (1 index)
+    expected = 1
+    #stderr goes to a file, a full stderr pipe would block samtools while stdout is read
+    with tempfile.TemporaryFile() as err, subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err) as proc:
+        for block in read_blocks(proc.stdout, chunk_bytes):
+            positions, depths = parse_depth_block(block)
+            if len(positions) == 0:
+                continue
+            starts = positions - 1
+            ends = positions
+            #a gap before a position is a depth 0 line from the position after the previous one
+            after = np.concatenate(([expected], positions[:-1] + 1))
+            gaps = np.flatnonzero(positions > after)
+            if len(gaps) > 0:
+                starts = np.insert(starts, gaps, after[gaps] - 1)
+                ends = np.insert(ends, gaps, positions[gaps] - 1)
+                depths = np.insert(depths, gaps, 0)
+            expected = int(positions[-1]) + 1
+            yield starts + offset, ends + offset, depths
+        if proc.wait() != 0:
+            err.seek(0)
+            raise Exception(f'samtools depth failed on {contig} of {bam}: {err.read().decode().strip()}')
+    #the whole contig when samtools printed nothing for it, otherwise what is left after the last read
+    if expected <= length:
+        yield np.array([expected - 1 + offset]), np.array([length + offset]), np.zeros(1, dtype=np.int64)
@@ -0,0 +1,198 @@
+# benchmark.py
+"""
+Benchmarks the conversion on a synthetic data set (see synthetic_data.py), so a change to any stage
+can be checked for speed before it is merged.
+Every benchmark is repeated and its best time kept. Results are appended as one JSON line per run
+(with the commit and the data set parameters) and compared with the last run on the same parameters.
+
+    python scripts/benchmark.py -d bench_data -r 3
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import datetime
+import subprocess
+import statistics
+
+from synthetic_data import generate
+from merge_contigs_bed import merge_contigs
+from contig_offsets import load_offsets, default_contig_lengths
+from compile_mask import compile_mask
+from vcf_to_diff_script import convert_sample, convert_multi_sample, mask_low_depth
+from combine_diffs import combine_diffs
+from cohort_store import ingest, export
+from stage_metrics import SampleMetrics
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def timed(fn, repeats, setup=None):
+    '''
+    Args:
+        fn: function to time (no arguments)
+        repeats: number of runs
+        setup: function run before every run, not timed (e.g. removing outputs so nothing is cached)
+    Output:
+        (best, median) wall time in seconds
+    '''
+    times = []
+    for r in range(repeats):
+        if setup != None:
+            setup()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return round(min(times), 4), round(statistics.median(times), 4)
+
+
+def fresh_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(data, samples, repeats, jobs):
+    '''
+    times every stage and the batch drivers on the data set in data
+    Output:
+        results: dictionary of benchmark name -> [best, median] seconds
+        stages: dictionary of convert_sample stage -> wall seconds summed over the samples (last repeat)
+    '''
+    offsets = load_offsets()
+    beds = [os.path.join(data, 'bed', f'aligned_{s}.bed') for s in samples]
+    vcfs = [os.path.join(data, 'vcf', f'{s}.vcf.gz') for s in samples]
+    merged_dir = os.path.join(data, 'merged')
+    merged = [os.path.join(merged_dir, f'{s}_merged.bed') for s in samples]
+    mask_bed = os.path.join(data, 'species_mask.bed')
+    mask_npy = os.path.join(data, 'species_mask.npy')
+    out = os.path.join(data, 'out')
+    results = {}
+
+    os.makedirs(merged_dir, exist_ok=True)
+    results['merge_contigs_bed'] = timed(lambda: [merge_contigs(b, m, offsets) for b, m in zip(beds, merged)], repeats)
+    results['compile_mask'] = timed(lambda: compile_mask(mask_bed, mask_npy), repeats)
+    results['mask_low_depth'] = timed(lambda: [mask_low_depth(m, 10) for m in merged], repeats)
+    #per-contig bedgraphs shifted while they are read, no merged copy
+    results['mask_low_depth_raw'] = timed(lambda: [mask_low_depth(b, 10, offsets) for b in beds], repeats)
+
+    stages = {}
+    def convert_all():
+        stages.clear()
+        for vcf, m in zip(vcfs, merged):
+            metrics = SampleMetrics(sum(length for contig, length in default_contig_lengths))
+            convert_sample(vcf, out, smf=mask_npy, bed=m, offsets=offsets, metrics=metrics)
+            summary = metrics.summary()
+            for stage in summary['stages']:
+                stages[stage['stage']] = stages.get(stage['stage'], 0) + stage['wall']
+            for name, step in summary['steps'].items():
+                stages[name] = stages.get(name, 0) + step['wall']
+    results['convert_sample'] = timed(convert_all, repeats, setup=lambda: fresh_dir(out))
+    results['convert_sample_compact'] = timed(lambda: [convert_sample(vcf, out, smf=mask_npy, bed=m, offsets=offsets, compact=True) for vcf, m in zip(vcfs, merged)],
+                                              repeats, setup=lambda: fresh_dir(out))
+    diffs = [os.path.join(out, f'{s}.diff') for s in samples]
+    results['combine_diffs'] = timed(lambda: combine_diffs(diffs, os.path.join(data, 'combined.diff')), repeats)
+    results['combine_diffs_gz'] = timed(lambda: combine_diffs(diffs, os.path.join(data, 'combined.diff.gz')), repeats)
+    store = os.path.join(data, 'cohort.store')
+    results['cohort_store_ingest'] = timed(lambda: ingest(diffs, store, jobs), repeats)
+    results['cohort_store_export'] = timed(lambda: export(store, samples[::2], os.path.join(data, 'subset.diff')), repeats)
+
+    joint = os.path.join(data, 'joint.vcf.gz')
+    if os.path.exists(joint):
+        joint_out = os.path.join(data, 'joint_out')
+        results['convert_multi_sample'] = timed(lambda: convert_multi_sample(joint, joint_out, smf=mask_npy, offsets=offsets, jobs=jobs),
+                                                repeats, setup=lambda: fresh_dir(joint_out))
+
+    #end to end batch drivers, outputs are removed before every run so nothing is cached
+    sl = os.path.join(data, 'samples.txt')
+    driver_merged = os.path.join(data, 'driver_merged')
+    driver_out = os.path.join(data, 'driver_out')
+    results['run_mergebed'] = timed(lambda: subprocess.run([sys.executable, os.path.join(SCRIPTS, 'run_mergebed.py'), '-bd', os.path.join(data, 'bed'),
+                                                            '-wd', driver_merged, '-sl', sl], check=True, capture_output=True),
+                                    repeats, setup=lambda: fresh_dir(driver_merged))
+    results['run_vcftodiff'] = timed(lambda: subprocess.run([sys.executable, os.path.join(SCRIPTS, 'run_vcftodiff.py'), '-vd', os.path.join(data, 'vcf'),
+                                                             '-bd', driver_merged, '-wd', driver_out, '-sl', sl, '-smf', mask_npy, '-j', str(jobs)], check=True, capture_output=True),
+                                     repeats, setup=lambda: fresh_dir(driver_out))
+    return results, {name: round(wall, 4) for name, wall in stages.items()}
+
+
+def last_run(results_file, params):
+    '''
+    Output:
+        the last stored run with the same parameters, or None
+    '''
+    if not os.path.exists(results_file):
+        return None
+    previous = None
+    with open(results_file) as f:
+        for line in f:
+            run = json.loads(line)
+            if run.get('params') == params:
+                previous = run
+    return previous
+
+
+def compare(run, previous, threshold=1.1, noise=0.05):
+    '''
+    prints every benchmark next to the previous run, marking the ones more than threshold times 
+    (and more than noise seconds) slower
+    '''
+    print(f"{'benchmark':<24}{'best (s)':>10}{'previous':>10}{'ratio':>8}")
+    for name, (best, median) in run['results'].items():
+        if previous != None and name in previous['results']:
+            before = previous['results'][name][0]
+            ratio = best / before if before > 0 else float('inf')
+            flag = '  SLOWER' if ratio > threshold and best - before > noise else ''
+            print(f'{name:<24}{best:>10.3f}{before:>10.3f}{ratio:>8.2f}{flag}')
+        else:
+            print(f'{name:<24}{best:>10.3f}{"-":>10}{"-":>8}')
+    print('convert_sample stages (s): ' + ', '.join(f'{name} {wall}' for name, wall in run['stages'].items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data', required=True, type=str, help='directory of the synthetic data set (generated if it has no samples.txt)')
+    parser.add_argument('-o', '--results', default='benchmark_results.jsonl', type=str, help='JSON lines file the results are appended to')
+    parser.add_argument('-r', '--repeats', default=3, type=int, help='runs of every benchmark (the best is kept)')
+    parser.add_argument('-j', '--jobs', default=1, type=int, help='workers for the batch driver and multi-sample conversion')
+    parser.add_argument('-n', '--samples', default=4, type=int, help='single-sample VCFs to generate')
+    parser.add_argument('-s', '--sites', default=50000, type=int, help='variant sites per single-sample VCF')
+    parser.add_argument('-ms', '--multi_samples', default=50, type=int, help='sample columns of the joint VCF (0 to skip)')
+    parser.add_argument('--missing_rate', default=0.01, type=float, help='fraction of ./. genotypes')
+    parser.add_argument('--profile', default='patchy', choices=['uniform', 'patchy', 'dropout'], help='coverage profile of the bedgraphs')
+    parser.add_argument('--seed', default=1, type=int, help='random seed of the data set')
+    args = parser.parse_args()
+
+    data_params = {'samples': args.samples, 'sites': args.sites, 'multi_samples': args.multi_samples, 'missing_rate': args.missing_rate,
+                   'profile': args.profile, 'seed': args.seed}
+    params_file = os.path.join(args.data, 'params.json')
+    if not os.path.exists(os.path.join(args.data, 'samples.txt')):
+        print(f"Generating synthetic data in {args.data}")
+        generate(args.data, n_samples=args.samples, n_sites=args.sites, multi_samples=args.multi_samples,
+                 missing_rate=args.missing_rate, profile=args.profile, seed=args.seed)
+        with open(params_file, 'w') as f:
+            json.dump(data_params, f)
+    elif os.path.exists(params_file):
+        #an existing data set is described by the parameters it was generated with
+        with open(params_file) as f:
+            data_params = json.load(f)
+    params = {**data_params, 'jobs': args.jobs}
+    with open(os.path.join(args.data, 'samples.txt')) as f:
+        samples = [s.strip() for s in f if s.strip() != '']
+
+    results, stages = run_benchmarks(args.data, samples, args.repeats, args.jobs)
+    run = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(), 'params': params,
+           'results': results, 'stages': stages}
+    compare(run, last_run(args.results, params))
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(run, sort_keys=True) + '\n')
+    print(f"Results appended to {args.results}")
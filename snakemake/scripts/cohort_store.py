@@ -0,0 +1,527 @@
+# cohort_store.py
+"""
+Columnar store of the diffs of a whole cohort, so subsets can be exported and mutations counted
+without re-parsing thousands of text diff files.
+A store is a directory of .npy arrays, memory-mapped when it is read:
+    samples.txt   sample names, one per line, in store order
+    rows.npy      int64 row pointers: the records of sample i are rows[i]:rows[i+1] (CSR layout)
+    alleles.npy   uint8 allele codes ('-' for masked/missing regions, see intervals.py)
+    starts.npy    1 index record starts (int32 when every position fits, else int64)
+    lengths.npy   record lengths (same type as starts)
+Records keep the order of their diff file, so a sample is exported back to its diff file line for line.
+Diff files are parsed whole with NumPy (no per-line Python), a chunk of files per worker.
+New samples are appended in place (see append_store), so growing the cohort only writes the new records.
+
+    python scripts/cohort_store.py -wd PATH/diffs -s cohort.store -j 8
+    python scripts/cohort_store.py -s cohort.store -sl subset.txt -x subset.diff.gz
+    python scripts/cohort_store.py -wd PATH/diffs -sl new_samples.txt -s cohort.store -a
+"""
+
+import io
+import os
+import gzip
+import itertools
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from conversion_cache import temp_path
+from combine_diffs import compression_of, member_writer, write_index, index_path, BUFFER_SIZE
+from merge_contigs_bed import parse_ints, count_digits, put_ints, TAB, NEWLINE
+from tabix_index import is_gzipped
+from intervals import MISSING
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HEADER = ord('>')
+#first bytes of every zstd frame
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+#diff files parsed by one worker task
+FILES_PER_TASK = 256
+#records formatted at once when exporting
+RECORDS_PER_BATCH = 1<<22
+
+
+def read_diff(path):
+    '''
+    Output:
+        the whole (plain, gzip or zstd compressed) diff file as bytes, ending with a line end
+    '''
+    with open(path, 'rb') as f:
+        zstd = f.read(4) == ZSTD_MAGIC
+    if zstd:
+        if zstandard == None:
+            raise Exception(f'{path} is zstd compressed, reading it needs the zstandard package (pip install zstandard)')
+        #a combined diff holds one frame per sample
+        with open(path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True) as r:
+            block = r.read()
+    else:
+        opener = gzip.open if is_gzipped(path) else open
+        with opener(path, 'rb') as f:
+            block = f.read()
+    if block != b'' and not block.endswith(b'\n'):
+        block += b'\n'
+    return block
+
+
+def parse_diff(block, name='diff'):
+    '''
+    parses the '>sample' blocks of a diff file (one per-sample diff or a combined diff)
+    Args:
+        block: bytes of complete lines
+        name: file name used in error messages
+    Output:
+        list of (sample, alleles, starts, lengths) with uint8 and int64 arrays, one per '>sample' header
+        (lines with no length column, 'A\\t123', get length 1)
+    '''
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_end = np.flatnonzero(buf == NEWLINE)
+    line_start = np.concatenate(([0], line_end[:-1] + 1))
+    #blank lines are dropped, windows line ends are cut off
+    line_end = line_end - (buf[np.maximum(line_end - 1, 0)] == ord('\r'))
+    keep = line_end > line_start
+    line_start, line_end = line_start[keep], line_end[keep]
+    headers = np.flatnonzero(buf[line_start] == HEADER)
+    if len(line_start) > 0 and (len(headers) == 0 or headers[0] != 0):
+        raise ValueError(f'{name} does not start with a >sample header')
+
+    records = np.flatnonzero(buf[line_start] != HEADER)
+    begin, end = line_start[records], line_end[records]
+    if np.any(end - begin < 3) or np.any(buf[np.minimum(begin + 1, len(buf) - 1)] != TAB):
+        raise ValueError(f'{name}: diff lines need an allele, a tab and a position')
+    tabs = np.flatnonzero(buf == TAB)
+    #the tab after the position, if the line has one
+    second = np.searchsorted(tabs, begin + 2)
+    second = np.where(second < len(tabs), tabs[np.minimum(second, len(tabs) - 1)], end)
+    has_length = second < end
+    position_end = np.where(has_length, second, end)
+    alleles = buf[begin]
+    try:
+        starts = parse_ints(buf, begin + 2, position_end)
+        lengths = np.ones(len(begin), dtype=np.int64)
+        with_length = np.flatnonzero(has_length)
+        lengths[with_length] = parse_ints(buf, second[with_length] + 1, end[with_length])
+    except ValueError:
+        raise ValueError(f'{name}: diff positions and lengths have to be non-negative integers')
+
+    #records between two headers belong to the first
+    bounds = np.searchsorted(records, headers).tolist() + [len(records)]
+    samples = []
+    for k, h in enumerate(headers.tolist()):
+        sample = block[line_start[h] + 1:line_end[h]].decode().strip()
+        a, b = bounds[k], bounds[k + 1]
+        samples.append((sample, alleles[a:b], starts[a:b], lengths[a:b]))
+    return samples
+
+
+def parse_diffs(diffs, part):
+    '''
+    parses a chunk of diff files and saves their records to one part file (runs in a worker)
+    Args:
+        diffs: list of paths to diff files
+        part: path of the .npz part to write
+    Output:
+        (samples, counts, reach): sample names, number of records of every sample and the largest record end
+    '''
+    samples, counts, alleles, starts, lengths = [], [], [], [], []
+    for diff in diffs:
+        for sample, a, s, l in parse_diff(read_diff(diff), diff):
+            samples.append(sample)
+            counts.append(len(a))
+            alleles.append(a)
+            starts.append(s)
+            lengths.append(l)
+    if samples == []:
+        reach = 0
+        alleles = np.zeros(0, dtype=np.uint8)
+        starts = lengths = np.zeros(0, dtype=np.int64)
+    else:
+        alleles, starts, lengths = np.concatenate(alleles), np.concatenate(starts), np.concatenate(lengths)
+        reach = int((starts + lengths).max(initial=0))
+    np.savez(part, alleles=alleles, starts=starts, lengths=lengths)
+    return samples, counts, reach
+
+
+def load_part(part):
+    with np.load(part) as p:
+        return p['alleles'], p['starts'], p['lengths']
+
+
+def write_store(store, samples, counts, blocks, reach):
+    '''
+    writes a store from record arrays given in sample order, replacing store when it is complete
+    Args:
+        store: path of the store directory
+        samples: list of sample names
+        counts: number of records of every sample
+        blocks: iterable of (alleles, starts, lengths) arrays, together holding the records of samples in order
+        reach: largest record end, picks the position type
+    '''
+    seen = set()
+    duplicates = sorted({sample for sample in samples if sample in seen or seen.add(sample)})
+    if duplicates != []:
+        raise Exception(f'{len(duplicates)} samples are in the cohort more than once: {", ".join(duplicates[:10])}')
+    rows = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+    total = int(rows[-1])
+    position_type = np.int32 if reach < 1 << 31 else np.int64
+    tmp = temp_path(store)
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        np.save(os.path.join(tmp, 'rows.npy'), rows)
+        out = [np.lib.format.open_memmap(os.path.join(tmp, f'{name}.npy'), mode='w+', dtype=dtype, shape=(total,))
+               for name, dtype in (('alleles', np.uint8), ('starts', position_type), ('lengths', position_type))]
+        pos = 0
+        for block in blocks:
+            n = len(block[0])
+            for o, values in zip(out, block):
+                o[pos:pos + n] = values
+            pos += n
+        if pos != total:
+            raise Exception(f'{store}: expected {total} records, got {pos}')
+        for o in out:
+            o.flush()
+        del out
+        with open(os.path.join(tmp, 'samples.txt'), 'w') as f:
+            f.writelines(f'{sample}\n' for sample in samples)
+        if os.path.exists(store):
+            shutil.rmtree(store)
+        os.replace(tmp, store)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def parse_all(diffs, parts_dir, jobs=1):
+    '''
+    parses diff files in chunks, in parallel, into .npz parts in parts_dir
+    Output:
+        (samples, counts, reach, parts): sample names and record counts in file order, the largest record end
+        and the part files holding the records in that order
+    '''
+    size = max(1, min(FILES_PER_TASK, -(-len(diffs) // max(1, jobs))))
+    chunks = [diffs[i:i + size] for i in range(0, len(diffs), size)]
+    parts = [os.path.join(parts_dir, f'part{k}.npz') for k in range(len(chunks))]
+    if jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as pool:
+            results = list(pool.map(parse_diffs, chunks, parts))
+    else:
+        results = [parse_diffs(chunk, part) for chunk, part in zip(chunks, parts)]
+    samples = [sample for r in results for sample in r[0]]
+    counts = [count for r in results for count in r[1]]
+    reach = max((r[2] for r in results), default=0)
+    return samples, counts, reach, parts
+
+
+def ingest(diffs, store, jobs=1):
+    '''
+    builds a store from diff files, parsing chunks of files in parallel
+    Args:
+        diffs: list of paths to per-sample (or combined) diff files, stored in that order
+        store: path of the store directory to write
+        jobs: number of worker processes
+    Output:
+        number of samples stored
+    '''
+    parts_dir = temp_path(f'{store}.parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    try:
+        samples, counts, reach, parts = parse_all(diffs, parts_dir, jobs)
+        write_store(store, samples, counts, (load_part(part) for part in parts), reach)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return len(samples)
+
+
+def append_npy(path, values, keep):
+    '''
+    writes values after the first keep entries of a 1-d .npy file in place and updates the shape in its header
+    (numpy leaves room in the header for the shape to grow)
+    Output:
+        False if the file is not 1-d, values don't fit its type or the new header is longer than the old one
+    '''
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_start = f.tell()
+        if len(shape) != 1 or keep > shape[0] or (len(values) > 0 and np.issubdtype(dtype, np.integer)
+                                                  and int(np.max(values)) > np.iinfo(dtype).max):
+            return False
+        header = io.BytesIO()
+        d = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order, 'shape': (keep + len(values),)}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, d)
+        else:
+            np.lib.format.write_array_header_2_0(header, d)
+        if header.tell() != data_start:
+            return False
+        f.seek(data_start + keep * dtype.itemsize)
+        f.truncate()
+        f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def append_store(store, diffs, jobs=1):
+    '''
+    adds the samples of diff files to the end of an existing store, only the new records are written
+    Args:
+        store: path of a store directory (built like ingest if it doesn't exist)
+        diffs: list of paths to diff files of samples not in the store yet
+        jobs: number of worker processes
+    Output:
+        number of samples added
+    '''
+    if not os.path.exists(store):
+        return ingest(diffs, store, jobs)
+    rows = np.load(os.path.join(store, 'rows.npy'))
+    with open(os.path.join(store, 'samples.txt')) as f:
+        #names written by an append that never got to rows.npy are dropped
+        known = [line.rstrip('\n') for line in f][:len(rows) - 1]
+    parts_dir = temp_path(f'{store}.parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    try:
+        samples, counts, reach, parts = parse_all(diffs, parts_dir, jobs)
+        repeated = sorted(set(known) & set(samples))
+        if repeated != []:
+            raise Exception(f'{len(repeated)} samples are already in {store}: {", ".join(repeated[:10])}')
+        total = int(rows[-1])
+        in_place = True
+        for part in parts:
+            for name, values in zip(('alleles', 'starts', 'lengths'), load_part(part)):
+                in_place = in_place and append_npy(os.path.join(store, f'{name}.npy'), values, total)
+            total += len(values)
+        if in_place:
+            #samples first, rows.npy last: a store is only ever read up to its row pointers
+            new_rows = np.concatenate((rows, rows[-1] + np.cumsum(counts, dtype=np.int64)))
+            tmp = temp_path(os.path.join(store, 'samples.txt'))
+            with open(tmp, 'w') as f:
+                f.writelines(f'{sample}\n' for sample in known + samples)
+            os.replace(tmp, os.path.join(store, 'samples.txt'))
+            tmp = temp_path(os.path.join(store, 'rows.npy'))
+            with open(tmp, 'wb') as f:
+                np.save(f, new_rows)
+            os.replace(tmp, os.path.join(store, 'rows.npy'))
+        else:
+            #positions outgrew int32 (or an old header has no room): rewrite the store
+            cohort = CohortStore(store)
+            old_reach = int((cohort.starts[:rows[-1]].astype(np.int64) + cohort.lengths[:rows[-1]]).max(initial=0))
+            old = cohort.blocks(range(len(known)))
+            write_store(store, known + samples, np.diff(rows).tolist() + counts,
+                        itertools.chain(old, (load_part(part) for part in parts)), max(reach, old_reach))
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return len(samples)
+
+
+class CohortStore:
+    '''
+    memory-mapped view of a store directory
+    '''
+    __slots__ = ('path', 'samples', 'index', 'rows', 'alleles', 'starts', 'lengths')
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = np.load(os.path.join(path, 'rows.npy'))
+        with open(os.path.join(path, 'samples.txt')) as f:
+            self.samples = [line.rstrip('\n') for line in f][:len(self.rows) - 1]
+        self.index = {sample: i for i, sample in enumerate(self.samples)}
+        self.alleles = np.load(os.path.join(path, 'alleles.npy'), mmap_mode='r')
+        self.starts = np.load(os.path.join(path, 'starts.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(path, 'lengths.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.samples)
+
+    def positions(self, samples):
+        '''
+        Args:
+            samples: list of sample names
+        Output:
+            store positions of samples, raises if any is not in the store
+        '''
+        missing = [sample for sample in samples if sample not in self.index]
+        if missing != []:
+            raise Exception(f'{len(missing)} samples not in {self.path}: {", ".join(missing[:10])}')
+        return [self.index[sample] for sample in samples]
+
+    def records(self, sample):
+        '''
+        Output:
+            (alleles, starts, lengths) arrays of one sample
+        '''
+        i = self.positions([sample])[0]
+        a, b = self.rows[i], self.rows[i + 1]
+        return self.alleles[a:b], self.starts[a:b], self.lengths[a:b]
+
+    def blocks(self, positions):
+        '''
+        Output:
+            yields (alleles, starts, lengths) of the samples at positions, consecutive samples are read as one slice
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return
+        breaks = np.flatnonzero(positions[1:] != positions[:-1] + 1) + 1
+        for run in np.split(positions, breaks):
+            a, b = self.rows[run[0]], self.rows[run[-1] + 1]
+            yield self.alleles[a:b], self.starts[a:b], self.lengths[a:b]
+
+
+def format_records(alleles, starts, lengths):
+    '''
+    Output:
+        (text, line_ends): the records as 'allele\\tstart\\tlength\\n' lines in one bytes object
+        and the end offset of every line in it
+    '''
+    if len(alleles) == 0:
+        return b'', np.zeros(0, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    start_len = count_digits(starts)
+    length_len = count_digits(lengths)
+    line_len = 1 + 1 + start_len + 1 + length_len + 1
+    line_ends = np.cumsum(line_len)
+    pos = line_ends - line_len
+    out = np.empty(int(line_ends[-1]), dtype=np.uint8)
+    out[pos] = alleles
+    out[pos + 1] = TAB
+    pos += 2
+    put_ints(out, pos, starts, start_len)
+    pos += start_len
+    out[pos] = TAB
+    pos += 1
+    put_ints(out, pos, lengths, length_len)
+    out[pos + length_len] = NEWLINE
+    return out.tobytes(), line_ends
+
+
+def batches(store, positions):
+    '''
+    splits samples into consecutive batches of about RECORDS_PER_BATCH records
+    '''
+    batch = []
+    size = 0
+    for i in positions:
+        batch.append(i)
+        size += int(store.rows[i + 1] - store.rows[i])
+        if size >= RECORDS_PER_BATCH:
+            yield batch
+            batch = []
+            size = 0
+    if batch != []:
+        yield batch
+
+
+def export(store, samples, output):
+    '''
+    writes samples of a store as one combined diff (with its index, like combine_diffs), reading only their records
+    Args:
+        store: CohortStore or path of a store directory
+        samples: list of sample names in output order (None for every sample)
+        output: path of the combined diff (.gz or .zst to compress)
+    Output:
+        index: list of (sample, offset, size) tuples of the output
+    '''
+    if not isinstance(store, CohortStore):
+        store = CohortStore(store)
+    positions = store.positions(samples) if samples != None else list(range(len(store)))
+    compression = compression_of(output)
+    index = []
+    tmp = temp_path(output)
+    try:
+        with open(tmp, 'wb', buffering=BUFFER_SIZE) as o:
+            for batch in batches(store, positions):
+                #the records of the whole batch are formatted at once, then cut at sample boundaries
+                text, line_ends = format_records(*(np.concatenate(column) for column in zip(*store.blocks(batch))))
+                counts = np.array([store.rows[i + 1] - store.rows[i] for i in batch], dtype=np.int64)
+                line_ends = np.concatenate(([0], line_ends))
+                ends = line_ends[np.cumsum(counts)]
+                begins = line_ends[np.cumsum(counts) - counts]
+                for i, a, b in zip(batch, begins.tolist(), ends.tolist()):
+                    offset = o.tell()
+                    with member_writer(o, compression) as w:
+                        w.write(f'>{store.samples[i]}\n'.encode())
+                        w.write(text[a:b])
+                    index.append((store.samples[i], offset, o.tell() - offset))
+        write_index(output, index)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return index
+
+
+def mutation_counts(store):
+    '''
+    Output:
+        list of (sample, variant records, variant bases, missing records, missing bases) tuples, one per sample
+    '''
+    if not isinstance(store, CohortStore):
+        store = CohortStore(store)
+    counts = np.diff(store.rows)
+    sample_of = np.repeat(np.arange(len(store)), counts)
+    missing = np.asarray(store.alleles) == MISSING
+    lengths = np.asarray(store.lengths, dtype=np.int64)
+    n = len(store)
+    missing_records = np.bincount(sample_of[missing], minlength=n)
+    missing_bases = np.bincount(sample_of[missing], weights=lengths[missing], minlength=n).astype(np.int64)
+    variant_records = counts - missing_records
+    variant_bases = np.bincount(sample_of[~missing], weights=lengths[~missing], minlength=n).astype(np.int64)
+    return list(zip(store.samples, variant_records.tolist(), variant_bases.tolist(), missing_records.tolist(), missing_bases.tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--store', required=True, type=str, help='cohort store directory to build or read')
+    parser.add_argument('-wd', '--working_directory', required=False, type=str, help='path to directory of per-sample diff files to store')
+    parser.add_argument('-sl', '--SRA_list_file', required=False, type=str, help='file with the list of SRA to store or export, in order (default: every .diff in -wd / every stored sample)')
+    parser.add_argument('-x', '--export', required=False, type=str, default=None, help='instead of building the store, write the -sl samples to this combined diff (.gz or .zst to compress)')
+    parser.add_argument('-cnt', '--counts', required=False, type=str, default=None, help='instead of building the store, write the per-sample record and base counts to this tsv')
+    parser.add_argument('-a', '--append', required=False, action='store_true', help='add the -sl diffs to the end of an existing store instead of rebuilding it')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1, help='worker processes parsing diff files')
+    args = parser.parse_args()
+    wd = args.working_directory
+    sl = args.SRA_list_file
+    store = args.store
+
+    samples = None
+    if sl != None:
+        with open(sl) as f:
+            samples = [sra.strip() for sra in f if sra.strip() != '']
+
+    if args.export != None:
+        index = export(store, samples, args.export)
+        print(f"Wrote {len(index)} samples to {args.export} (index: {index_path(args.export)})")
+    elif args.counts != None:
+        with open(args.counts, 'w') as f:
+            f.write('sample\tvariant_records\tvariant_bases\tmissing_records\tmissing_bases\n')
+            f.writelines('\t'.join(map(str, row)) + '\n' for row in mutation_counts(store))
+        print(f"Wrote counts to {args.counts}")
+    else:
+        if wd == None:
+            parser.error('-wd is required to build the store')
+        if samples == None:
+            samples = sorted(name[:-len('.diff')] for name in os.listdir(wd) if name.endswith('.diff'))
+        diffs = []
+        for sra in samples:
+            diff = os.path.join(wd, f'{sra}.diff')
+            if os.path.exists(diff):
+                diffs.append(diff)
+            else:
+                print(f"Diff file for SRA {sra} not found in {wd}")
+        if args.append:
+            n = append_store(store, diffs, args.jobs)
+            print(f"Added {n} samples to {store}")
+        else:
+            n = ingest(diffs, store, args.jobs)
+            print(f"Stored {n} samples in {store}")
@@ -0,0 +1,284 @@
+# combine_diffs.py
+"""
+Streams finished per-sample diff files into the one combined diff that UShER and MAPLE read.
+Diffs are copied in large blocks, never parsed, and the output can be plain, gzip (.gz) or zstd (.zst).
+Next to the output an index '{output}.idx' lists every sample with the byte offset and size of its
+block in the output. Compressed outputs hold every sample as its own gzip member / zstd frame (the file
+is still one valid .gz/.zst), so any sample can be pulled back out with a seek and a read (see extract),
+and new samples are appended to the end without touching the ones already there (see append_diffs).
+"""
+
+import os
+import io
+import gzip
+import argparse
+
+from conversion_cache import temp_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#size of the blocks copied between files
+BUFFER_SIZE = 1<<24
+
+
+def compression_of(path):
+    '''
+    Output:
+        'gzip', 'zstd' or None, from the extension of path
+    '''
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        if zstandard == None:
+            raise Exception(f'{path}: zstd output needs the zstandard package (pip install zstandard)')
+        return 'zstd'
+    return None
+
+
+def index_path(output):
+    return f'{output}.idx'
+
+
+def member_writer(o, compression):
+    '''
+    Args:
+        o: combined output opened in binary mode
+        compression: 'gzip', 'zstd' or None
+    Output:
+        writable file object for one sample block, closing it finishes the block but leaves o open
+    '''
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=o, mode='wb', compresslevel=6, mtime=0)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(o, closefd=False)
+    return NoClose(o)
+
+
+class NoClose(io.RawIOBase):
+    '''
+    passes writes through to o without closing it, the uncompressed counterpart of a gzip member
+    '''
+    def __init__(self, o):
+        self.o = o
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.o.write(b)
+
+
+def copy_diff(diff, w):
+    '''
+    copies one diff file into w in large blocks
+    Args:
+        diff: path to the diff file
+        w: writable file object
+    Output:
+        sample: name from the '>sample' header of the diff
+    '''
+    with open(diff, 'rb') as f:
+        header = f.readline()
+        if not header.startswith(b'>'):
+            raise Exception(f'{diff} does not start with a >sample header')
+        w.write(header)
+        last = header
+        for block in iter(lambda: f.read(BUFFER_SIZE), b''):
+            #the index has one entry per file, so a file holding several samples would hide all but the first
+            if b'\n>' in block or (last.endswith(b'\n') and block.startswith(b'>')):
+                raise Exception(f'{diff} has more than one >sample header')
+            w.write(block)
+            last = block
+        #the next sample's header has to start on its own line
+        if not last.endswith(b'\n'):
+            w.write(b'\n')
+    return header[1:].strip().decode()
+
+
+def combine_diffs(diffs, output):
+    '''
+    writes all diffs into output and the index of their blocks to '{output}.idx'
+    Args:
+        diffs: list of paths to per-sample diff files, written in that order
+        output: path to the combined diff (.gz or .zst to compress)
+    Output:
+        index: list of (sample, offset, size) tuples, one per diff
+    '''
+    compression = compression_of(output)
+    index = []
+    seen = set()
+    tmp = temp_path(output)
+    try:
+        with open(tmp, 'wb', buffering=BUFFER_SIZE) as o:
+            for diff in diffs:
+                offset = o.tell()
+                with member_writer(o, compression) as w:
+                    sample = copy_diff(diff, w)
+                if sample in seen:
+                    raise Exception(f'{sample} is in the diffs more than once ({diff})')
+                seen.add(sample)
+                index.append((sample, offset, o.tell() - offset))
+        write_index(output, index)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return index
+
+
+def append_diffs(diffs, output):
+    '''
+    appends diffs to an existing combined diff (and its index) in place, without reading the samples already in it
+    Args:
+        diffs: list of paths to per-sample diff files, appended in that order
+        output: path to a combined diff made by combine_diffs (made like combine_diffs if it doesn't exist)
+    Output:
+        index: list of (sample, offset, size) tuples of the appended samples
+    '''
+    if not os.path.exists(output):
+        return combine_diffs(diffs, output)
+    known = read_index(output)
+    compression = compression_of(output)
+    index = []
+    with open(output, 'r+b') as o:
+        #blocks are appended after the last indexed sample, so what an interrupted append left behind is overwritten
+        end = max((offset + size for offset, size in known.values()), default=0)
+        o.truncate(end)
+        o.seek(end)
+        try:
+            for diff in diffs:
+                offset = o.tell()
+                with member_writer(o, compression) as w:
+                    sample = copy_diff(diff, w)
+                if sample in known:
+                    raise Exception(f'{sample} is already in {output}')
+                known[sample] = (offset, o.tell() - offset)
+                index.append((sample, offset, o.tell() - offset))
+        except BaseException:
+            o.truncate(end)
+            raise
+    with open(index_path(output), 'a') as f:
+        f.writelines(f'{sample}\t{offset}\t{size}\n' for sample, offset, size in index)
+    return index
+
+
+def write_index(output, index):
+    tmp = temp_path(index_path(output))
+    with open(tmp, 'w') as f:
+        f.write('sample\toffset\tsize\n')
+        f.writelines(f'{sample}\t{offset}\t{size}\n' for sample, offset, size in index)
+    os.replace(tmp, index_path(output))
+
+
+def read_index(combined):
+    '''
+    Output:
+        index: dictionary where key is sample and value is (offset, size) of its block in combined
+    '''
+    index = {}
+    with open(index_path(combined)) as f:
+        next(f)
+        for line in f:
+            sample, offset, size = line.rstrip('\n').split('\t')
+            if sample in index:
+                raise Exception(f'{sample} is in {index_path(combined)} more than once')
+            index[sample] = (int(offset), int(size))
+    return index
+
+
+def read_block(combined, offset, size, compression):
+    '''
+    Output:
+        the uncompressed diff text (bytes) of the sample stored at offset
+    '''
+    with open(combined, 'rb') as f:
+        f.seek(offset)
+        block = f.read(size)
+    if compression == 'gzip':
+        return gzip.decompress(block)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj().decompress(block)
+    return block
+
+
+def extract(combined, samples, output):
+    '''
+    writes a subset of a combined diff (with its own index) using the index of combined, without reading the other samples
+    Args:
+        combined: path to a combined diff made by combine_diffs
+        samples: list of sample names to keep, in output order
+        output: path to the subset diff (.gz or .zst to compress)
+    Output:
+        index: list of (sample, offset, size) tuples of the subset
+    '''
+    source = read_index(combined)
+    missing = [sample for sample in samples if sample not in source]
+    if missing != []:
+        raise Exception(f'{len(missing)} samples not in {combined}: {", ".join(missing[:10])}')
+    in_compression = compression_of(combined)
+    compression = compression_of(output)
+    index = []
+    tmp = temp_path(output)
+    try:
+        with open(tmp, 'wb', buffering=BUFFER_SIZE) as o:
+            for sample in samples:
+                offset, size = source[sample]
+                start = o.tell()
+                if in_compression == compression:
+                    #same format: copy the stored block as it is
+                    with open(combined, 'rb') as f:
+                        f.seek(offset)
+                        o.write(f.read(size))
+                else:
+                    with member_writer(o, compression) as w:
+                        w.write(read_block(combined, offset, size, in_compression))
+                index.append((sample, start, o.tell() - start))
+        write_index(output, index)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-wd', '--working_directory', required=False, type=str, help='path to directory of per-sample diff files')
+    parser.add_argument('-sl', '--SRA_list_file', required=False, type=str, help='file with the list of SRA to combine, in order (default: every .diff in -wd)')
+    parser.add_argument('-o', '--output', required=True, type=str, help='combined diff to write, end with .gz or .zst to compress it')
+    parser.add_argument('-a', '--append', required=False, action='store_true', help='append the -sl samples to an existing -o combined diff instead of rewriting it')
+    parser.add_argument('-x', '--extract_from', required=False, type=str, default=None, help='instead of combining -wd, copy the -sl samples out of this combined diff')
+    args = parser.parse_args()
+    wd = args.working_directory
+    sl = args.SRA_list_file
+    output = args.output
+
+    samples = None
+    if sl != None:
+        with open(sl) as f:
+            samples = [sra.strip() for sra in f if sra.strip() != '']
+
+    if args.extract_from != None:
+        if samples == None:
+            parser.error('-x needs -sl with the samples to extract')
+        index = extract(args.extract_from, samples, output)
+    else:
+        if wd == None:
+            parser.error('-wd is required to combine diffs')
+        if samples == None:
+            samples = sorted(name[:-len('.diff')] for name in os.listdir(wd) if name.endswith('.diff'))
+        diffs = []
+        for sra in samples:
+            diff = os.path.join(wd, f'{sra}.diff')
+            if os.path.exists(diff):
+                diffs.append(diff)
+            else:
+                print(f"Diff file for SRA {sra} not found in {wd}")
+        if args.append:
+            index = append_diffs(diffs, output)
+        else:
+            index = combine_diffs(diffs, output)
+    print(f"Wrote {len(index)} samples to {output} (index: {index_path(output)})")
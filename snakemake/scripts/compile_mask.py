@@ -0,0 +1,60 @@
+# compile_mask.py
+"""
+Compiles the species mask bed file (-smf) once into a binary mask index,
+so the converters memory-map it instead of re-parsing the bed file for every sample.
+The index is a .npy file with two int64 rows: the starts (1 index) and the lengths of
+the merged, sorted masked regions. Workers that map the same file share its pages.
+"""
+
+import argparse
+
+import numpy as np
+
+from vcf_to_diff_script import mask_TB
+
+
+def merge_regions(masks):
+    '''
+    merges overlapping and touching masked regions
+    Args:
+        masks: Intervals of masked regions sorted by start
+    Output:
+        (starts, lengths): numpy int64 arrays of the merged regions
+    '''
+    starts = np.asarray(masks.starts, dtype=np.int64)
+    ends = starts + np.asarray(masks.lengths, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, ends
+    #a region starts a new merged region when it starts after everything before it has ended
+    reach = np.maximum.accumulate(ends)
+    first = np.concatenate(([True], starts[1:] > reach[:-1]))
+    group = np.cumsum(first) - 1
+    merged_starts = starts[first]
+    merged_ends = np.zeros(len(merged_starts), dtype=np.int64)
+    np.maximum.at(merged_ends, group, ends)
+    return merged_starts, merged_ends - merged_starts
+
+
+def compile_mask(smf, output):
+    '''
+    Args:
+        smf: bed file of commonly masked regions of genome
+        output: path of the mask index to write (.npy)
+    Output:
+        number of merged regions written
+    '''
+    starts, lengths = merge_regions(mask_TB(smf))
+    np.save(output, np.vstack((starts, lengths)))
+    return len(starts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-smf', '--species_maskfile', required=True, type=str, help='path to bed file of commonly masked regions of genome')
+    parser.add_argument('-o', '--output', required=True, type=str, help='mask index to write, pass it to -smf of the converters (must end with .npy)')
+    args = parser.parse_args()
+
+    if not args.output.endswith('.npy'):
+        parser.error('output must end with .npy')
+    n = compile_mask(args.species_maskfile, args.output)
+    print(f"Wrote {n} merged masked regions to {args.output}")
@@ -0,0 +1,159 @@
+# contig_offsets.py
+"""
+Contig offset table shared by the BED and VCF mergers.
+Every contig is given the number that has to be added to its positions so that all contigs
+are laid end to end (in reference order) as one big chromosome.
+The same number is added to 0-indexed BED and 1-indexed VCF positions, so both stay in their own indexing.
+"""
+
+import gzip
+
+#name of the one big chromosome all contigs are merged into
+merged_contig = 'NC_07281X.1'
+
+#C. auris reference contig lengths, used when no .fai or VCF header is given
+default_contig_lengths = [
+    ('NC_072812.1', 3148135),
+    ('NC_072813.1', 2554418),
+    ('NC_072814.1', 2336890),
+    ('NC_072815.1', 1318327),
+    ('NC_072816.1', 1007026),
+    ('NC_072817.1', 1004684),
+    ('NC_072818.1', 880293),
+]
+
+
+def offsets_from_lengths(lengths):
+    '''
+    turns contig lengths into offsets
+    Args:
+        lengths: a list of (contig, length) tuples in reference order
+    Output:
+        offsets: dictionary where key is contig name and value is the sum of the lengths of all previous contigs
+    '''
+    offsets = {}
+    total = 0
+    for contig, length in lengths:
+        offsets[contig] = total
+        total += length
+    return offsets
+
+
+def read_fai(fai):
+    '''
+    reads contig lengths from a samtools faidx index of the reference fasta
+    Args:
+        fai: path to reference.fasta.fai (columns: name, length, ...)
+    Output:
+        lengths: a list of (contig, length) tuples in reference order
+    '''
+    lengths = []
+    with open(fai) as f:
+        for line in f:
+            line = line.split('\t')
+            if len(line) > 1:
+                lengths.append((line[0], int(line[1])))
+    return lengths
+
+
+def read_fasta_lengths(fasta):
+    '''
+    reads contig lengths from the reference fasta itself (compressed or not), for when it has no .fai yet
+    Args:
+        fasta: path to reference.fasta
+    Output:
+        lengths: a list of (contig, length) tuples in reference order (names cut at the first space, like samtools faidx)
+    '''
+    with open(fasta, 'rb') as test:
+        binary = test.read(2) == b'\x1f\x8b'
+    lengths = []
+    with (gzip.open(fasta, 'rb') if binary else open(fasta, 'rb')) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                lengths.append([line[1:].split()[0].decode(), 0])
+            elif lengths != []:
+                lengths[-1][1] += len(line.rstrip())
+    return [(contig, length) for contig, length in lengths]
+
+
+def read_vcf_contigs(vcf):
+    '''
+    reads contig lengths from the ##contig header lines of a VCF (compressed or not)
+    Args:
+        vcf: path to VCF
+    Output:
+        lengths: a list of (contig, length) tuples in header order
+    '''
+    with open(vcf, 'rb') as test:
+        binary = test.read(2) == b'\x1f\x8b'
+    lengths = []
+    with (gzip.open(vcf, 'rt') if binary else open(vcf, 'rt')) as v:
+        for line in v:
+            if not line.startswith('##'):
+                break
+            if line.startswith('##contig=<'):
+                fields = {}
+                for field in line.strip()[len('##contig=<'):-1].split(','):
+                    key, _, value = field.partition('=')
+                    fields[key] = value
+                if 'ID' in fields and 'length' in fields:
+                    lengths.append((fields['ID'], int(fields['length'])))
+    return lengths
+
+
+def load_lengths(fai=None, vcf=None):
+    '''
+    picks where contig lengths come from: the .fai if given, otherwise the ##contig lines of vcf if given,
+    otherwise the built-in C. auris contig lengths
+    Args:
+        fai: path to reference.fasta.fai
+        vcf: path to a VCF whose header has ##contig lines
+    Output:
+        lengths: a list of (contig, length) tuples in reference order
+    '''
+    if fai != None:
+        lengths = read_fai(fai)
+    elif vcf != None:
+        lengths = read_vcf_contigs(vcf)
+    else:
+        lengths = default_contig_lengths
+    if lengths == []:
+        raise Exception(f'no contig lengths found in {fai if fai != None else vcf}')
+    return lengths
+
+
+def scatter_intervals(lengths, shards=0):
+    '''
+    splits the genome into shards for scattered variant calling
+    Args:
+        lengths: a list of (contig, length) tuples in reference order
+        shards: number of shards of about the same number of bases (long contigs are cut), 0 for one shard per contig
+    Output:
+        list of shards in reference order, each a list of (contig, start, end) intervals (1 index, end inclusive like GATK -L)
+    '''
+    if shards <= 0:
+        return [[(contig, 1, length)] for contig, length in lengths]
+    total = sum(length for contig, length in lengths)
+    size = -(-total // shards)
+    intervals = [[]]
+    room = size
+    for contig, length in lengths:
+        start = 1
+        while start <= length:
+            if room == 0:
+                intervals.append([])
+                room = size
+            end = min(length, start + room - 1)
+            intervals[-1].append((contig, start, end))
+            room -= end - start + 1
+            start = end + 1
+    return intervals
+
+
+def load_offsets(fai=None, vcf=None):
+    '''
+    builds the offset table once (see load_lengths for where the contig lengths come from)
+    Output:
+        offsets: dictionary where key is contig name and value is the number added to its positions
+    '''
+    return offsets_from_lengths(load_lengths(fai, vcf))
@@ -0,0 +1,118 @@
+# conversion_cache.py
+"""
+Per-sample conversion cache used by the batch drivers.
+Every output gets a '{output}.cache.json' sidecar holding a key made from the sha256 of its inputs
+(vcf, bedgraph, mask, ...) and the parameters it was made with. A sample is only skipped when the
+output exists and the key still matches, so changed inputs or parameters are recomputed.
+Outputs are written to a temporary file and renamed into place, so an interrupted run never
+leaves a truncated output behind that looks finished.
+"""
+
+import os
+import json
+import hashlib
+
+#bump when the conversion itself changes so every cached output is recomputed
+CACHE_VERSION = 6
+
+
+def file_digest(path, known=None):
+    '''
+    sha256 of a file's content
+    Args:
+        path: path to the file
+        known: digest recorded by an earlier run, reused without reading the file if size and mtime did not change
+    Output:
+        digest: dictionary with sha256, size and mtime_ns of the file
+    '''
+    st = os.stat(path)
+    if known != None and known.get('size') == st.st_size and known.get('mtime_ns') == st.st_mtime_ns:
+        return known
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''):
+            h.update(block)
+    return {'sha256': h.hexdigest(), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def sidecar_path(output):
+    return f'{output}.cache.json'
+
+
+def read_sidecar(output):
+    '''
+    Output:
+        the sidecar of output as a dictionary ({} if there is none or it can't be read)
+    '''
+    try:
+        with open(sidecar_path(output)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cache_key(digests, params):
+    '''
+    Args:
+        digests: dictionary of input name -> file_digest
+        params: dictionary of parameters (must be JSON serialisable)
+    Output:
+        key: hex sha256 of the input contents, the parameters and CACHE_VERSION
+    '''
+    content = {
+        'version': CACHE_VERSION,
+        'inputs': {name: digests[name]['sha256'] for name in sorted(digests)},
+        'params': params,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def check(output, inputs, params):
+    '''
+    decides if output is still up to date
+    Args:
+        output: path to the output file
+        inputs: dictionary of input name -> path (None paths are ignored)
+        params: dictionary of parameters the output depends on
+    Output:
+        (fresh, key, digests): fresh is True if output exists unchanged since it was made from the same inputs 
+                               and parameters, key and digests are passed to record once the output is (re)made
+    '''
+    sidecar = read_sidecar(output)
+    known = sidecar.get('inputs', {})
+    digests = {name: file_digest(path, known.get(name)) for name, path in inputs.items() if path != None}
+    key = cache_key(digests, params)
+    fresh = sidecar.get('key') == key and output_stat(output) == sidecar.get('output')
+    #an input was touched but its content is the same, remember the new mtime so it isn't hashed again next time
+    if fresh and digests != known:
+        record(output, key, digests, params)
+    return fresh, key, digests
+
+
+def record(output, key, digests, params):
+    '''
+    writes the sidecar of a finished output (write-then-rename, like the output itself)
+    '''
+    tmp = temp_path(sidecar_path(output))
+    with open(tmp, 'w') as f:
+        json.dump({'key': key, 'inputs': digests, 'params': params, 'output': output_stat(output)}, f, sort_keys=True)
+    os.replace(tmp, sidecar_path(output))
+
+
+def output_stat(output):
+    '''
+    size and mtime of an output, so an output changed after it was made is not trusted (None if it doesn't exist)
+    '''
+    try:
+        st = os.stat(output)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def temp_path(path):
+    '''
+    temporary name next to path (same directory, so the final os.replace is atomic)
+    '''
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.tmp{os.getpid()}')
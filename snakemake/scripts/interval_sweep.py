@@ -0,0 +1,147 @@
+# interval_sweep.py
+"""
+Sorted-merge operations on streams of diff records, used by the masking stages.
+Every stream is an iterable of (allele code, start, length) records sorted by start, and every operation
+walks its inputs once, front to back, holding only records that still overlap what comes next
+(subtract and override raise on input that is out of order instead of skipping masks):
+    coalesce:  union of overlapping records of the same allele
+    subtract:  the parts of records not covered by regions
+    override:  regions (and records of the same allele) win over every other record they overlap
+Records that touch without overlapping are kept as separate records, like the diff files always had them.
+"""
+
+import heapq
+from collections import deque
+
+from intervals import MISSING
+
+
+def start_of(record):
+    return record[1]
+
+
+def coalesce(records):
+    '''
+    unions overlapping records of the same allele into one record
+    Args:
+        records: start-sorted iterable of (allele code, start, length) records
+    Output:
+        yields [allele code, start, length] records, overlapping records of one allele combined
+    '''
+    prev = None
+    for allele, start, length in records:
+        if prev != None and allele == prev[0] and start < prev[1] + prev[2]:
+            prev[2] = max(prev[2], start + length - prev[1])
+        else:
+            if prev != None:
+                yield prev
+            prev = [allele, start, length]
+    if prev != None:
+        yield prev
+
+
+def subtract(records, regions):
+    '''
+    removes the parts of records covered by regions, a record is split when a region falls inside it
+    Args:
+        records: start-sorted iterable of (allele code, start, length) records
+        regions: start-sorted iterable of (allele code, start, length) regions (the allele is ignored)
+    Output:
+        yields the uncovered parts of records, records no region touches are yielded as they are
+    '''
+    regions = iter(regions)
+    upcoming = next(regions, None)
+    #regions that can still overlap the coming records
+    window = deque()
+    last = None
+    for record in records:
+        allele, start, length = record
+        end = start + length
+        #the window drops regions that end before a record, a record before that would miss them
+        if last != None and start < last:
+            raise Exception(f'records are not sorted by start: {start} after {last}')
+        last = start
+        while window and window[0][1] + window[0][2] <= start:
+            window.popleft()
+        while upcoming != None and upcoming[1] < end:
+            if upcoming[1] + upcoming[2] > start:
+                window.append(upcoming)
+            region = next(regions, None)
+            if region != None and region[1] < upcoming[1]:
+                raise Exception(f'regions are not sorted by start: {region[1]} after {upcoming[1]}')
+            upcoming = region
+        if not window or window[0][1] >= end:
+            yield record
+            continue
+        pos = start
+        for region in window:
+            if region[1] >= end:
+                break
+            if region[1] > pos:
+                yield [allele, pos, region[1] - pos]
+            pos = max(pos, region[1] + region[2])
+            if pos >= end:
+                break
+        if pos < end:
+            yield [allele, pos, end - pos]
+
+
+def first_wins(records):
+    '''
+    removes the parts of records already covered by an earlier record (e.g. two vcf records at one position)
+    Args:
+        records: start-sorted iterable of (allele code, start, length) records
+    '''
+    covered = None
+    for allele, start, length in records:
+        end = start + length
+        if covered != None and start < covered:
+            start = covered
+        if end > start:
+            yield [allele, start, end - start]
+            covered = end if covered == None else max(covered, end)
+
+
+def clusters(records):
+    '''
+    splits a start-sorted stream into groups of records that overlap each other (directly or through others)
+    Output:
+        yields lists of records, no record of a group overlaps a record of another group
+    '''
+    cluster = []
+    end = None
+    for record in records:
+        if cluster and record[1] < cluster[-1][1]:
+            raise Exception(f'records are not sorted by start: {record[1]} after {cluster[-1][1]}')
+        record_end = record[1] + record[2]
+        if cluster and record[1] >= end:
+            yield cluster
+            cluster = []
+        if not cluster:
+            end = record_end
+        elif record_end > end:
+            end = record_end
+        cluster.append(record)
+    if cluster:
+        yield cluster
+
+
+def override(records, regions, allele=MISSING):
+    '''
+    lays regions over records: every position covered by a region or by a record of allele ends up in one
+    allele record, all other records are cut where they are covered (and an earlier record wins over a later one)
+    Args:
+        records: start-sorted iterable of (allele code, start, length) records
+        regions: start-sorted iterable of (allele code, start, length) regions of allele
+        allele: allele code of the regions, records of this allele are merged with them
+    Output:
+        yields start-sorted records
+    '''
+    #regions come before records starting at the same position
+    for cluster in clusters(heapq.merge(regions, records, key=start_of)):
+        if len(cluster) == 1:
+            yield cluster[0]
+            continue
+        high = list(coalesce(r for r in cluster if r[0] == allele))
+        low = first_wins(r for r in cluster if r[0] != allele)
+        yield from heapq.merge(high, subtract(low, high), key=start_of)
@@ -0,0 +1,124 @@
+# intervals.py
+"""
+Compact container for diff records and mask regions.
+Every record is an int start (1 index), an int length and a one byte allele code
+(the allele character, '-' for masked/missing regions) kept in flat arrays,
+so positions are parsed once and strings are only made when the diff file is written.
+The conversion stages pass records along as [allele code, start, length] lists, one at a time.
+"""
+
+from array import array
+
+#allele code of masked/missing positions
+MISSING = ord('-')
+
+
+class Intervals:
+    '''
+    array-backed list of (allele code, start, length) records
+    '''
+    __slots__ = ('alleles', 'starts', 'lengths')
+
+    def __init__(self):
+        self.alleles = bytearray()
+        self.starts = array('q')
+        self.lengths = array('q')
+
+    @classmethod
+    def from_records(cls, records):
+        '''
+        collects [allele code, start, length] records (e.g. from records_to_diff) into an Intervals
+        '''
+        intervals = cls()
+        for allele, start, length in records:
+            intervals.append(allele, start, length)
+        return intervals
+
+    @classmethod
+    def from_regions(cls, starts, ends, allele=MISSING):
+        '''
+        builds masks from sorted region starts and (not inclusive) ends, e.g. the arrays from mask_low_depth
+        Args:
+            starts: iterable of region starts
+            ends: iterable of region ends
+            allele: allele code given to every region
+        '''
+        intervals = cls()
+        for start, end in zip(starts, ends):
+            intervals.append(allele, int(start), int(end) - int(start))
+        return intervals
+
+    @classmethod
+    def from_arrays(cls, starts, lengths, allele=MISSING):
+        '''
+        wraps existing start and length arrays without copying them (e.g. a memory-mapped compiled mask)
+        Args:
+            starts: array of region starts
+            lengths: array of region lengths
+            allele: allele code given to every region
+        '''
+        intervals = cls.__new__(cls)
+        intervals.starts = starts
+        intervals.lengths = lengths
+        intervals.alleles = bytes([allele]) * len(starts)
+        return intervals
+
+    def append(self, allele, start, length):
+        '''
+        Args:
+            allele: allele code (int) or allele character (str)
+            start: first position of the record
+            length: number of positions covered by the record
+        '''
+        if type(allele) == str:
+            allele = ord(allele)
+        self.alleles.append(allele)
+        self.starts.append(start)
+        self.lengths.append(length)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return [self.alleles[i], self.starts[i], self.lengths[i]]
+
+    def __iter__(self):
+        return zip(self.alleles, self.starts, self.lengths)
+
+    def sort(self):
+        '''
+        puts the records in start order in place, records with the same start keep their order
+        '''
+        starts = self.starts
+        if all(starts[i] <= starts[i + 1] for i in range(len(starts) - 1)):
+            return
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        self.alleles = bytearray(self.alleles[i] for i in order)
+        self.starts = array('q', (starts[i] for i in order))
+        self.lengths = array('q', (self.lengths[i] for i in order))
+
+    def total_length(self):
+        return sum(self.lengths)
+
+    def write(self, o, sample=None):
+        '''
+        writes the records in diff format (see write_records)
+        '''
+        write_records(o, self, sample)
+
+
+#allele code -> allele character, for writing
+allele_chars = [chr(c) for c in range(256)]
+
+
+def write_records(o, records, sample=None):
+    '''
+    writes records in diff format as they arrive, the only place records are turned into strings
+    Args:
+        o: open text file
+        records: iterable of (allele code, start, length) records
+        sample: if given, the '>sample' header line is written first
+    '''
+    if sample != None:
+        o.write(f'>{sample}\n')
+    o.writelines(f'{allele_chars[a]}\t{s}\t{l}\n' for a, s, l in records)
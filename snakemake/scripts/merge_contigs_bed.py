@@ -1,75 +1,261 @@
 # merge_contigs_bed.py
 """
-A program designed to modify the contig positions in a bed file 
+A program designed to modify the contig positions in a bed file
 to start from the end of the previous contig.
+The bed file is rewritten in blocks: the columns of a whole block of lines are parsed, offset and
+formatted as NumPy arrays, so no line is handled on its own (per-base bedgraphs are tens of millions of lines).
+Input and output can be gzipped (the output is compressed when its name ends in .gz).
 """
 
+import gzip
 import argparse
 
-#this script requires bed files
-parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--input', required=True, type=str,help='input bed file to convert')
-parser.add_argument('-o', '--output', required=True, type=str, help='output bed file with merged contigs')
-
-
-args = parser.parse_args()
-input_file = args.input
-output_file = args.output
-
-
-def merge_contigs(input, output):
-    new_start_pos_2 = 3148135
-    new_start_pos_3 = new_start_pos_2 + 2554418
-    new_start_pos_4 = new_start_pos_3 + 2336890
-    new_start_pos_5 = new_start_pos_4 + 1318327
-    new_start_pos_6 = new_start_pos_5 + 1007026
-    new_start_pos_7 = new_start_pos_6 + 1004684
-        
-    with open(input, 'r') as infile, open(output, 'w') as outfile:
-        for line in infile:
-            columns = line.strip().split('\t')
-
-            contig = columns[0]
-            start_pos = int(columns[1])
-            end_pos = int(columns[2])
-            coverage = columns[3]
-
-            if contig == 'NC_072812.1':
-                contig = 'NC_07281X.1'
-        
-            elif contig == 'NC_072813.1':
-                contig = 'NC_07281X.1'
-                start_pos += new_start_pos_2
-                end_pos += new_start_pos_2
-                
-            elif contig == 'NC_072814.1':
-                contig = 'NC_07281X.1'
-                start_pos += new_start_pos_3
-                end_pos += new_start_pos_3
-            
-            elif contig == 'NC_072815.1':
-                contig = 'NC_07281X.1'
-                start_pos += new_start_pos_4
-                end_pos += new_start_pos_4
-                
-            elif contig == 'NC_072816.1':
-                contig = 'NC_07281X.1'
-                start_pos += new_start_pos_5
-                end_pos += new_start_pos_5
-                
-            elif contig == 'NC_072817.1':
-                contig = 'NC_07281X.1'
-                start_pos += new_start_pos_6
-                end_pos += new_start_pos_6
-            
-            elif contig == 'NC_072818.1':
-                contig = 'NC_07281X.1'
-                start_pos += new_start_pos_7
-                end_pos += new_start_pos_7
-                
-            outfile.write(f"{contig}\t{start_pos}\t{end_pos}\t{coverage}\n")
+import numpy as np
+
+from contig_offsets import load_offsets, merged_contig
+from tabix_index import is_gzipped
+
+TAB = ord('\t')
+NEWLINE = ord('\n')
+ZERO = ord('0')
+#10, 100, ... for counting digits
+POWERS = 10 ** np.arange(1, 19, dtype=np.int64)
+
+
+def read_blocks(infile, chunk_bytes=1<<24):
+    '''
+    Output:
+        yields blocks of roughly chunk_bytes bytes that end at a line end
+    '''
+    rest = b''
+    while True:
+        block = infile.read(chunk_bytes)
+        if not block:
+            break
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        rest = block[cut:]
+        if cut > 0:
+            yield block[:cut]
+    if rest.strip() != b'':
+        yield rest + b'\n'
+
+
+def parse_ints(buf, begin, end):
+    '''
+    parses the decimal fields buf[begin:end] of every line at once, one digit column at a time
+    Args:
+        buf: uint8 array of the block
+        begin, end: arrays of field bounds (end not inclusive)
+    Output:
+        int64 array of the values
+    '''
+    width = end - begin
+    if len(width) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if np.any(width == 0):
+        raise ValueError('bed positions have to be non-negative integers')
+    values = np.zeros(len(begin), dtype=np.int64)
+    #every field has at least the shortest width, only the longer ones need masking after that
+    shortest = int(width.min())
+    for j in range(int(width.max())):
+        if j < shortest:
+            #uint8 wraps around below '0', so one comparison catches every non-digit
+            digits = buf[begin + j] - np.uint8(ZERO)
+            bad = np.any(digits > 9)
+            values = values * 10 + digits
+        else:
+            active = np.flatnonzero(j < width)
+            digits = buf[begin[active] + j] - np.uint8(ZERO)
+            bad = np.any(digits > 9)
+            values[active] = values[active] * 10 + digits
+        if bad:
+            raise ValueError('bed positions have to be non-negative integers')
+    return values
+
+
+def count_digits(values):
+    return np.searchsorted(POWERS, values, side='right') + 1
+
+
+def put_ints(out, pos, values, lengths):
+    '''
+    writes the ascii digits of values to out[pos:pos+lengths], last digit first
+    '''
+    last = pos + lengths - 1
+    #32 bit division is a lot faster, and positions almost always fit
+    if values.max(initial=0) < 1 << 32:
+        values = values.astype(np.uint32)
+    shortest = int(lengths.min())
+    for k in range(int(lengths.max())):
+        rest = values // 10
+        digits = (values - rest * 10).astype(np.uint8)
+        values = rest
+        if k < shortest:
+            out[last - k] = digits + ZERO
+        else:
+            active = np.flatnonzero(k < lengths)
+            out[last[active] - k] = digits[active] + ZERO
+
+
+def put_fields(out, pos, buf, begin, lengths):
+    '''
+    copies the fields buf[begin:begin+lengths] to out[pos:pos+lengths]
+    '''
+    for k in range(int(lengths.max(initial=0))):
+        active = np.flatnonzero(k < lengths)
+        out[pos[active] + k] = buf[begin[active] + k]
+
+
+def format_lines(buf, prefix, starts, ends, cov_begin, cov_end):
+    '''
+    writes 'prefix start\\tend\\tcoverage\\n' lines into one buffer
+    Args:
+        buf: uint8 array of the block the coverage fields are copied from
+        prefix: bytes written before the start of every line (contig and tab)
+        starts, ends: int64 arrays of positions
+        cov_begin, cov_end: bounds of the coverage fields in buf
+    Output:
+        bytes of the lines
+    '''
+    start_len = count_digits(starts)
+    end_len = count_digits(ends)
+    cov_len = cov_end - cov_begin
+    line_len = len(prefix) + start_len + 1 + end_len + 1 + cov_len + 1
+    line_off = np.cumsum(line_len) - line_len
+    out = np.empty(int(line_len.sum()), dtype=np.uint8)
+    for k, c in enumerate(prefix):
+        out[line_off + k] = c
+    pos = line_off + len(prefix)
+    put_ints(out, pos, starts, start_len)
+    pos += start_len
+    out[pos] = TAB
+    pos += 1
+    put_ints(out, pos, ends, end_len)
+    pos += end_len
+    out[pos] = TAB
+    pos += 1
+    #coverage fields are copied as they are
+    put_fields(out, pos, buf, cov_begin, cov_len)
+    out[pos + cov_len] = NEWLINE
+    return out.tobytes()
+
+
+def parse_block(block):
+    '''
+    finds the columns of a block of complete bed lines
+    Args:
+        block: bytes of complete lines
+    Output:
+        (buf, runs, starts, ends, cov_begin, cov_end): the block as a uint8 array, (contig, first line, last line + 1)
+        for every run of lines of one contig, the start and end positions and the bounds of the coverage fields in buf
+    '''
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_end = np.flatnonzero(buf == NEWLINE)
+    line_start = np.concatenate(([0], line_end[:-1] + 1))
+    #blank lines are dropped
+    keep = line_end > line_start
+    line_start, line_end = line_start[keep], line_end[keep]
+    if len(line_start) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return buf, [], empty, empty, empty, empty
+    tabs = np.flatnonzero(buf == TAB)
+    first = np.searchsorted(tabs, line_start)
+    if first[-1] + 2 >= len(tabs) or np.any(tabs[np.minimum(first + 2, len(tabs) - 1)] > line_end):
+        raise ValueError('bed lines need at least 4 tab separated columns')
+    tab1, tab2, tab3 = tabs[first], tabs[first + 1], tabs[first + 2]
+    #coverage is the 4th column: up to the next tab or the line end (without a windows line end)
+    cov_end = line_end.copy()
+    has_more = first + 3 < len(tabs)
+    more = np.flatnonzero(has_more)
+    cut = tabs[first[more] + 3] < line_end[more]
+    cov_end[more[cut]] = tabs[first[more[cut]] + 3]
+    cov_end -= buf[cov_end - 1] == ord('\r')
+
+    starts = parse_ints(buf, tab1 + 1, tab2)
+    ends = parse_ints(buf, tab2 + 1, tab3)
+
+    #the lines of one contig come together, find where the contig name changes
+    name_len = tab1 - line_start
+    differs = name_len[1:] != name_len[:-1]
+    for k in range(int(name_len.max())):
+        differs |= (k < name_len[1:]) & (buf[line_start[1:] + k] != buf[line_start[:-1] + k])
+    bounds = np.concatenate(([0], np.flatnonzero(differs) + 1, [len(line_start)])).tolist()
+    runs = [(block[line_start[a]:tab1[a]].decode(), a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+    return buf, runs, starts, ends, tab3 + 1, cov_end
+
+
+def parse_coverage(buf, begin, end):
+    '''
+    Output:
+        float array of the coverage fields buf[begin:end], integer and decimal (e.g. averaged) depths are parsed in bulk
+    '''
+    dot = end.copy()
+    for j in range(int((end - begin).max(initial=0))):
+        at = np.flatnonzero((begin + j < end) & (buf[np.minimum(begin + j, len(buf) - 1)] == ord('.')))
+        dot[at] = begin[at] + j
+    try:
+        coverage = parse_ints(buf, begin, dot).astype(np.float64)
+        frac = np.flatnonzero(end - dot > 1)
+        if len(frac) > 0:
+            coverage[frac] += parse_ints(buf, dot[frac] + 1, end[frac]) / 10.0 ** (end[frac] - dot[frac] - 1)
+        return coverage
+    except ValueError:
+        #anything else (exponents, nan) is left to float()
+        return np.array([float(buf[b:e].tobytes()) for b, e in zip(begin.tolist(), end.tolist())])
+
+
+def merge_block(block, offsets):
+    '''
+    rewrites a block of complete bed lines
+    Args:
+        block: bytes of complete lines
+        offsets: dictionary where key is contig name and value is the number added to its positions
+    Output:
+        bytes of the rewritten lines
+    '''
+    buf, runs, starts, ends, cov_begin, cov_end = parse_block(block)
+    out = []
+    for contig, a, b in runs:
+        # contigs that are not in the table are written unchanged
+        offset = offsets.get(contig)
+        if offset != None:
+            contig = merged_contig
+        else:
+            offset = 0
+        out.append(format_lines(buf, f'{contig}\t'.encode(), starts[a:b] + offset, ends[a:b] + offset, cov_begin[a:b], cov_end[a:b]))
+    return b''.join(out)
+
+
+def merge_contigs(input, output, offsets, compress=None):
+    '''
+    Args:
+        input: bed file to convert (plain or gzipped)
+        output: bed file with merged contigs
+        offsets: dictionary where key is contig name and value is the number added to its positions (see contig_offsets.py)
+        compress: True to gzip the output, None to gzip it if output ends with .gz
+    '''
+    if compress == None:
+        compress = output.endswith('.gz')
+    opener = gzip.open if is_gzipped(input) else open
+    with opener(input, 'rb') as infile, open(output, 'wb') as raw:
+        #level 3 compresses bedgraphs as well as the default level at a fraction of the time
+        outfile = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=3) if compress else raw
+        for block in read_blocks(infile):
+            outfile.write(merge_block(block, offsets))
+        if compress:
+            outfile.close()
 
 
 if __name__ == "__main__":
-              
-    merge_contigs(input_file, output_file)
\ No newline at end of file
+    #this script requires bed files
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', required=True, type=str,help='input bed file to convert (plain or gzipped)')
+    parser.add_argument('-o', '--output', required=True, type=str, help='output bed file with merged contigs (gzipped if it ends in .gz)')
+    parser.add_argument('-fai', '--reference_index', required=False, type=str, default=None, help='reference.fasta.fai with the contig lengths (default: built-in C. auris contigs)')
+
+    args = parser.parse_args()
+    input_file = args.input
+    output_file = args.output
+
+    merge_contigs(input_file, output_file, load_offsets(fai=args.reference_index))
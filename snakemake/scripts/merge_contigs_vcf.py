@@ -9,81 +9,34 @@ import vcfpy
 import os
 import argparse
 
-#this script requires individual VCFs
-parser = argparse.ArgumentParser()
-parser.add_argument('-i', '--input', required=True, type=str,help='input vcf file to convert')
-parser.add_argument('-o', '--output', required=False, type=str, default=None, help='output vcf file with merged contigs')
-
-
-args = parser.parse_args()
-input_file = args.input
-
-if args.output is None:
-    output_file = input_file.replace('.vcf', '_merged.vcf')
-else:
-    output_file = args.output
-
-
-def merge_contigs(input, output):
+from contig_offsets import load_lengths, offsets_from_lengths, merged_contig
+
+def merge_contigs(input, output, lengths):
+    '''
+    Args:
+        input: vcf file to convert
+        output: vcf file with merged contigs
+        lengths: a list of (contig, length) tuples in reference order (see contig_offsets.py)
+    '''
+    offsets = offsets_from_lengths(lengths)
     vcf = VCF(input)
     w = Writer(output, vcf)
       
     # # Modify the header and add new contig info
-    new_contig_line = '##contig=<ID=NC_07281x.1,length=12249773>'
+    new_contig_line = f'##contig=<ID={merged_contig},length={sum(length for contig, length in lengths)}>'
     w.add_to_header(new_contig_line)
               
-    
-    # new start positions for different cotings
-    # set_pos set the POS to the given 1-based position    
-    new_start_pos_2 = 3148135 - 1
-    new_start_pos_3 = new_start_pos_2 + 2554418
-    new_start_pos_4 = new_start_pos_3 + 2336890
-    new_start_pos_5 = new_start_pos_4 + 1318327
-    new_start_pos_6 = new_start_pos_5 + 1007026
-    new_start_pos_7 = new_start_pos_6 + 1004684
-    
-    
     # make modifications to the start positions for each contig
+    # note: set_pos takes a 0-based position, so the new 1-based POS is variant.POS + offset
     for variant in vcf:
-        if variant.CHROM.startswith('NC_072812.1'):
-            variant.CHROM = variant.CHROM.replace('NC_072812.1', 'NC_07281X.1')
-            w.write_record(variant)
-            
-        elif variant.CHROM.startswith('NC_072813.1'):
-            new_pos_2 = variant.POS + new_start_pos_2
-            variant.set_pos(new_pos_2) 
-            variant.CHROM = variant.CHROM.replace('NC_072813.1', 'NC_07281X.1')
-            w.write_record(variant)
-            
-        elif variant.CHROM.startswith('NC_072814.1'):
-            new_pos_3 = variant.POS + new_start_pos_3
-            variant.set_pos(new_pos_3) 
-            variant.CHROM = variant.CHROM.replace('NC_072814.1', 'NC_07281X.1')
-            w.write_record(variant)
-            
-        elif variant.CHROM.startswith('NC_072815.1'):
-            new_pos_4 = variant.POS + new_start_pos_4
-            variant.set_pos(new_pos_4)
-            variant.CHROM = variant.CHROM.replace('NC_072815.1', 'NC_07281X.1') 
-            w.write_record(variant)
-            
-        elif variant.CHROM.startswith('NC_072816.1'):
-            new_pos_5 = variant.POS + new_start_pos_5
-            variant.set_pos(new_pos_5)
-            variant.CHROM = variant.CHROM.replace('NC_072816.1', 'NC_07281X.1')  
-            w.write_record(variant)
-            
-        elif variant.CHROM.startswith('NC_072817.1'):
-            new_pos_6 = variant.POS + new_start_pos_6
-            variant.set_pos(new_pos_6)
-            variant.CHROM = variant.CHROM.replace('NC_072817.1', 'NC_07281X.1')  
-            w.write_record(variant)
-            
-        elif variant.CHROM.startswith('NC_072818.1'):
-            new_pos_7 = variant.POS + new_start_pos_7
-            variant.set_pos(new_pos_7)
-            variant.CHROM = variant.CHROM.replace('NC_072818.1', 'NC_07281X.1')  
-            w.write_record(variant)
+        offset = offsets.get(variant.CHROM)
+        # records on contigs that are not in the table are dropped
+        if offset == None:
+            continue
+        if offset:
+            variant.set_pos(variant.POS - 1 + offset)
+        variant.CHROM = merged_contig
+        w.write_record(variant)
 
       
     # close the vcf files    
@@ -111,12 +64,12 @@ def remove_contig_lines(input, output):
     writer.close()
 
 
-def add_contig(input, output):
+def add_contig(input, output, lengths):
     vcf = VCF(input)
     w = Writer(output, vcf)
       
     # # Modify the header and add new contig info
-    new_contig_line = '##contig=<ID=NC_07281x.1,length=12249773>'
+    new_contig_line = f'##contig=<ID={merged_contig},length={sum(length for contig, length in lengths)}>'
     w.add_to_header(new_contig_line)   
     
     for variant in vcf:
@@ -127,12 +80,29 @@ def add_contig(input, output):
     vcf.close() 
 
 if __name__ == "__main__":
+    #this script requires individual VCFs
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', required=True, type=str,help='input vcf file to convert')
+    parser.add_argument('-o', '--output', required=False, type=str, default=None, help='output vcf file with merged contigs')
+    parser.add_argument('-fai', '--reference_index', required=False, type=str, default=None, help='reference.fasta.fai with the contig lengths (default: built-in C. auris contigs)')
+    parser.add_argument('-hc', '--header_contigs', required=False, action='store_true', help='take the contig lengths from the ##contig lines of the input vcf instead')
+
+    args = parser.parse_args()
+    input_file = args.input
+
+    if args.output is None:
+        output_file = input_file.replace('.vcf', '_merged.vcf')
+    else:
+        output_file = args.output
+
+    lengths = load_lengths(fai=args.reference_index, vcf=input_file if args.header_contigs else None)
+
     temp_file1 = input_file + 'temp1.vcf'
     temp_file2 = input_file + 'temp2.vcf'
                 
-    merge_contigs(input_file, temp_file1)    
+    merge_contigs(input_file, temp_file1, lengths)    
     remove_contig_lines(temp_file1, temp_file2)
-    add_contig(temp_file2, output_file)
+    add_contig(temp_file2, output_file, lengths)
     
     
     try:
@@ -1,77 +1,60 @@
 import os
 import argparse
-import subprocess
 
-#this script requires individual VCFs
-parser = argparse.ArgumentParser()
-parser.add_argument('-bd', '--BED_directory', required=True, type=str,help='path to directory of bed files')
-parser.add_argument('-wd', '--working_directory', required=True, type=str,help='path to directory of merged bed files')
-parser.add_argument('-sl', '--SRA_list_file', required=True, type=str,help='file with the list of SRA want to be processed')
-args = parser.parse_args()
-bd = args.BED_directory
-wd = args.working_directory
-sl = args.SRA_list_file
+from merge_contigs_bed import merge_contigs
+from contig_offsets import load_offsets
+import conversion_cache
 
-# make output directory if doesn't exist
-os.makedirs(wd, exist_ok=True)
 
-with open(sl, 'r') as SRA_list:
-    for sra in SRA_list:
-        sra = sra.strip()
-        bed_filename = f"aligned_{sra}.bed"
-        bed_path = os.path.join(bd, bed_filename)
-        
-        # bed_files = [f for f in os.listdir(bd) if f.endswith(".bed")]
-        
-        if os.path.exists(bed_path):
-            # for bed in bed_filename:
-            # input_prefix = bed_filename.split("aligned_")[-1]
-            bm = f"{sra}_merged.bed"
-            
-            # current_bed_path = os.path.join(bd, bed)
-            output_path = os.path.join(wd, bm)
-            
-            # check if the file already exists
-            if os.path.exists(output_path):
-                print(f"Skipping {sra}: Output file {output_path} already exists.")
-                continue        
+if __name__ == "__main__":
+    #this script requires individual VCFs
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-bd', '--BED_directory', required=True, type=str,help='path to directory of bed files')
+    parser.add_argument('-wd', '--working_directory', required=True, type=str,help='path to directory of merged bed files')
+    parser.add_argument('-sl', '--SRA_list_file', required=True, type=str,help='file with the list of SRA want to be processed')
+    parser.add_argument('-fai', '--reference_index', required=False, type=str, default=None, help='reference.fasta.fai with the contig lengths (default: built-in C. auris contigs)')
+    args = parser.parse_args()
+    bd = args.BED_directory
+    wd = args.working_directory
+    sl = args.SRA_list_file
+    fai = args.reference_index
+
+    # make output directory if doesn't exist
+    os.makedirs(wd, exist_ok=True)
+
+    offsets = load_offsets(fai=fai)
+    params = {'reference_index': conversion_cache.file_digest(fai)['sha256'] if fai != None else None}
+
+    with open(sl, 'r') as SRA_list:
+        for sra in SRA_list:
+            sra = sra.strip()
+            bed_filename = f"aligned_{sra}.bed"
+            bed_path = os.path.join(bd, bed_filename)
+            # gzipped bedgraphs are read directly
+            if not os.path.exists(bed_path) and os.path.exists(bed_path + '.gz'):
+                bed_path += '.gz'
             
-            else:
-                arg = f'python scripts/merge_contigs_bed.py -i {bed_path} -o {wd}/{bm}'
-                print('arg', arg)
+            if os.path.exists(bed_path):
+                bm = f"{sra}_merged.bed"
+                output_path = os.path.join(wd, bm)
+                
+                # skip only if the merged bed was made from this exact bed file and contig table
+                fresh, key, digests = conversion_cache.check(output_path, {'bed': bed_path}, params)
+                if fresh:
+                    print(f"Skipping {sra}: Output file {output_path} is up to date.")
+                    continue        
                 
+                # write to a temporary file and rename it when finished, so an interrupted run leaves no truncated output
+                tmp_path = conversion_cache.temp_path(output_path)
                 try:
-                    subprocess.run(arg, shell=True, check=True)
-                except subprocess.CalledProcessError as e:
-                    # If subprocess run fails, print the error, delete the specific output file, and move on
-                    print(f"Error: {e}")
-                    print(f"Deleting {output_path}")
-                    os.remove(output_path)
-        else:
-            print(f"Bed file for SRA {sra} not found in {bd}")
-    
-
-
-# for bed in bed_files:
-#     input_prefix = bed.split("aligned_")[-1]
-#     bm = input_prefix.replace('.bed', '') + "_merged.bed"
-    
-#     bed_path = os.path.join(bd, bed)
-#     output_path = os.path.join(wd, bm)
-    
-#     # check if the file already exists
-#     if os.path.exists(output_path):
-#         print(f"Skipping {bed}: Output file {output_path} already exists.")
-#         continue        
-    
-#     else:
-#         arg = f'python scripts/merge_contigs_bed.py -i {bed_path} -o {wd}/{bm}'
-#         print('arg', arg)
-        
-#         try:
-#             subprocess.run(arg, shell=True, check=True)
-#         except subprocess.CalledProcessError as e:
-#             # If subprocess run fails, print the error, delete the specific output file, and move on
-#             print(f"Error: {e}")
-#             print(f"Deleting {output_path}")
-#             os.remove(output_path)
\ No newline at end of file
+                    merge_contigs(bed_path, tmp_path, offsets)
+                    os.replace(tmp_path, output_path)
+                    conversion_cache.record(output_path, key, digests, params)
+                    print(f"Finished {sra}")
+                except Exception as e:
+                    # If the merge fails, print the error, delete the partial output, and move on
+                    print(f"Error: {sra} failed ({type(e).__name__}: {e})")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            else:
+                print(f"Bed file for SRA {sra} not found in {bd}")
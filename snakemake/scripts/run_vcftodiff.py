@@ -1,109 +1,189 @@
 import os
+import sys
+import json
 import argparse
-import gzip
 import logging
-import subprocess
-
-#this script requires individual VCFs
-parser = argparse.ArgumentParser()
-parser.add_argument('-vd', '--VCF_directory', required=True, type=str,help='path to directory of single-sample VCFs')
-parser.add_argument('-wd', '--working_directory', required=True, type=str, help='directory for all outputs (make sure this directory will have enough space!!!!)')
-parser.add_argument('-bd', '--bedgraph_directory', required=True, type=str, help="path to directory of bed coverage file (bedgraph) for vcf")
-parser.add_argument('-sl', '--SRA_list_file', required=True, type=str,help='file with the list of SRA want to be processed')
-
-args = parser.parse_args()
-vd = args.VCF_directory
-wd = args.working_directory
-# wd = "diff_files"
-bd = args.bedgraph_directory
-sl = args.SRA_list_file
-
-with open(sl, 'r') as SRA_list:
-    for sra in SRA_list:
-        sra = sra.strip()
-        
-        vcfs = [f"{sra}.vcf.gz"]
-        beds = [f"{sra}_merged.bed"]
-        diffs = [f"{sra}.diff"]
-        
-        for vcf, bed, diff in zip(vcfs, beds, diffs):
-            diff_path = os.path.join(wd, diff)
-            bed_path = os.path.join(bd, bed)
-            vcf_path = os.path.join(vd, vcf)
-            
-            # Debugging statements
-            print(f"Current working directory: {os.getcwd()}")
-            print(f"Checking for existence of {diff_path}")
-            print(vcf, bed)
-        
-            # arg = f'python scripts/vcf_to_diff_script.py -v {os.path.join(vd, vcf)} -d {wd} -bed {os.path.join(bd, bed)}'
-            # print('arg', arg)    
-            
-            # check if the .diff file already exists
-            if os.path.exists(diff_path) and diff_path.endswith(".diff"):
-                print(f"Skipping {vcf}: Output file {diff_path} already exists.")
-                continue
-            
-            elif not os.path.exists(bed_path):
-                print(f"Skipping {vcf}: Bedgraph file {bed_path} does not exists.")
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from vcf_to_diff_script import convert_sample, load_species_mask, find_bedgraph
+from bam_coverage import find_alignment
+from contig_offsets import load_lengths, offsets_from_lengths
+from intervals import Intervals
+from stage_metrics import SampleMetrics, aggregate, write_metrics
+import conversion_cache
+
+#species masks and contig offsets used by every sample a worker converts, read once per worker by init_worker
+worker_masks = None
+worker_offsets = None
+worker_lengths = None
+worker_genome_length = None
+worker_reference = None
+
+
+def init_worker(smf, fai=None, reference=None):
+    '''
+    runs once in every worker: quiet logging, read the species mask file and build the contig offset table a single time
+    Args:
+        smf: path to bed file of commonly masked regions of genome (or None)
+        fai: reference.fasta.fai with the contig lengths (or None for the built-in C. auris contigs)
+        reference: reference fasta for CRAM alignments (or None)
+    '''
+    global worker_masks, worker_offsets, worker_lengths, worker_genome_length, worker_reference
+    worker_reference = reference
+    logging.basicConfig(level=logging.WARNING)
+    worker_lengths = load_lengths(fai=fai)
+    worker_offsets = offsets_from_lengths(worker_lengths)
+    worker_genome_length = sum(length for contig, length in worker_lengths)
+    if smf != None:
+        worker_masks = load_species_mask(smf)
+    else:
+        worker_masks = Intervals()
+
+
+def convert_one(sra, vcf_path, wd, bed_path, min_coverage, compact=False, shared=None, metrics=False, bam_path=None):
+    '''
+    converts a single SRA in-process and reports the result instead of raising, so one bad sample 
+    does not stop the whole batch. the sample is skipped if its diff was already made from the same
+    inputs and parameters (see conversion_cache.py)
+    Args:
+        sra: SRA accession
+        vcf_path: path to the single-sample vcf.gz
+        wd: directory for the diff files
+        bed_path: path to the bedgraph of the sample (merged or per contig)
+        min_coverage: minimum coverage depth
+        compact: combine adjacent missing-data diff lines
+        shared: dictionary of digests of the files every sample uses (species mask, reference index)
+        metrics: if True, time and count every stage of the conversion (see stage_metrics.py)
+        bam_path: path to the sorted, indexed BAM/CRAM the low-depth regions are read from when bed_path is None
+    Output:
+        (sra, status, detail, summary) where status is 'converted', 'cached' or 'failed' and summary 
+        is the metrics of a converted sample (None otherwise)
+    '''
+    diff_path = os.path.join(wd, f"{sra}.diff")
+    try:
+        params = {'min_coverage': min_coverage, 'compact': compact, 'shared': shared}
+        inputs = {'vcf': vcf_path, 'bed': bed_path} if bed_path != None else {'vcf': vcf_path, 'bam': bam_path}
+        fresh, key, digests = conversion_cache.check(diff_path, inputs, params)
+        if fresh:
+            return sra, 'cached', diff_path, None
+        sample_metrics = SampleMetrics(worker_genome_length) if metrics else None
+        convert_sample(vcf_path, wd, bed=bed_path, min_coverage=min_coverage, masks=worker_masks, offsets=worker_offsets, compact=compact, metrics=sample_metrics,
+                       bam=bam_path, reference=worker_reference, lengths=worker_lengths)
+        conversion_cache.record(diff_path, key, digests, params)
+        return sra, 'converted', diff_path, sample_metrics.summary() if metrics else None
+    except Exception as e:
+        return sra, 'failed', f"{type(e).__name__}: {e}", None
+
+
+if __name__ == "__main__":
+    #this script requires individual VCFs
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-vd', '--VCF_directory', required=True, type=str,help='path to directory of single-sample VCFs')
+    parser.add_argument('-wd', '--working_directory', required=True, type=str, help='directory for all outputs (make sure this directory will have enough space!!!!)')
+    parser.add_argument('-bd', '--bedgraph_directory', required=False, type=str, help="path to directory of bed coverage files: aligned_{sra}.bed(.gz) per contig or {sra}_merged.bed from run_mergebed.py")
+    parser.add_argument('-ad', '--alignment_directory', required=False, type=str, help="path to directory of sorted, indexed aligned_{sra}.bam/.cram files: low-depth regions are read from them (samtools depth) for samples without a bedgraph")
+    parser.add_argument('-ref', '--reference', required=False, type=str, help="reference fasta, for CRAM alignments")
+    parser.add_argument('-sl', '--SRA_list_file', required=True, type=str,help='file with the list of SRA want to be processed')
+    parser.add_argument('-smf', '--species_maskfile', required=False, type=str, help='path to bed file of commonly masked regions of genome (or its .npy index from compile_mask.py)')
+    parser.add_argument('-cd', '--coverage_depth', required=False, default=10, type=int, help="minimum coverage depth for any given call before that call is considered dubious")
+    parser.add_argument('-fai', '--reference_index', required=False, type=str, help='reference.fasta.fai with the contig lengths (default: built-in C. auris contigs)')
+    parser.add_argument('-c', '--compact', required=False, action='store_true', help="combine adjacent missing-data ('-') diff lines into one line")
+    parser.add_argument('-ml', '--metrics', required=False, action='store_true', help='write per-stage timings and counters of every converted sample to run_vcftodiff_metrics.jsonl and a run summary to run_vcftodiff_summary.json')
+    parser.add_argument('-j', '--jobs', required=False, default=os.cpu_count(), type=int, help='number of samples converted in parallel (default: all cores)')
+
+    args = parser.parse_args()
+    if args.bedgraph_directory == None and args.alignment_directory == None:
+        parser.error('one of -bd (bedgraphs) or -ad (BAM/CRAM alignments) is needed for the low-depth mask')
+    vd = args.VCF_directory
+    wd = args.working_directory
+    bd = args.bedgraph_directory
+    sl = args.SRA_list_file
+    smf = args.species_maskfile
+    fai = args.reference_index
+    min_coverage = args.coverage_depth
+    jobs = max(1, args.jobs)
+
+    os.makedirs(wd, exist_ok=True)
+
+    # the species mask and reference index are the same for every sample, hash them once
+    shared = {}
+    for name, path in (('species_mask', smf), ('reference_index', fai), ('reference', args.reference)):
+        if path != None:
+            shared[name] = conversion_cache.file_digest(path)['sha256']
+
+    # per-sample accounting: sra -> (status, detail)
+    results = {}
+    todo = []
+    with open(sl, 'r') as SRA_list:
+        for sra in SRA_list:
+            sra = sra.strip()
+            if sra == '':
                 continue
-            
+
+            # the raw bedgraph is shifted while it is read, run_mergebed.py is only needed for old merged beds
+            bed_path = find_bedgraph(bd, sra) if bd != None else None
+            # without a bedgraph the depth is read from the alignments
+            bam_path = find_alignment(args.alignment_directory, sra) if bed_path == None and args.alignment_directory != None else None
+            vcf_path = os.path.join(vd, f"{sra}.vcf.gz")
+
+            if bed_path == None and bam_path == None:
+                print(f"Skipping {sra}: no bedgraph or alignment found for it.")
+                results[sra] = ('missing_input', f'no bedgraph in {bd} or alignment in {args.alignment_directory}')
+
             elif not os.path.exists(vcf_path):
-                print(f"Skipping {vcf}: vcf file {vcf_path} does not exists.")
-                continue                
+                print(f"Skipping {sra}: vcf file {vcf_path} does not exists.")
+                results[sra] = ('missing_input', f'{vcf_path} does not exist')
 
             else:
-                arg = f'python scripts/vcf_to_diff_script.py -v {os.path.join(vd, vcf)} -d {wd} -bed {os.path.join(bd, bed)}'
-                subprocess.run(arg, shell=True, check=True)
-                print('arg', arg)
-                print("Finished")
-        
-
-# # get a list of files in vd with .vcf.gz extension
-# vcfs = [f for f in os.listdir(vd) if f.endswith(".vcf.gz")]
-
-# # create a list of corresponding BED files by changing the extension
-# beds = [os.path.splitext(os.path.splitext(f)[0])[0] + "_merged.bed" for f in vcfs]
-
-# # create a list of corresponding DIFF files
-# diffs = [os.path.splitext(os.path.splitext(f)[0])[0] + ".vc.diff" for f in vcfs]
-
-
-# for vcf, bed, diff in zip(vcfs, beds, diffs):
-#     diff_path = os.path.join(wd, diff)
-#     bed_path = os.path.join(bd, bed)
-    
-#     # Debugging statements
-#     print(f"Current working directory: {os.getcwd()}")
-#     print(f"Checking for existence of {diff_path}")
-#     print(vcf, bed)
- 
-#     # arg = f'python scripts/vcf_to_diff_script.py -v {os.path.join(vd, vcf)} -d {wd} -bed {os.path.join(bd, bed)}'
-#     # print('arg', arg)    
-    
-#     # check if the .diff file already exists
-#     if os.path.exists(diff_path) and diff_path.endswith(".vc.diff"):
-#         print(f"Skipping {vcf}: Output file {diff_path} already exists.")
-#         continue
-    
-#     elif not os.path.exists(bed_path):
-#         print(f"Skipping {vcf}: Bedgraph file {bed_path} does not exists.")
-#         continue
-
-#     else:
-#         arg = f'python scripts/vcf_to_diff_script.py -v {os.path.join(vd, vcf)} -d {wd} -bed {os.path.join(bd, bed)}'
-#         subprocess.run(arg, shell=True, check=True)
-#         print('arg', arg)
-#         print("Finished")
-
-    
-    # try:
-    #     subprocess.run(arg, shell=True, check=True)
-    #     print('arg', arg)
-    #     print("Finished")
-    # except subprocess.CalledProcessError as e:
-    #     # If subprocess run fails, print the error, delete the specific output file, and move on
-    #     print(f"Error: {e}")
-    #     print(f"Deleting {diff_path}")
-    #     os.remove(diff_path)
-        
\ No newline at end of file
+                todo.append((sra, vcf_path, wd, bed_path, min_coverage, args.compact, shared, args.metrics, bam_path))
+
+    print(f"Converting {len(todo)} samples with {jobs} workers")
+    if jobs == 1:
+        # no pool needed, run everything in this process
+        init_worker(smf, fai, args.reference)
+        finished = (convert_one(*task) for task in todo)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(smf, fai, args.reference))
+        futures = [pool.submit(convert_one, *task) for task in todo]
+        finished = (f.result() for f in as_completed(futures))
+
+    summaries = []
+    for sra, status, detail, summary in finished:
+        results[sra] = (status, detail)
+        if summary != None:
+            summary['sample'] = sra
+            summaries.append(summary)
+        if status == 'converted':
+            print(f"Finished {sra}")
+        elif status == 'cached':
+            print(f"Skipping {sra}: {detail} is up to date.")
+        else:
+            print(f"Error: {sra} failed ({detail})")
+
+    if jobs != 1:
+        pool.shutdown()
+
+    # write the per-sample report and a short summary
+    report = os.path.join(wd, 'run_vcftodiff_report.tsv')
+    counts = {}
+    with open(report, 'w') as r:
+        r.write('sra\tstatus\tdetail\n')
+        for sra, (status, detail) in results.items():
+            r.write(f'{sra}\t{status}\t{detail}\n')
+            counts[status] = counts.get(status, 0) + 1
+    print(', '.join(f'{status}: {n}' for status, n in sorted(counts.items())) + f' (report: {report})')
+
+    # per-sample metrics and what they add up to over the run
+    if args.metrics and summaries != []:
+        metrics_file = os.path.join(wd, 'run_vcftodiff_metrics.jsonl')
+        summary_file = os.path.join(wd, 'run_vcftodiff_summary.json')
+        write_metrics(metrics_file, summaries, mode='w')
+        run_summary = aggregate(summaries)
+        with open(summary_file, 'w') as f:
+            json.dump(run_summary, f, indent=1)
+        print(f"Stage time over {run_summary['samples']} samples: " + ', '.join(f'{name} {wall}s' for name, wall in run_summary['stage_wall'].items()))
+        print('Slowest samples: ' + ', '.join(f'{sample} ({wall}s)' for sample, wall in run_summary['slowest']) + f' (metrics: {metrics_file})')
+
+    # non-zero exit so pipelines notice failed samples
+    if counts.get('failed', 0) > 0:
+        sys.exit(1)
@@ -0,0 +1,175 @@
+# stage_metrics.py
+"""
+Per-sample metrics of the conversion pipeline, written as one JSON line per sample.
+The streaming stages (vcf_to_diff, mask_and_write_diff, mask2ref, squish) are chained generators, so a
+stage is timed around every record it hands on: that time includes the stages before it, and the time of
+the stage itself is what is left after taking away the time of the stage before it.
+One-shot steps (reading masks, writing) are timed with wall and CPU time; the CPU time of 'write'
+covers every streaming stage, since writing is what pulls the records through them.
+Nothing is measured unless a SampleMetrics is passed to convert_sample.
+"""
+
+import json
+import time
+import resource
+from contextlib import contextmanager, nullcontext
+
+from intervals import MISSING
+
+
+class SampleMetrics:
+    '''
+    collects the metrics of one sample while it is converted
+    '''
+    def __init__(self, genome_length=None):
+        '''
+        Args:
+            genome_length: length of the reference (sum of the contig lengths), used for missing_fraction
+        '''
+        self.genome_length = genome_length
+        self.sample = None
+        self.stages = []
+        self.steps = {}
+        self.extra = {}
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def summary(self):
+        '''
+        Output:
+            dictionary of the metrics (JSON serialisable)
+        '''
+        stages = []
+        for i, stage in enumerate(self.stages):
+            stage = dict(stage)
+            if i > 0:
+                #every stage pulls its records through the stage before it
+                prev = self.stages[i-1]
+                stage['wall'] -= prev['wall']
+                stage['records_in'] = prev['records_out']
+                stage['missing_added'] = stage['missing_out'] - prev['missing_out']
+                stage['bases_removed'] = prev['bases_out'] - stage['bases_out']
+            stages.append(stage)
+        steps = {name: dict(step) for name, step in self.steps.items()}
+        #writing drives the whole chain of stages
+        if 'write' in steps and self.stages != []:
+            steps['write']['wall'] -= self.stages[-1]['wall']
+        for stage in stages:
+            stage['wall'] = round(stage['wall'], 4)
+        for step in steps.values():
+            step['wall'] = round(step['wall'], 4)
+            step['cpu'] = round(step['cpu'], 4)
+        return {
+            'sample': self.sample,
+            'wall': round(time.perf_counter() - self.wall, 4),
+            'cpu': round(time.process_time() - self.cpu, 4),
+            #peak of the whole process so far (a worker reports the largest sample it has converted)
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'stages': stages,
+            'steps': steps,
+            **self.extra,
+        }
+
+
+def stream(metrics, name, records):
+    '''
+    counts the records (and bases) a streaming stage hands on and the time spent getting them
+    Args:
+        metrics: SampleMetrics or None (records are returned as they are)
+        name: stage name
+        records: iterable of [allele code, start, length] records the stage yields
+    Output:
+        the same records
+    '''
+    if metrics == None:
+        return records
+    stage = {'stage': name, 'wall': 0.0, 'records_out': 0, 'bases_out': 0, 'missing_out': 0}
+    metrics.stages.append(stage)
+    return counted(stage, iter(records))
+
+
+def counted(stage, records):
+    clock = time.perf_counter
+    wall = 0.0
+    n = bases = missing = 0
+    try:
+        while True:
+            t = clock()
+            record = next(records, None)
+            wall += clock() - t
+            if record == None:
+                return
+            n += 1
+            bases += record[2]
+            if record[0] == MISSING:
+                missing += record[2]
+            yield record
+    finally:
+        stage['wall'] += wall
+        stage['records_out'] += n
+        #positions from a memory-mapped mask index are numpy integers
+        stage['bases_out'] += int(bases)
+        stage['missing_out'] += int(missing)
+
+
+def step(metrics, name):
+    '''
+    times a one-shot step (wall and CPU): with step(metrics, 'write'): ...
+    Args:
+        metrics: SampleMetrics or None (nothing is timed)
+        name: step name
+    '''
+    if metrics == None:
+        return nullcontext()
+    return timed_step(metrics, name)
+
+
+@contextmanager
+def timed_step(metrics, name):
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        metrics.steps[name] = {'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu}
+
+
+def write_metrics(path, summaries, mode='a'):
+    '''
+    writes metrics summaries to a JSON lines file, one line per sample
+    Args:
+        path: JSON lines file
+        summaries: list of metrics summaries (SampleMetrics.summary)
+        mode: 'a' to append to the file, 'w' to replace it
+    '''
+    with open(path, mode) as f:
+        for summary in summaries:
+            f.write(json.dumps(summary, sort_keys=True) + '\n')
+
+
+def aggregate(summaries, top=5):
+    '''
+    sums the metrics of a batch run and picks out slow or mostly missing samples
+    Args:
+        summaries: list of metrics summaries (SampleMetrics.summary)
+        top: number of samples listed as slowest / most missing
+    Output:
+        dictionary with totals, the time of every stage summed over all samples and the outliers
+    '''
+    stage_wall = {}
+    for summary in summaries:
+        for stage in summary['stages']:
+            stage_wall[stage['stage']] = stage_wall.get(stage['stage'], 0) + stage['wall']
+        for name, s in summary['steps'].items():
+            stage_wall[name] = stage_wall.get(name, 0) + s['wall']
+    slowest = sorted(summaries, key=lambda s: s['wall'], reverse=True)[:top]
+    with_missing = [s for s in summaries if s.get('missing_fraction') != None]
+    most_missing = sorted(with_missing, key=lambda s: s['missing_fraction'], reverse=True)[:top]
+    return {
+        'samples': len(summaries),
+        'wall': round(sum(s['wall'] for s in summaries), 2),
+        'cpu': round(sum(s['cpu'] for s in summaries), 2),
+        'peak_rss_mb': max((s['peak_rss_mb'] for s in summaries), default=None),
+        'stage_wall': {name: round(wall, 2) for name, wall in stage_wall.items()},
+        'slowest': [[s['sample'], s['wall']] for s in slowest],
+        'most_missing': [[s['sample'], s['missing_fraction']] for s in most_missing],
+    }
@@ -0,0 +1,202 @@
+# synthetic_data.py
+"""
+Generates synthetic C. auris inputs for benchmarking the conversion: single- and multi-sample VCFs,
+per-contig bedgraphs and a species mask, all laid out on the seven reference contigs used by the
+mergers (contig_offsets.default_contig_lengths). Everything is drawn from a seeded random generator,
+so the same arguments always give the same files.
+"""
+
+import os
+import gzip
+import argparse
+
+import numpy as np
+
+from contig_offsets import default_contig_lengths, merged_contig
+
+BASES = np.array(list('ACGT'))
+
+
+def random_seq(rng, length):
+    return ''.join(rng.choice(BASES, length))
+
+
+def draw_sites(rng, contigs, n_sites, snp_rate, indel_rate):
+    '''
+    picks the variant sites: positions spread over the contigs by length, each a SNP or an indel
+    Args:
+        rng: numpy random Generator
+        contigs: list of (contig, length) tuples
+        n_sites: number of sites over all contigs
+        snp_rate, indel_rate: relative weights of SNPs and indels (MNPs fill the rest)
+    Output:
+        sites: list of (contig, pos, ref, alt) in reference order
+    '''
+    total = sum(length for contig, length in contigs)
+    other = max(0.0, 1.0 - snp_rate - indel_rate)
+    kinds = np.array(['snp', 'indel', 'mnp'])
+    p = np.array([snp_rate, indel_rate, other]) / (snp_rate + indel_rate + other)
+    sites = []
+    for contig, length in contigs:
+        n = int(round(n_sites * length / total))
+        positions = np.unique(rng.integers(1, length - 10, n))
+        for pos, kind in zip(positions.tolist(), rng.choice(kinds, len(positions), p=p).tolist()):
+            ref = random_seq(rng, 1)
+            if kind == 'snp':
+                alt = random_seq(rng, 1)
+                while alt == ref:
+                    alt = random_seq(rng, 1)
+            elif kind == 'indel':
+                size = int(rng.integers(1, 6))
+                if rng.random() < 0.5:
+                    ref = ref + random_seq(rng, size)
+                    alt = ref[0]
+                else:
+                    alt = ref + random_seq(rng, size)
+            else:
+                size = int(rng.integers(2, 5))
+                ref = random_seq(rng, size)
+                alt = ''.join(b if rng.random() < 0.5 else random_seq(rng, 1) for b in ref)
+                if alt == ref:
+                    alt = ref[:-1] + ('A' if ref[-1] != 'A' else 'C')
+            #a second alt allele now and then, so multi-allelic genotypes (1/2) occur
+            if kind == 'snp' and rng.random() < 0.05:
+                second = random_seq(rng, 1)
+                if second not in (ref, alt):
+                    alt = f'{alt},{second}'
+            sites.append((contig, pos, ref, alt))
+    return sites
+
+
+def draw_genotype(rng, alt, het_rate, missing_rate, ref_rate=0.0):
+    r = rng.random()
+    if r < missing_rate:
+        return './.'
+    if r < missing_rate + ref_rate:
+        return '0/0'
+    n_alt = alt.count(',') + 1
+    if rng.random() < het_rate:
+        if n_alt > 1 and rng.random() < 0.5:
+            return '1/2'
+        return '0/1'
+    a = int(rng.integers(1, n_alt + 1))
+    return f'{a}/{a}'
+
+
+def write_vcf(path, samples, contigs, sites, rng, het_rate=0.05, missing_rate=0.0, ref_rate=0.0):
+    '''
+    writes a (gzipped) VCF with GT:DP sample columns
+    Args:
+        path: output .vcf.gz
+        samples: list of sample names (one column each)
+        contigs: list of (contig, length) tuples for the ##contig lines
+        sites: sites from draw_sites
+        rng: numpy random Generator
+        het_rate: fraction of heterozygous genotypes
+        missing_rate: fraction of ./. genotypes
+        ref_rate: fraction of 0/0 genotypes (joint-called VCFs, single-sample VCFs only list variants)
+    '''
+    with gzip.open(path, 'wt', compresslevel=1) as v:
+        v.write('##fileformat=VCFv4.2\n')
+        v.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        v.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n')
+        for contig, length in contigs:
+            v.write(f'##contig=<ID={contig},length={length}>\n')
+        v.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' + '\t'.join(samples) + '\n')
+        for contig, pos, ref, alt in sites:
+            gts = '\t'.join(f'{draw_genotype(rng, alt, het_rate, missing_rate, ref_rate)}:{int(rng.integers(5, 60))}' for s in samples)
+            v.write(f'{contig}\t{pos}\t.\t{ref}\t{alt}\t50\tPASS\t.\tGT:DP\t{gts}\n')
+
+
+def write_bedgraph(path, contigs, rng, mean_depth=30, low_depth_rate=0.1, segment=200, profile='patchy'):
+    '''
+    writes a per-contig bedgraph (0 index, not merged) like bedtools genomecov -bg
+    Args:
+        path: output bedgraph
+        contigs: list of (contig, length) tuples
+        rng: numpy random Generator
+        mean_depth: average depth of covered segments
+        low_depth_rate: fraction of segments below 10x
+        segment: mean segment length
+        profile: 'uniform' (depth varies little), 'patchy' (many short low depth segments)
+                 or 'dropout' (low depth comes in long blocks)
+    '''
+    with open(path, 'w') as o:
+        for contig, length in contigs:
+            n = int(length / segment * 1.2) + 10
+            lengths = rng.geometric(1 / segment, n)
+            ends = np.minimum(np.cumsum(lengths), length)
+            ends = ends[:np.searchsorted(ends, length) + 1]
+            starts = np.concatenate(([0], ends[:-1]))
+            if profile == 'uniform':
+                depth = rng.normal(mean_depth, mean_depth / 10, len(ends))
+            else:
+                depth = rng.gamma(4, mean_depth / 4, len(ends))
+            low = rng.random(len(ends)) < low_depth_rate
+            if profile == 'dropout':
+                #low depth blocks span ~20 segments
+                low = np.repeat(rng.random(len(ends) // 20 + 1) < low_depth_rate, 20)[:len(ends)]
+            depth = np.where(low, rng.integers(0, 10, len(ends)), np.maximum(depth, 10)).astype(int)
+            o.writelines(f'{contig}\t{s}\t{e}\t{d}\n' for s, e, d in zip(starts.tolist(), ends.tolist(), depth.tolist()))
+
+
+def write_species_mask(path, contigs, rng, n_regions=100, mean_length=2000):
+    '''
+    writes a species mask bed on the merged chromosome (like the -smf files)
+    '''
+    total = sum(length for contig, length in contigs)
+    starts = np.sort(rng.integers(0, total - 10 * mean_length, n_regions))
+    lengths = rng.integers(mean_length // 10, mean_length * 2, n_regions)
+    with open(path, 'w') as o:
+        o.writelines(f'{merged_contig}\t{s}\t{s + l}\n' for s, l in zip(starts.tolist(), lengths.tolist()))
+
+
+def generate(out, n_samples=4, n_sites=50000, multi_samples=50, multi_sites=20000, snp_rate=0.85, indel_rate=0.1,
+             het_rate=0.05, missing_rate=0.01, ref_rate=0.8, mean_depth=30, low_depth_rate=0.1, profile='patchy', seed=1):
+    '''
+    writes a full synthetic data set to out:
+        vcf/{sample}.vcf.gz, bed/aligned_{sample}.bed (per-contig bedgraphs), samples.txt, species_mask.bed
+        and joint.vcf.gz (multi_samples columns, skipped if 0)
+    Output:
+        samples: list of single-sample names
+    '''
+    rng = np.random.default_rng(seed)
+    contigs = default_contig_lengths
+    for d in ('vcf', 'bed'):
+        os.makedirs(os.path.join(out, d), exist_ok=True)
+    samples = [f'SYN{i:04d}' for i in range(n_samples)]
+    for sample in samples:
+        sites = draw_sites(rng, contigs, n_sites, snp_rate, indel_rate)
+        write_vcf(os.path.join(out, 'vcf', f'{sample}.vcf.gz'), [sample], contigs, sites, rng, het_rate, missing_rate)
+        write_bedgraph(os.path.join(out, 'bed', f'aligned_{sample}.bed'), contigs, rng, mean_depth, low_depth_rate, profile=profile)
+    with open(os.path.join(out, 'samples.txt'), 'w') as f:
+        f.writelines(f'{sample}\n' for sample in samples)
+    write_species_mask(os.path.join(out, 'species_mask.bed'), contigs, rng)
+    if multi_samples > 0:
+        sites = draw_sites(rng, contigs, multi_sites, snp_rate, indel_rate)
+        joint = [f'JNT{i:04d}' for i in range(multi_samples)]
+        write_vcf(os.path.join(out, 'joint.vcf.gz'), joint, contigs, sites, rng, het_rate, missing_rate, ref_rate)
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', required=True, type=str, help='directory for the synthetic data set')
+    parser.add_argument('-n', '--samples', default=4, type=int, help='number of single-sample VCFs (each with a bedgraph)')
+    parser.add_argument('-s', '--sites', default=50000, type=int, help='variant sites per single-sample VCF')
+    parser.add_argument('-ms', '--multi_samples', default=50, type=int, help='sample columns of joint.vcf.gz (0 to skip it)')
+    parser.add_argument('-msites', '--multi_sites', default=20000, type=int, help='sites of joint.vcf.gz')
+    parser.add_argument('--snp_rate', default=0.85, type=float, help='fraction of SNP sites')
+    parser.add_argument('--indel_rate', default=0.1, type=float, help='fraction of indel sites (MNPs fill the rest)')
+    parser.add_argument('--het_rate', default=0.05, type=float, help='fraction of heterozygous genotypes')
+    parser.add_argument('--missing_rate', default=0.01, type=float, help='fraction of ./. genotypes')
+    parser.add_argument('--ref_rate', default=0.8, type=float, help='fraction of 0/0 genotypes in joint.vcf.gz')
+    parser.add_argument('--depth', default=30, type=int, help='mean depth of the bedgraphs')
+    parser.add_argument('--low_depth_rate', default=0.1, type=float, help='fraction of bedgraph segments below 10x')
+    parser.add_argument('--profile', default='patchy', choices=['uniform', 'patchy', 'dropout'], help='coverage profile of the bedgraphs')
+    parser.add_argument('--seed', default=1, type=int, help='random seed')
+    args = parser.parse_args()
+
+    samples = generate(args.output, args.samples, args.sites, args.multi_samples, args.multi_sites, args.snp_rate, args.indel_rate,
+                       args.het_rate, args.missing_rate, args.ref_rate, args.depth, args.low_depth_rate, args.profile, args.seed)
+    print(f"Wrote {len(samples)} samples to {args.output}")
@@ -0,0 +1,165 @@
+# tabix_index.py
+"""
+Reads the .tbi/.csi index of a bgzipped VCF without pysam or htslib.
+Only what is needed to jump to the first record of a contig is used: the smallest virtual file offset
+of every contig's chunks. A virtual offset is (offset of the BGZF block in the file << 16 | offset in the
+uncompressed block), and every BGZF block is a complete gzip member, so reading can start at any block.
+"""
+
+import os
+import io
+import gzip
+import struct
+
+#pseudo-bin that holds index metadata (not records) in tabix indexes
+TBI_META_BIN = 37450
+
+
+def is_bgzf(path):
+    '''
+    checks for a BGZF header: a gzip member with the 'BC' extra subfield (plain gzip files can't be indexed)
+    Args:
+        path: path to the file
+    Output:
+        True if the file is bgzip compressed
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(14)
+    return head[:4] == b'\x1f\x8b\x08\x04' and head[12:14] == b'BC'
+
+
+def is_gzipped(path):
+    '''
+    checks the first two bytes of a file for the gzip magic number (bgzip files are gzip files too)
+    Args:
+        path: path to the file
+    Output:
+        True if the file is gzip compressed
+    '''
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def find_index(vcf):
+    '''
+    Output:
+        path to the .tbi or .csi index next to vcf, or None if there is none
+    '''
+    for ext in ('.tbi', '.csi'):
+        if os.path.exists(vcf + ext):
+            return vcf + ext
+    return None
+
+
+def read_names(data, pos, l_nm):
+    '''
+    Output:
+        contig names stored as l_nm bytes of NUL terminated strings starting at data[pos]
+    '''
+    return [name.decode() for name in data[pos:pos+l_nm].split(b'\0') if name != b'']
+
+
+def read_tbi(data):
+    '''
+    Args:
+        data: uncompressed content of a .tbi file
+    Output:
+        starts: dictionary where key is contig name and value is the smallest virtual offset of its records
+    '''
+    n_ref, = struct.unpack_from('<i', data, 4)
+    l_nm, = struct.unpack_from('<i', data, 32)
+    names = read_names(data, 36, l_nm)
+    pos = 36 + l_nm
+    starts = {}
+    for ref in range(n_ref):
+        n_bin, = struct.unpack_from('<i', data, pos)
+        pos += 4
+        first = None
+        for b in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from('<Ii', data, pos)
+            pos += 8
+            if bin_id != TBI_META_BIN and n_chunk > 0:
+                begs = struct.unpack_from(f'<{2*n_chunk}Q', data, pos)[0::2]
+                first = min(begs) if first == None else min(first, min(begs))
+            pos += 16 * n_chunk
+        n_intv, = struct.unpack_from('<i', data, pos)
+        pos += 4 + 8 * n_intv
+        if first != None:
+            starts[names[ref]] = first
+    return starts
+
+
+def read_csi(data):
+    '''
+    Args:
+        data: uncompressed content of a .csi file
+    Output:
+        starts: dictionary where key is contig name and value is the smallest virtual offset of its records
+    '''
+    min_shift, depth, l_aux = struct.unpack_from('<iii', data, 4)
+    if l_aux < 28:
+        #no tabix header in aux (e.g. a BCF index), the contig names are not in the index
+        raise Exception('csi index has no contig names')
+    l_nm, = struct.unpack_from('<i', data, 16 + 24)
+    names = read_names(data, 16 + 28, l_nm)
+    pos = 16 + l_aux
+    meta_bin = ((1 << 3 * (depth + 1)) - 1) // 7 + 1
+    n_ref, = struct.unpack_from('<i', data, pos)
+    pos += 4
+    starts = {}
+    for ref in range(n_ref):
+        n_bin, = struct.unpack_from('<i', data, pos)
+        pos += 4
+        first = None
+        for b in range(n_bin):
+            bin_id, loffset, n_chunk = struct.unpack_from('<IQi', data, pos)
+            pos += 16
+            if bin_id != meta_bin and n_chunk > 0:
+                begs = struct.unpack_from(f'<{2*n_chunk}Q', data, pos)[0::2]
+                first = min(begs) if first == None else min(first, min(begs))
+            pos += 16 * n_chunk
+        if first != None:
+            starts[names[ref]] = first
+    return starts
+
+
+def contig_starts(vcf):
+    '''
+    reads the index of a bgzipped vcf
+    Args:
+        vcf: path to vcf.gz
+    Output:
+        starts: dictionary where key is contig name and value is the virtual offset of its first record,
+                or None if vcf is not bgzipped or has no index
+    '''
+    index = find_index(vcf)
+    if index == None or not is_bgzf(vcf):
+        return None
+    with gzip.open(index, 'rb') as f:
+        data = f.read()
+    if data[:4] == b'TBI\x01':
+        return read_tbi(data)
+    if data[:4] == b'CSI\x01':
+        return read_csi(data)
+    raise Exception(f'{index} is not a tabix or csi index')
+
+
+def contig_lines(vcf, voffset, contig):
+    '''
+    reads the lines of one contig of an indexed vcf.gz, decompressing only from its first block onwards
+    Args:
+        vcf: path to bgzipped vcf
+        voffset: virtual offset of the first record of the contig (from contig_starts)
+        contig: contig name, reading stops at the first line of another contig
+    Output:
+        yields the text lines of the contig's records
+    '''
+    prefix = contig + '\t'
+    with open(vcf, 'rb') as f:
+        f.seek(voffset >> 16)
+        with gzip.GzipFile(fileobj=f) as g:
+            g.read(voffset & 0xffff)
+            for line in io.TextIOWrapper(g):
+                if not line.startswith(prefix):
+                    break
+                yield line
@@ -0,0 +1,132 @@
+# update_cohort.py
+"""
+Nightly cohort update: only the SRA accessions that are not in the combined diff yet are converted.
+The SRA list is compared with the index of the combined diff (the cohort of the previous run), the new
+samples go through run_vcftodiff.py, and their diffs are
+    - appended to the combined diff and its index (see combine_diffs.append_diffs)
+    - appended to the cohort store, if one is kept (see cohort_store.append_store)
+    - written on their own to a new-samples diff, for usher-sampled to place on the existing tree
+so an update costs O(new samples), not O(cohort). Samples that fail are left out and tried again next run.
+
+    python scripts/update_cohort.py -vd PATH/vcfs -bd PATH/beds -wd PATH/diffs -sl sra_list.txt -o combined_diff.diff -s cohort.store
+    usher-sampled -i PATH/tree.pb --diff new_samples.diff --ref PATH/reference.fasta -o PATH/tree.pb
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+from combine_diffs import combine_diffs, append_diffs, read_index, index_path
+from cohort_store import ingest, append_store, CohortStore
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def new_samples(sl, combined):
+    '''
+    Args:
+        sl: file with the list of SRA of the whole cohort
+        combined: path to the combined diff of the previous run (may not exist yet)
+    Output:
+        (new, known): SRA in sl that are not in combined (in list order, without repeats) and the number already in it
+    '''
+    known = read_index(combined) if os.path.exists(index_path(combined)) else {}
+    new = []
+    seen = set()
+    with open(sl) as f:
+        for sra in f:
+            sra = sra.strip()
+            if sra != '' and sra not in known and sra not in seen:
+                seen.add(sra)
+                new.append(sra)
+    return new, len(known)
+
+
+def read_report(report):
+    '''
+    Output:
+        dictionary where key is SRA and value is its status in a run_vcftodiff_report.tsv
+    '''
+    status = {}
+    with open(report) as f:
+        next(f)
+        for line in f:
+            sra, state = line.rstrip('\n').split('\t')[:2]
+            status[sra] = state
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-vd', '--VCF_directory', required=True, type=str, help='path to directory of single-sample VCFs')
+    parser.add_argument('-wd', '--working_directory', required=True, type=str, help='directory of the per-sample diff files (and the new-samples list)')
+    parser.add_argument('-bd', '--bedgraph_directory', required=False, type=str, help='path to directory of bed coverage files (see run_vcftodiff.py)')
+    parser.add_argument('-ad', '--alignment_directory', required=False, type=str, help='path to directory of sorted, indexed aligned_{sra}.bam/.cram files (see run_vcftodiff.py)')
+    parser.add_argument('-ref', '--reference', required=False, type=str, help='reference fasta, for CRAM alignments')
+    parser.add_argument('-sl', '--SRA_list_file', required=True, type=str, help='file with the list of SRA of the whole cohort, old and new')
+    parser.add_argument('-o', '--combined', required=True, type=str, help='combined diff of the cohort, new samples are appended to it (made if it does not exist)')
+    parser.add_argument('-s', '--store', required=False, type=str, default=None, help='cohort store to append the new samples to (built from -o first if it does not exist)')
+    parser.add_argument('-n', '--new_diff', required=False, type=str, default=None, help='diff of only the new samples, for usher-sampled (default: new_samples.diff next to -o, it must not be in -wd)')
+    parser.add_argument('-smf', '--species_maskfile', required=False, type=str, help='path to bed file of commonly masked regions of genome (or its .npy index from compile_mask.py)')
+    parser.add_argument('-cd', '--coverage_depth', required=False, default=10, type=int, help='minimum coverage depth for any given call before that call is considered dubious')
+    parser.add_argument('-fai', '--reference_index', required=False, type=str, help='reference.fasta.fai with the contig lengths (default: built-in C. auris contigs)')
+    parser.add_argument('-c', '--compact', required=False, action='store_true', help="combine adjacent missing-data ('-') diff lines into one line")
+    parser.add_argument('-j', '--jobs', required=False, default=os.cpu_count(), type=int, help='number of samples converted (and diffs stored) in parallel')
+    args = parser.parse_args()
+    if args.bedgraph_directory == None and args.alignment_directory == None:
+        parser.error('one of -bd (bedgraphs) or -ad (BAM/CRAM alignments) is needed for the low-depth mask')
+    wd = args.working_directory
+    combined = args.combined
+    store = args.store
+    #the new-samples diff is kept out of wd, where combine_diffs.py and cohort_store.py would take it for one more sample
+    new_diff = args.new_diff if args.new_diff != None else os.path.join(os.path.dirname(combined), 'new_samples.diff')
+    if os.path.abspath(os.path.dirname(new_diff)) == os.path.abspath(wd):
+        parser.error('-n must not be in -wd, every .diff there is taken for a sample')
+    os.makedirs(wd, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(new_diff)), exist_ok=True)
+
+    new, n_known = new_samples(args.SRA_list_file, combined)
+    print(f"{n_known} samples already in {combined}, {len(new)} new")
+    new_list = os.path.join(wd, 'new_samples.txt')
+    with open(new_list, 'w') as f:
+        f.writelines(f'{sra}\n' for sra in new)
+
+    done = []
+    failed = False
+    if new != []:
+        # convert the new samples only, with the same options a full run would use
+        cmd = [sys.executable, os.path.join(SCRIPTS, 'run_vcftodiff.py'), '-vd', args.VCF_directory, '-wd', wd, '-sl', new_list,
+               '-cd', str(args.coverage_depth), '-j', str(args.jobs)]
+        for flag, value in (('-bd', args.bedgraph_directory), ('-ad', args.alignment_directory), ('-ref', args.reference),
+                            ('-smf', args.species_maskfile), ('-fai', args.reference_index)):
+            if value != None:
+                cmd += [flag, value]
+        if args.compact:
+            cmd.append('-c')
+        # a non-zero exit only means some samples failed, the ones that converted are still added
+        failed = subprocess.run(cmd).returncode != 0
+        status = read_report(os.path.join(wd, 'run_vcftodiff_report.tsv'))
+        done = [sra for sra in new if status.get(sra) in ('converted', 'cached')]
+        skipped = [sra for sra in new if sra not in done]
+        if skipped != []:
+            print(f"Not added (will be tried again next run): {', '.join(skipped[:20])}" + (' ...' if len(skipped) > 20 else ''))
+
+    diffs = [os.path.join(wd, f'{sra}.diff') for sra in done]
+    # the new samples on their own, for placing them on the existing tree
+    combine_diffs(diffs, new_diff)
+    print(f"Wrote {len(diffs)} new samples to {new_diff}")
+
+    if store != None:
+        # a store started after the combined diff catches up from it once
+        if not os.path.exists(store) and os.path.exists(combined):
+            ingest([combined], store, args.jobs)
+        # the combined diff is updated last, so samples an interrupted run already stored are not stored twice
+        stored = set(CohortStore(store).samples) if os.path.exists(store) else set()
+        n = append_store(store, [diff for sra, diff in zip(done, diffs) if sra not in stored], args.jobs)
+        print(f"Added {n} samples to {store}")
+    append_diffs(diffs, combined)
+    print(f"Added {len(diffs)} samples to {combined} ({n_known + len(diffs)} samples)")
+
+    if failed:
+        sys.exit(1)
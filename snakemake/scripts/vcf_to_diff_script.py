@@ -1,34 +1,23 @@
 import os
 import argparse
 import gzip
+import heapq
 import logging
-import subprocess
-
-#this script requires individual VCFs
-parser = argparse.ArgumentParser()
-parser.add_argument('-v', '--VCF', required=True, type=str,help='path to single-sample VCF')
-parser.add_argument('-d', '--working_directory', required=True, type=str, help='directory for all outputs (make sure this directory will have enough space!!!!)')
-parser.add_argument('-smf', '--species_maskfile', required=False, type=str, help='path to bed file of commonly masked regions of genome')
-parser.add_argument('-bed', '--bedgraph', required=False, type=str, help="path to bed coverage file (bedgraph) for vcf")
-parser.add_argument('-cd', '--coverage_depth', required=False, default=10, type=int, help="minimum coverage depth for any given call before that call is considered dubious")
-parser.add_argument('-l', '--logging', required=False, default=True, type=bool, help="if True, logging.debug verbose logging to diff.log, else suppress most logging")
-
-args = parser.parse_args()
-vcf = args.VCF
-wd = args.working_directory
-smf = args.species_maskfile
-bed = args.bedgraph
-min_coverage = args.coverage_depth
-#makes sure input path wont cause error
-if wd[-1] != '/':
-    wd = wd+'/'
-
-if args.logging is True:
-    logging.basicConfig(filename=f"{wd}{os.path.basename(vcf[:-4])}.log", filemode='a', level=logging.DEBUG,
-        format="%(asctime)s %(funcName)s@%(lineno)d::%(levelname)s: %(message)s", datefmt="%I:%M:%S %p")
-    logging.info(f"Arguments:\n\tvcf = {vcf}\n\twd = {wd}\n\tsmf={smf}\n\tbed={bed}\n\tmin_coverage={min_coverage}\n\tl={args.logging}")
-else:
-    logging.basicConfig(level=logging.WARNING)
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from intervals import Intervals, MISSING, write_records
+
+from contig_offsets import load_offsets, load_lengths, offsets_from_lengths, merged_contig
+from conversion_cache import temp_path
+import tabix_index
+import bam_coverage
+from tabix_index import is_gzipped
+from merge_contigs_bed import read_blocks, parse_block, parse_coverage
+import interval_sweep
+import stage_metrics
+from stage_metrics import SampleMetrics
 
 #len_ref = 4411532
 
@@ -42,7 +31,7 @@ def find_snps(line):
     args: 
         line: a list containg the line from the VCF
     output:
-        lines: a list of lists of lines to be added to the diff file 
+        lines: a list of (allele, start, length) records to be added to the diff file 
     '''
     ref = line[3]
     alt = line[4]
@@ -54,7 +43,7 @@ def find_snps(line):
     #generate new lines for diff file
     lines = []
     for s in range(len(snps)):
-        lines.append([alt[snps[s]], str(int(line[1])+snps[s]), '1'])
+        lines.append((alt[snps[s]], int(line[1])+snps[s], 1))
 
     return lines
 
@@ -64,7 +53,7 @@ def process_dels(line):
     Args: 
         line: a list containing info from a line of the VCF
     output:
-        l: a list containing the diff-formatted version of the deletion
+        l: an (allele, start, length) record of the deletion
     '''
     ref = line[3]
     alt = line[4]
@@ -73,15 +62,15 @@ def process_dels(line):
 
     #make sure remaining alt nucleotide is the same as the corresponding ref nuc
     if alt[0] == ref[0]:
-        l = ['-', str(int(line[1])+1), str(end-1)]
+        l = ('-', int(line[1])+1, end-1)
 
     elif alt[0]  == '-':
         #this is for missing data
-        l = ['-', line[1], str(end)]
+        l = ('-', int(line[1]), end)
 
     else:
         #this is a scenario that could be represented by a snp at the first ref position
-        l = ['-', line[1], str(len(line[3]))]
+        l = ('-', int(line[1]), len(line[3]))
         
     return l
  
@@ -91,15 +80,15 @@ def process_others(line):
     Args:
         line: a list containing info from a line of the VCF
     Input: 
-        l: a list containing the diff-formatted version of the line
+        l: an (allele, start, length) record of the line
     '''
     ref = line[3]
     alt = line[4]
     end = len(ref)
     if ref < alt:
-        l = ['-', line[1], str(end)]
+        l = ('-', int(line[1]), end)
     if ref > alt:
-        l = ['-', line[1], str(end)]
+        l = ('-', int(line[1]), end)
 
     return l
 
@@ -110,289 +99,313 @@ def mask_TB(smf):
     Args:
         smf: bed file with positions to be ignored (note positions are assumed to be 0 indexed)
     Output:
-        tb_sites: dictionary where key is start of masked region (1 index) and value is end of masked region (not inclusive)
+        tb_sites: Intervals of masked regions sorted by start (1 index)
     '''
-    tb_sites = {}
+    #key is start of masked region and value is end of masked region (not inclusive), a later line with the same start wins
+    ends = {}
     with open(smf) as file:
         for line in file:
             line=line.strip().split()
-            tb_sites[int(line[1])+1] = int(line[2])+1
+            ends[int(line[1])+1] = int(line[2])+1
+    starts = sorted(ends)
+    tb_sites = Intervals.from_regions(starts, [ends[start] for start in starts])
     return tb_sites
 
-def mask_low_depth(bed, min_coverage):
+def read_bedgraph_chunks(bed, chunk_bytes=1<<24, offsets=None):
+    '''
+    reads the start, end and coverage columns of a bedgraph in bulk, one block of lines at a time
+    Args:
+        bed: path to bed coverage file (4 columns: contig, start, end, coverage), plain or gzipped
+        chunk_bytes: roughly how much of the file is parsed per block
+        offsets: contig offset table (see contig_offsets.py), the positions of every contig in the table are shifted 
+                 onto the merged chromosome as they are read, so a per-contig bedgraph needs no merge_contigs_bed.py
+                 (the merged chromosome is read as it is, any other contig is dropped like the vcf reader drops it)
+    Output:
+        yields (starts, ends, coverage) numpy arrays for every block of lines
+    '''
+    opener = gzip.open if is_gzipped(bed) else open
+    with opener(bed, 'rb') as cf:
+        for block in read_blocks(cf, chunk_bytes):
+            buf, runs, starts, ends, cov_begin, cov_end = parse_block(block)
+            if offsets != None:
+                keep = None
+                for contig, a, b in runs:
+                    offset = offsets.get(contig)
+                    if offset != None:
+                        starts[a:b] += offset
+                        ends[a:b] += offset
+                    elif contig != merged_contig:
+                        #e.g. a mitochondrial contig or plasmid, it would land on the first contig of the merged chromosome
+                        if keep is None:
+                            keep = np.ones(len(starts), dtype=bool)
+                        keep[a:b] = False
+                if keep is not None:
+                    starts, ends, cov_begin, cov_end = starts[keep], ends[keep], cov_begin[keep], cov_end[keep]
+            yield starts, ends, parse_coverage(buf, cov_begin, cov_end)
+
+def load_species_mask(smf):
+    '''
+    loads the species masks: a mask index made by compile_mask.py (.npy) is memory-mapped, so it costs almost 
+    nothing per sample and its pages are shared by all workers, anything else is read as a bed file with mask_TB
+    Args:
+        smf: mask index (.npy) or bed file with positions to be ignored
+    Output:
+        tb_sites: Intervals of masked regions sorted by start (1 index)
+    '''
+    if smf.endswith('.npy'):
+        index = np.load(smf, mmap_mode='r')
+        return Intervals.from_arrays(index[0], index[1])
+    return mask_TB(smf)
+
+def mask_low_depth(bed, min_coverage, offsets=None):
     '''
     read bed coverage file and generate sites to be masked 
     note: if coverage does not have HR37c reference it will throw an error (this can be changed)
     note: bed files are 0-indexed in col1 and 1-indexed in col2, i am adding one to both to make them both one indexed
+    note: low coverage lines are combined when a line starts exactly where the previous low coverage line ended
     Args: 
-        bed: path to bed coverage file 
+        bed: path to bed coverage file, either merged (merge_contigs_bed.py) or per contig with offsets
         min_coverage: integer indicating coverage depth needed 
+        offsets: contig offset table, contigs in it are shifted while reading (the merged one is read as it is, others are dropped)
     out:
-        low_depth_sites: dictionary of low-depth sites needing to be masked 
+        low_depth_sites: (starts, ends) sorted numpy arrays of low-depth regions needing to be masked (1 index, end not inclusive)
     '''
-    low_depth_sites = {}
-    prev = None
-    with open(bed) as cf:
-        for line in cf:
-            #might need to delete or change this
-            #for currect bed coverage file 
-            #NEED TO FIX FOR TAYLOR
-            #if line.startswith('NC_000962.3'):
-            #assumes a single reference is used
-            line = line.strip().split()
-            #re-index to match VCF
-            line[1] = str(int(line[1])+1)
-            line[2] = str(int(line[2])+1)
-            #if the coverage is below min_coverage
-            if int(line[3]) < min_coverage:
-                if prev == None:
-                    #for first low-coverage line in file
-                    low_depth_sites[int(line[1])] = int(line[2])
-                    prev = [int(line[1]), int(line[2])]
-                else:
-                    #for all subsequent low-coverage lines, determine if they can be combined 
-                    #if start of line is the same as the end of prev
-                    if int(line[1]) == prev[1]:
-                        #combine sites and update prev
-                        low_depth_sites[prev[0]] = int(line[2])
-                        prev[1] = int(line[2])
-                    #create a new site and update prev
-                    else:
-                        low_depth_sites[int(line[1])] = int(line[2])
-                        prev = [int(line[1]), int(line[2])]
+    starts, ends = low_depth_regions(read_bedgraph_chunks(bed, offsets=offsets), min_coverage)
     #this conditional might need to be fixed if there are no low-coverage areas
-    if low_depth_sites == {}:
+    if len(starts) == 0:
         raise Exception('coverage file has incorrect reference')
+    return starts, ends
 
-    return low_depth_sites
-
-"""
-NOT FOR USE WITH UNIVERSAL MASK2REF
-def check_prev_mask(prev, line):
+def low_depth_regions(chunks, min_coverage):
     '''
-    when merging low depth and tb masks, make sure the masks are not overlapping with previously added masks
+    thresholds coverage blocks and combines the low coverage lines into regions (see mask_low_depth)
     Args:
-        prev: a list of the start and stop of the previously added mask region 
-        line: a list of the start and stop of the to-be-added mask region
+        chunks: iterable of (starts, ends, coverage) numpy arrays in bedgraph coordinates (0 index start, 1 index end)
+        min_coverage: integer indicating coverage depth needed 
+    Output:
+        (starts, ends) sorted numpy arrays of low-depth regions (1 index, end not inclusive), empty if there are none
+    '''
+    run_starts = []
+    run_ends = []
+    for starts, ends, coverage in chunks:
+        #re-index to match VCF and keep the low coverage lines only
+        low = coverage < min_coverage
+        starts = starts[low] + 1
+        ends = ends[low] + 1
+        if len(starts) == 0:
+            continue
+        #a new region starts wherever a line does not start at the end of the previous line
+        breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+        first = np.concatenate(([0], breaks))
+        last = np.concatenate((breaks - 1, [len(starts) - 1]))
+        block_starts = starts[first]
+        block_ends = ends[last]
+        #combine with the last region of the previous block
+        if run_ends and block_starts[0] == run_ends[-1][-1]:
+            run_ends[-1][-1] = block_ends[0]
+            block_starts = block_starts[1:]
+            block_ends = block_ends[1:]
+        if len(block_starts) > 0:
+            run_starts.append(block_starts)
+            run_ends.append(block_ends)
+
+    if run_starts == []:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    starts = np.concatenate(run_starts)
+    ends = np.concatenate(run_ends)
+    #keep regions sorted by start even if the bedgraph wasn't
+    if np.any(starts[1:] < starts[:-1]):
+        order = np.argsort(starts, kind='stable')
+        starts = starts[order]
+        ends = ends[order]
+    return starts, ends
+
+def contig_low_depth(bam, contig, length, offset, min_coverage, reference=None):
+    '''
+    low-depth regions of one contig of an indexed BAM/CRAM (runs in a worker, see bam_low_depth)
     Output:
-        overlap: a boolean meant to indicate if prev and line overlap
-        change: a list containing important information for updating the prev value
+        (starts, ends) numpy arrays of the contig's low-depth regions, shifted by offset
     '''
-    #currently not checking overlap to left of prev bc that indicates a bigger error
-    #may need to change?
-    overlap = False
-    change = None
-    
-    prev_s = int(prev[0])
-    prev_e = int(prev[1])
-    line_s = int(line[0])
-    line_e = int(line[1])
+    return low_depth_regions(bam_coverage.depth_chunks(bam, contig, length, offset, reference), min_coverage)
 
+def bam_low_depth(bam, lengths, min_coverage, jobs=1, reference=None):
     '''
-    DEBUGGING
-    logging.debug('prev', prev_s, prev_e, 'line', line_s, line_e)
-    '''
-
-    #NO OTHER CONDITIONALS NEEDED BC LINE CANT BE TO THE LEFT OF PREV AND IF LINE HAS NO OVERLAP W PREV NO TRACKING IS NEEDED 
-    #add error checking to make sure line isn't to left of prev?
-
-    #if line is completely contained inside prev, line should not be added to all_sites 
-    if line_s >= prev_s and line_e <= prev_e:
-        overlap = True
-    #if line is overlapping the right end of prev
-    elif line_s >= prev_s and line_s <= prev_e and line_e >= prev_e:
-        overlap = True 
-        prev[1] = line_e
-        change = prev
-    return overlap, change
+    finds the low-depth regions straight from the alignments instead of a bedgraph, one contig per worker
+    only the low-depth regions are kept, the per-base depth is thresholded as samtools writes it
+    Args:
+        bam: path to a sorted and indexed BAM/CRAM
+        lengths: a list of (contig, length) tuples in reference order (see contig_offsets.load_lengths), every contig 
+                 is scanned and positions samtools does not print are depth 0
+        min_coverage: integer indicating coverage depth needed 
+        jobs: number of workers
+        reference: reference fasta (for CRAM)
+    Output:
+        low_depth_sites: (starts, ends) sorted numpy arrays of low-depth regions (1 index, end not inclusive)
+    '''
+    if bam_coverage.find_index(bam) == None:
+        raise Exception(f'{bam} has no index, run samtools index {bam}')
+    offsets = offsets_from_lengths(lengths)
+    if jobs > 1:
+        logging.info(f'Reading the depth of {len(lengths)} contigs of {bam} with {jobs} workers')
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            regions = [pool.submit(contig_low_depth, bam, c, length, offsets[c], min_coverage, reference) for c, length in lengths]
+            regions = [r.result() for r in regions]
+    else:
+        regions = [contig_low_depth(bam, c, length, offsets[c], min_coverage, reference) for c, length in lengths]
+    #contigs are laid end to end, combine regions that run over the end of one contig into the next
+    return low_depth_regions(((starts - 1, ends - 1, np.zeros(len(starts))) for starts, ends in regions), 1)
 
+#diff alleles that carry a length (missing data); runs of other alleles are left one record per line
+squishable = {MISSING, ord('n'), ord('N')}
 
-def condense_mask_regions(low_depth_sites,tb_sites):
-    '''
-    for instances with low-depth masking, combine low-depth masks and universal masks into a single data structure 
-    Args: 
-        low_depth_sites: a dictionary containing low-depth sites to be masked
-        tb_sites: a dictionary containing universal masking sites 
-    Output:
-        all_sites: a dictionary containing all masking sites from both universal and low-depth
-    '''
-    #editing thought: would likely benefit from being a list rather than a dictionary 
-    tb_keys = sorted(tb_sites.keys())
-    ld_keys = sorted(low_depth_sites.keys())
-    all_sites = {}
-    tb_keys_ind = 0
-    ld_keys_ind = 0
-    #cont = 0
-
-    #track previous line in all_sites
-    prev = None
-    #iterate through tb_keys and ld_keys exactly 1 time, track index of keys as you iterate
-    while tb_keys_ind < len(tb_keys) or ld_keys_ind < len(ld_keys):
-        #if still iterating through both lists
-        if tb_keys_ind < len(tb_keys) and ld_keys_ind < len(ld_keys): 
-            tb_start = tb_keys[tb_keys_ind]
-            tb_end =  tb_sites[tb_keys[tb_keys_ind]]
-            ld_start = ld_keys[ld_keys_ind]
-            ld_end = low_depth_sites[ld_keys[ld_keys_ind]]
-
-            if ld_start < tb_start:
-                if ld_end < tb_start:
-                    #the low-depth site is completely to the left of the universal site
-                    if prev != None:
-                        #before adding to all_sites, make sure it doesn't overlap prev
-                        overlap, change = check_prev_mask(prev, [ld_start, ld_end])
-                        #if overlap is detected AND requires prev to be updated
-                        if overlap == True and change != None:
-                            #update prev in all_sites
-                            all_sites[change[0]] = change[1]
-                    if prev == None or overlap == False:
-                        #add new site to all_sites
-                        all_sites[ld_start] = ld_end
-                    #update ld index because site was processed
-                    ld_keys_ind += 1
-                elif ld_end >= tb_start:
-                    #this accounts for ld overlapping tb on the left
-                    if prev != None:
-                        overlap, change = check_prev_mask(prev, [ld_start, tb_end])
-                        if overlap == True and change != None:
-                            #if new region overlaps, update prev
-                            all_sites[change[0]] = change[1]
-                    #if there is no overlap, add new region to all_sites
-                    if prev == None or overlap == False:
-                        all_sites[ld_start] = tb_end
-                    #since both regions are added at the same time, update index for both lists
-                    tb_keys_ind += 1
-                    ld_keys_ind += 1
-            
-            elif ld_start <= tb_end and ld_end > tb_end:
-                #if ld overlaps tb on the right
-                if prev != None:
-                    #before adding to all_sites, make sure it doesn't overlap prev
-                    overlap,change = check_prev_mask(prev, [tb_start, ld_end])
-                    if overlap == True and change != None:
-                        all_sites[change[0]] = change[1]
-                #if there is no overlap, add new region to all_sites
-                if prev == None or overlap == False:
-                    all_sites[tb_start] = ld_end
-                #since both regions are added at the same time, update index for both lists
-                tb_keys_ind += 1
-                ld_keys_ind += 1
-
-            elif ld_start > tb_end:
-                #if there is no overlap between ld and tb, and ld is on the right
-                if prev != None:
-                    #before adding to all_sites, make sure it doesn't overlap prev
-                    overlap,change = check_prev_mask(prev, [tb_start, tb_end])
-                    if overlap == True and change != None:
-                        all_sites[change[0]] = change[1]
-                if prev == None or overlap == False:
-                    #if there is no overlap, add new region to all_sites
-                    all_sites[tb_start] = tb_end
-                tb_keys_ind += 1
-
-            elif ld_start >= tb_start and ld_end <= tb_end:
-                # if tb and ld fully overlap with ld inside
-                if prev != None:
-                    #make sure tb doesnt overlap prev 
-                    overlap,change = check_prev_mask(prev, [tb_start, tb_end])
-                    if overlap == True and change != False:
-                        all_sites[change[0]] = change[1]
-                if prev == None or overlap == False:
-                    all_sites[tb_start] = tb_end
-                tb_keys_ind += 1
-                ld_keys_ind += 1
-
-            
-            elif ld_start <= tb_start and ld_end >= tb_end:
-                #if ld and tb fully overlap with tb inside
-                if prev != None:
-                    #make sure ld doesnt overlap prev
-                    overlap,change = check_prev_mask(prev, [ld_start, ld_end])
-                    if overlap == True and change != None:
-                        all_sites[change[0]] = change[1]
-                if prev == None or overlap == False:
-                    all_sites[ld_start] = ld_end
-                tb_keys_ind += 1
-                ld_keys_ind += 1
-                
-            #covered all 6 possible positions of the two regions
-            '''
-            DEBUG
-            logging.debug('ld',ld_keys[ld_keys_ind], low_depth_sites[ld_keys[ld_keys_ind]])
-            '''
-
-        #possible bug: prev overlaps with one list the first time the other list expires
-        elif tb_keys_ind >= len(tb_keys) and ld_keys_ind < len(ld_keys):
-            #if reach end of tb_masks process ld only
-            ld_start = ld_keys[ld_keys_ind]
-            ld_end = low_depth_sites[ld_keys[ld_keys_ind]]
-            all_sites[ld_start] = ld_end
-            ld_keys_ind += 1
-
-        #possible bug: prev overlaps with one list the first time the other list expires
-        elif ld_keys_ind >= len(ld_keys) and tb_keys_ind < len(tb_keys):
-            #if reach end of ld masks process tb only
-            tb_start = tb_keys[tb_keys_ind]
-            tb_end = tb_sites[tb_keys[tb_keys_ind]]
-            all_sites[tb_start] = tb_end
-            tb_keys_ind += 1 
-
-        #keep all sites sorted
-        if len(all_sites) > 0:
-            all_sites_keys = sorted(all_sites.keys())
-        #track last site for every iteration
-        prev = [all_sites_keys[-1],all_sites[all_sites_keys[-1]]]
-    return all_sites
-    """
-                    
 def squish(lines):
     '''
-    condenses diff lines that can be compressed into a single line
+    condenses diff lines that can be compressed into a single line, one record at a time
+    (optional pipeline stage, run after masking with --compact)
+    only runs of '-'/'n' records are combined, since those are the only alleles with a length in the diff format 
     Args:
-        lines: a list of diff-formatted lines each stored as a list
+        lines: an iterable of [allele code, start, length] diff records sorted by start
     Outputs:
-        newlines: a list of diff-formatted lines after compression
+        yields [allele code, start, length] diff records after compression
     '''
     #track previous line in lines
     prev = None
-    #create a new list of lines for after compression
-    newLines = []
     for line in lines:
-        #skip header 
-        if not line[0].startswith('>'):
-            #if not the first line in the file
-            if prev != None:
-                #if prev and line have the same nucleotide
-                if prev[0] == line[0]:
-                    #if end of prev overlaps w beginning of line
-                    if int(prev[1]) == int(line[1])-int(prev[2]):
-                        #rewrite prev and line into a new prev
-                        prev[2] = str(int(prev[2])+int(line[2]))
-                    else:
-                        #if prev and line don't overlap, add prev to newLines and update prev
-                        newLines.append(prev) 
-                        prev = line
-                else:
-                    #if prev and line don't overlap, add prev to newLines and update prev
-                    newLines.append(prev) 
-                    prev = line
-            
-            #the first line of file becomes prev variable 
+        #if not the first line in the file
+        if prev != None:
+            #if prev and line have the same nucleotide and end of prev is the beginning of line
+            if prev[0] == line[0] and prev[0] in squishable and prev[1]+prev[2] == line[1]:
+                #rewrite prev and line into a new prev
+                prev[2] = prev[2]+line[2]
             else:
-                prev = line
-        #write header to new file
+                #if prev and line don't overlap, yield prev and update prev
+                yield prev
+                prev = list(line)
+        
+        #the first line of file becomes prev variable 
         else:
-            newLines.append(line)
-    #add last prev to end of newLines
+            prev = list(line)
+    #add last prev
     if prev != None:
-        newLines.append(prev)  
+        yield prev
+
+def stream_gt_records(vcf_file, offsets):
+    '''
+    reads a single sample vcf (compressed or not) exactly once, keeping only GT and moving every position 
+    onto one big chromosome. replaces bcftools annotate + merge_contigs_vcf.py, so no filtered/merged/temp VCFs 
+    are written
+    NOTE: records on contigs that are not in offsets are dropped (same as merge_contigs_vcf.py)
+    Args:
+        vcf_file: path to single sample vcf (.vcf or .vcf.gz)
+        offsets: dictionary where key is contig name and value is the number added to POS
+    Output:
+        yields the column name line and then every position line as a list of columns, 
+        with the genotype of the sample as the last column
+    '''
+    return stream_gt_columns(vcf_file, offsets, [9])
+
+def stream_gt_columns(vcf_file, offsets, columns):
+    '''
+    same as stream_gt_records for any set of sample columns of a (multi-sample) vcf
+    Args:
+        vcf_file: path to vcf (.vcf or .vcf.gz)
+        offsets: dictionary where key is contig name and value is the number added to POS
+        columns: column numbers of the samples to keep (the first sample is column 9)
+    Output:
+        yields the column name line and then every position line as a list of columns: the 8 site columns, 
+        'GT' and the genotype of every sample in columns
+    '''
+    if is_gzipped(vcf_file):
+        v = gzip.open(vcf_file, 'rt')
     else:
-        #prev should probably not be None
-        logging.warning('no lines in file?')
-    #should i overwrite lines variable for storage consideration?
-    return newLines
+        v = open(vcf_file, 'rt')
+    columns_seen = False
+    with v:
+        for line in v:
+            #ignore header lines
+            if line.startswith('##'):
+                continue
+            #column names
+            if line.startswith('#'):
+                columns_seen = True
+                line = line.rstrip('\n').split('\t')
+                yield line[:9] + [line[c] for c in columns]
+                break
+            raise Exception(f'{vcf_file} does not look like a VCF (no #CHROM line before the first record)')
+        if not columns_seen:
+            raise Exception(f'{vcf_file} does not look like a VCF (no #CHROM line)')
+        #the rest of the file are position lines
+        yield from gt_columns(v, offsets, columns)
+
+def gt_columns(lines, offsets, columns):
+    '''
+    keeps only the GT of the sample columns of vcf position lines and moves them onto one big chromosome
+    NOTE: records on contigs that are not in offsets are dropped
+    Args:
+        lines: iterable of vcf position lines (text, no header lines)
+        offsets: dictionary where key is contig name and value is the number added to POS
+        columns: column numbers of the samples to keep (the first sample is column 9)
+    Output:
+        yields every position line as a list of columns: the 8 site columns, 'GT' and the genotype of every sample in columns
+    '''
+    for line in lines:
+        line = line.rstrip('\n').split('\t')
+        offset = offsets.get(line[0])
+        if offset is None:
+            continue
+        if offset:
+            line[1] = str(int(line[1]) + offset)
+        #GT is the first FORMAT field when it is present
+        fmt = line[8].split(':')
+        if fmt[0] == 'GT':
+            gts = [line[c].split(':', 1)[0] for c in columns]
+        elif 'GT' in fmt:
+            gt = fmt.index('GT')
+            gts = [line[c].split(':')[gt] for c in columns]
+        else:
+            gts = ['./.'] * len(columns)
+        yield line[:8] + ['GT'] + gts
+
+def contig_to_diff(vcf_file, voffset, contig, offset):
+    '''
+    converts the records of one contig of an indexed single sample vcf.gz, decompressing only that contig
+    (runs in a worker, see indexed_records)
+    Args:
+        vcf_file: path to bgzipped vcf with a .tbi/.csi index
+        voffset: virtual offset of the contig's first record (from tabix_index.contig_starts)
+        contig: contig name
+        offset: number added to the contig's positions
+    Output:
+        diff: Intervals of the contig's diff records
+    '''
+    lines = tabix_index.contig_lines(vcf_file, voffset, contig)
+    return Intervals.from_records(records_to_diff(gt_columns(lines, {contig: offset}, [9])))
 
-def vcf_to_diff(vcf_file, sample):
+def indexed_records(vcf_file, offsets, jobs):
+    '''
+    converts an indexed single sample vcf.gz with one worker per contig, so a deeply sequenced sample is 
+    decompressed and parsed in parallel
+    Args:
+        vcf_file: path to bgzipped vcf
+        offsets: dictionary where key is contig name and value is the number added to POS
+        jobs: number of workers
+    Output:
+        yields [allele code, start, length] diff records of all contigs in offset order, 
+        or None if the vcf is not bgzipped or has no .tbi/.csi index
+    '''
+    starts = tabix_index.contig_starts(vcf_file)
+    if starts == None:
+        return None
+    #records on contigs that are not in offsets are dropped (same as stream_gt_records)
+    contigs = sorted((c for c in starts if c in offsets), key=lambda c: offsets[c])
+    logging.info(f'{vcf_file} is indexed, converting {len(contigs)} contigs with {jobs} workers')
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        diffs = [pool.submit(contig_to_diff, vcf_file, starts[c], c, offsets[c]) for c in contigs]
+        diffs = [d.result() for d in diffs]
+    return (record for diff in diffs for record in diff)
+
+def vcf_to_diff(vcf_file):
     '''
     takes a single sample vcf and converts to diff format
     NOTE: this function makes the assumption that incoming diff file is genotyped as diploid
@@ -400,172 +413,150 @@ def vcf_to_diff(vcf_file, sample):
     Args: 
         vcf_file: uncompressed single sample vcf 
     Outputs:
-        diff_formatted_lines: a list of diff-formatted lines for the file
+        diff_formatted_lines: Intervals of diff records for the file (the '>sample' header is added by Intervals.write)
     ''' 
-
-    lines = []
     with open(vcf_file, 'rt') as v:
-        #missing = 0
-        total = 0
-        for line in v:
-            #ignore header lines
-            if not line.startswith('##'):
-                #find column names
-                if line.startswith('#'):
-                    line = line.strip().split()
-                    #last column name is single-sample vcf will be sample name
-                    #make diff file header
-                    lines.append([f'>{sample}'])
-                #all position lines
-                else:
-                    #total += int(len(line[3]))
-                    line = line.strip().split()
-                    #genotype
-                    var = line[-1]
-
-                    # for all lines with multiple alt alleles
-                    #if len(line[4].split(','))>1:
-                    #    logging.debug('OPTIONS!!!!', line[4].split(','))
-
-                    #combine ref allele and alt alleles
-                    alleles = [line[3]] + line[4].split(',')
-                    
-                    #if genotype is not reference allele
-                    if var != '0/0':
-
-                        #logging.debug("Not a reference allele")
-                        #logging.debug('line',line)
-                        #logging.debug('alleles', alleles)
-
-                        #split genotype to check for heterozygosity
-                        genos = var.split('/')
-                        
-                        if var == './.':
-                            #potentially useful to track number of positions with missing info 
-                            #missing += int(len(line[3]))
-                            line[4] = '-'
-                            line [-1] = '1'
-                            #logging.debug("Missing info")
-                            #logging.debug('missing', line)
-
-                        #assumes diploid genotype
-                        #if genotype is heterozygous and reference position is not and indel
-                        #NOTE: may need to change this later when indels are not ignored by usher 
-                    
-                        
-                        if len(genos) > 1 and genos[0]!= genos[1]:
-                            if len(line[3])==1:
-                                #logging.debug("Hetero")
-                                #logging.debug('HETERO', line)
-                                #logging.debug('genos', genos)
-                                #logging.debug('alleles', alleles)
-                                
-                                IUPAC = {
-                                    'R':['A','G'], 
-                                    'Y':['C','T'],
-                                    'S':['C','G'],
-                                    'W':['A','T'],
-                                    'K':['G','T'],
-                                    'M':['A','C']   
-                                        }
-                                
-                                #generated sorted list of both alleles genotyped 
-                                vars = sorted([alleles[int(genos[0])], alleles[int(genos[1])]])
-                                logging.debug('vars', vars)
-                                #if the heterozygous position is a SNP, replace with an IUPAC symbol
-                                if len(vars[0])==len(vars[1])==1:
-                                    logging.debug('SNP')
-                                    for key in IUPAC:
-                                        if IUPAC[key] == vars:
-                                            logging.debug('IUPAC key', key)
-                                            #alts = line[4].split(',')
-                                            #alt = alts[int(var)-1]
-                                            line[4] = key
-                                            line[-1] = '1'
-                                            logging.debug('line after ', line)
-                                            break
-
-                            ##if one of the vars is an indel, mask the position       
-                            if len(line[3])>1:
-                                logging.info('one of alleles is an indel, mask the ref for clarity')
-                                logging.debug(line)
-                                line[4] = '-'
-                                line [-1] = '1'
-                                logging.debug('after', line)
-
-                        #if reference is an indel and/or genotype is homozygous
-                        else: 
-                            var = var.split('/')
-                            var = var[0]
-                            alts = line[4].split(',')
-                            alt = alts[int(var)-1]
-                            line[4] = alt
-                            line[-1] = '1'
-
-                        #after above processing there should only be a string with one alt allele
-                        assert type(line[4]) == str
-
-                        #if len of ref position and len of alt are both one, process as a SNP
-                        if len(line[3]) == 1:
-                            if len(line[4]) == 1:
-                                lines.append([line[4],line[1], '1'])
-                            #if len(line[4]) > 1, the position is an insertion which will not be included in the file
-
-                        elif len(line[3]) > 1:
-                            if len(line[4]) == len(line[3]):
-                                #if the ref and alt are both longer than 1 but equal to each other,
-                                #search through alt for snps
-                                newlines = find_snps(line)
-                                for n in newlines:
-                                    lines.append(n)
-
-                            elif len(line[4]) == 1:
-                                #if ref is >1 and alt=1, process line as a simple deletion
-                                newline = process_dels(line)
-                                lines.append(newline)
-
-                            else:
-                                #if len(ref) and len(alt) are both greater than 1 but not the same len as each other
-                                newline = process_others(line)
-                                lines.append(newline)
-    
-    #compress adjacent diff lines where possible 
-    #diff_formatted_lines = squish(lines)
-    diff_formatted_lines = lines
+        #ignore header lines, everything else is split into columns
+        records = (line.strip().split() for line in v if not line.startswith('##'))
+        diff_formatted_lines = Intervals.from_records(records_to_diff(records))
     return diff_formatted_lines
 
-def make_files(samps,wd):
+#heterozygous SNP allele pair -> IUPAC symbol, in both orders so no sorting is needed
+IUPAC = {
+    ('A','G'): 'R', 
+    ('C','T'): 'Y',
+    ('C','G'): 'S',
+    ('A','T'): 'W',
+    ('G','T'): 'K',
+    ('A','C'): 'M',
+}
+IUPAC.update({(b, a): code for (a, b), code in list(IUPAC.items())})
+
+#genotype string -> parsed genotype, filled as genotypes are seen (a vcf only has a handful of different ones)
+genotype_cache = {}
+
+def parse_gt(gt):
     '''
-    Initializes VCF file for each sample in the VCF (will create smaller VCFs for multi-sample VCFs)
-    Args: 
-        samps: a list of sample names
-        vcf (global): string of the starting VCF name (only used to make sure new VCFs' filename differs from old VCF)
-        wd: a working directory where all files should be created *make sure directory contains enough space for all uncompressed 
-        sampleVCFs 
-    outputs:
-        files: a dictionary that has the column number as key and the VCF-file-to-create as the value
+    parses a GT field, phased or not: '0/1', '1|2', '1' (haploid) or './.'
+    Args:
+        gt: the GT field
+    Output:
+        (first allele, second allele) as allele numbers (a haploid allele is given twice), 
+        or None if any allele is missing
     '''
-    files = {}
-    for i in range(len(samps)):
-        logging.debug(f"samps[{i}] is {samps[i]}")
-    for i in range(len(samps)):
-        s = samps[i]
-        #replace '/' in sample name with '-'
-        if '/' not in s:
-            file = f"{wd}{s}.vcf"
-            #file = open(f'{wd}{s}.vcf','w')
+    try:
+        return genotype_cache[gt]
+    except KeyError:
+        pass
+    alleles = gt.replace('|', '/').split('/')
+    if '.' in alleles or '' in alleles:
+        parsed = None
+    else:
+        parsed = (int(alleles[0]), int(alleles[1 if len(alleles) > 1 else 0]))
+    #don't let a broken vcf with endless different genotypes grow the cache
+    if len(genotype_cache) < 1000:
+        genotype_cache[gt] = parsed
+    return parsed
+
+def allele_records(line, alt):
+    '''
+    converts a vcf line with a REF longer than one base, for the called allele alt
+    Args:
+        line: a vcf line split into columns
+        alt: the called allele
+    Output:
+        list of [allele code, start, length] diff records, they can start after the vcf position
+        (the SNPs of an MNP, a deletion after its anchor base)
+    '''
+    ref = line[3]
+    line[4] = alt
+    if len(alt) == len(ref):
+        #if the ref and alt are both longer than 1 but equal to each other,
+        #search through alt for snps
+        return [[ord(n[0]), n[1], n[2]] for n in find_snps(line)]
+
+    elif len(alt) == 1:
+        #if ref is >1 and alt=1, process line as a simple deletion
+        newline = process_dels(line)
+        return [[MISSING, newline[1], newline[2]]]
+
+    else:
+        #if len(ref) and len(alt) are both greater than 1 but not the same len as each other
+        newline = process_others(line)
+        return [[MISSING, newline[1], newline[2]]]
+
+def records_to_diff(records):
+    '''
+    converts the records of a single sample vcf to diff format, one record at a time
+    NOTE: the genotype is always read from the last column of each record
+    Args: 
+        records: an iterable of vcf lines already split into columns (column name line first, no '##' lines), sorted by position
+    Outputs:
+        yields [allele code, start, length] diff records sorted by start (records with the same start in vcf order)
+    ''' 
+    het_indels = 0
+    #records that start after their vcf position wait here until the vcf has moved past them, 
+    #so an MNP or deletion never comes out after a record of the next positions
+    pending = []
+    n = 0
+    for line in records:
+        #skip column names
+        if line[0].startswith('#'):
+            continue
+        genotype = parse_gt(line[-1])
+
+        #reference call
+        if genotype == (0, 0):
+            continue
+
+        pos = int(line[1])
+        #no later record can start before pos
+        while pending and pending[0][0] <= pos:
+            yield heapq.heappop(pending)[2]
+
+        ref = line[3]
+        if genotype == None:
+            #missing call: the whole reference allele is missing data
+            yield [MISSING, pos, len(ref)]
+            continue
+
+        first, second = genotype
+        #assumes diploid genotype
+        #if genotype is heterozygous
+        #NOTE: may need to change this later when indels are not ignored by usher 
+        if first != second:
+            if len(ref) > 1:
+                #if one of the vars is an indel, mask the ref for clarity
+                het_indels += 1
+                yield [MISSING, pos, len(ref)]
+                continue
+            #if the heterozygous position is a SNP, replace with an IUPAC symbol
+            alleles = [ref] + line[4].split(',')
+            alt = IUPAC.get((alleles[first], alleles[second]), line[4])
+        #if genotype is homozygous
         else:
-            newname = s.replace('/', '-')
-            file = f"{wd}{newname}.vcf"
-            #file = open(f'{wd}{newname}.vcf','w')
-        global vcf
-        if file == f"./{vcf}" or file == vcf:
-            logging.warning("Per-sample VCF file name cannot match input VCF filename, so we will rename the input VCF")
-            subprocess.run(["mv", f"{vcf}", f"input_{vcf}"], check=True)
-            vcf = f"input_{vcf}" # WARNING: THIS OVERWRITES A GLOBAL VARIABLE
-        files[i+9] = file
-    return files
-                      
+            alt = line[4].split(',')[first-1]
+
+        #if len of ref position and len of alt are both one, process as a SNP
+        if len(ref) == 1:
+            if len(alt) == 1:
+                yield [ord(alt), pos, 1]
+            #if len(alt) > 1, the position is an insertion which will not be included in the file
+            continue
+
+        for record in allele_records(line, alt):
+            if record[1] == pos:
+                yield record
+            else:
+                n += 1
+                heapq.heappush(pending, (record[1], n, record))
+
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+    if het_indels > 0:
+        logging.info('%d heterozygous positions with an indel allele were masked', het_indels)
+
 def count_samples(vcf):
     '''
     opens VCF and determines how many samples it has (note that this assumes 9cols of metadata)
@@ -623,626 +614,34 @@ def count_samples_bin(vcf):
         logging.error("Could not calculate number of samples -- does the VCF exist, and does it have more than just a header?")
         exit(1)   
 
-def read_VCF(vcf, files):
-    '''
-    open uncompressed VCF and separate columns into individual sample VCFs 
-    *note slightly redundant if VCF only contains one sample but allows for editing of VCF wo changing 
-    original file
-    Args:
-        vcf: uncompressed VCF 
-        files: dictionary of VCF files to fill in with VCF info
-    Outputs:
-        none
-    '''
-    with open(vcf) as v:
-        for line in v:
-            #for lines not in heading
-            if not line.startswith('##'):
-                line = line.strip().split()
-                #position data for all samples
-                position = line[0:9] 
-                for key in files:
-                    #sample specific data
-                    parcel = [line[key]]
-                    newline = position+parcel
-                    #write position and sample data to file in VCF format
-                    with open(files[key], "a") as f:
-                        f.write('\t'.join(newline)+'\n')
-            #write position and sample data to file in VCF format
-            else:
-                #write heading to new VCF file 
-                for key in files:
-                    with open(files[key], "a") as f:
-                        f.write(line)
-
-def read_VCF_bin(vcf, files):
-    '''
-    open compressed VCF and separate columns into individual sample VCFs 
-    *note: only reads file once regardless of number of samples
-    *note slightly redundant if VCF only contains one sample but allows for editing of VCF wo changing 
-    original file
-    Args:
-        vcf: compressed VCF 
-        files: dictionary of VCF files to fill in with VCF info
-    Outputs:
-        none
-    '''
-    with gzip.open(vcf, 'rt') as v:
-        for line in v:
-            #for lines not in heading
-            if not line.startswith('##'):
-                line = line.strip().split()
-                #position data for all samples
-                position = line[0:9] 
-                for key in files:
-                    #sample specific data
-                    parcel = [line[key]]
-                    newline = position+parcel
-                    #write position and sample data to file in VCF format
-                    with open(files[key], "a") as f:
-                        f.write('\t'.join(newline)+'\n')
-            #write position and sample data to file in VCF format
-            else:
-                #write heading to new VCF file 
-                for key in files:
-                    with open(files[key], "a") as f:
-                        f.write(line)
-
-def check_prev_line(prev, line):
-    '''
-    when merging lines and masks, make sure all newly added lines are not overlapping with previously added ones
-    Args:
-        prev: a list containing the most recent added line to all_lines
-        line: a list containing the line to be added next to all_lines
-    Outputs:
-        overlap: a boolean meant to indicate if prev and line overlap
-        change: a list containing important information for updating the prev value
-    '''
-    # NOTE currently not checking overlap to left of prev bc that indicates a bigger error
-    overlap = False
-    change = None
-    newline = None
-
-    '''
-    #DEBUG
-    logging.debug('masking prev ', prev)
-    logging.debug('masking line', line)
-    '''
-
-    
-    
-    prev_s = int(prev[1])
-    prev_e = prev_s + int(prev[2])
-    line_s = int(line[1])
-    line_e = line_s + int(line[2])
-
-    
-    #DEBUG logging.debugS
-    logging.debug(f'prev {prev}')
-    logging.debug(f'line {line}')
-    logging.debug(f'prev: {prev_s} {prev_e}, line: {line_s} {line_e}')
-
-    if line_s >= prev_s and line_e <= prev_e:
-        overlap = True
-        logging.debug('Full OVERLAP!!!!!')
-        logging.debug(f'prev {prev_s} {prev_e}, line, {line_s} {line_e}')
-    elif line_s >= prev_s and line_s < prev_e and line_e >= prev_e:
-        overlap = True 
-#<<<<<<< fix_mismatch_overlaps
-        logging.debug(f'right overlap vcftodiff, prev {prev_s}, {prev_e}, line {line_s}, {line_e}')
-        
-        #logging.debug('prev', prev)
-        #logging.debug('line', line)
-        #if line_s == prev_e and line[-1]=='1':
-
-        #if line[0] and prev[0] are the same, we can squish these, otherwise, ignore 
-        #squish later if necessary 
-        if line_s == prev_e:
-            logging.debug('start to end {line} {prev}')
-            '''            
-        #=======
-        logging.debug('right overlap vcftodiff', 'prev', prev, prev_s, prev_e, 'line', line, line_s, line_e)
-        #if prev[0] != line[0]:
-        #    logging.debug('masking prev ', prev)
-        #    logging.debug('masking line', line)
-        #logging.debug('prev', prev)
-        #logging.debug('line', line)
-        logging.debug('prev', prev_s, prev_e, 'line', line_s, line_e, line)
-        if line_s == prev_e and line[-1]=='1':
-            #logging.debug('SNP')
-            #>>>>>>> main
-            '''
-            overlap = False
-
-        elif line_s < prev_e and line_e>prev_e:
-            logging.debug(f'truly right overlap (prev {prev} line {line}')
-
-            #COME BACK HERE WEDS!!!!!!!!!!! need to figure out how to add two lines 
-            if prev[0] == '-' and line[0] != '-':
-                logging.debug(f'masking needed (prev {prev}, line {line})')
-                line[1] = str(prev_e)
-                line[2] = str(line_e-prev_e)
-                logging.debug(f'newline {line}')
-                newline = line
-
-            elif prev[0] != '-' and line[0] == '-':
-                logging.debug(f'masking needed complicated (prev {prev}, line {line})')
-
-                
-            elif prev[0] == line[0]:
-                logging.debug('combine!')
-                prev[2] = str(line_e-prev_s)
-                logging.debug(f'prev after {prev}')
-                change = prev
-            else:
-                logging.warning(f'BAD NEWS: line {line}, prev {prev}')
-            
-
-            #change = line
-        #elif line_s == prev_e and line[-1]!='1':
-        #    overlap = True
-        #    logging.debug('need to change this!!!', 'prev', prev, 'line', line)
-        #    logging.debug('prev')
-        else:
-            # previously there were arthimatic errors, but this should be fine now
-            prev[2] = str(line_e-prev_s)
-            logging.debug('prev after ', prev)
-            change = prev
-    #elif line_s <= prev_s and line_e >= prev_s:
-    if newline != None:
-        logging.debug(f'overlap {overlap} change {change} newline {newline}')
-    return overlap, change, newline
-
-#def interpret_overlap()  
-
 def mask_and_write_diff(low_depth_sites, tb_masks, lines):
     '''
-    iterate through masking regions and lines of diff file to mask positions
+    lays the low depth regions over the diff records: low depth positions become missing, overlapping
+    missing records are combined and SNPs inside missing regions are dropped
+    only the masks are held in memory, diff records are read and yielded one at a time
     args:
-        low_depth_sites: a dictionary of low depth coverage regions 
-        tb_masks: a dictionary of universally masked regions
-        lines: a list of diff-formatted lines 
-        samps: a list of sample names from the VCF
+        low_depth_sites: Intervals of low depth coverage regions 
+        tb_masks: Intervals of universally masked regions (not used here, see mask2ref)
+        lines: an iterable of [allele code, start, length] diff records sorted by start
     output:
-        all_lines: a list of diff-formatted lines including all of the masked regions
+        yields [allele code, start, length] diff records including all of the masked regions
     '''
-    
-    #if low_depth_sites != None:
-    #    assert len(samps) == 1
-    #    masks = condense_mask_regions(low_depth_sites,tb_masks)
-        
-    #else:
-    #    masks = tb_masks
-    masks = low_depth_sites
-    masks_key = sorted(low_depth_sites.keys())
     logging.info("Masking the diff file...")
-    logging.debug(f'masks: {masks_key} {masks}')
-    
-    # iterate through all masks and lines one time and combine things as needed
-    masks_ind = 0
-
-    #skip header in lines
-    lines_ind = 1
-    all_lines = [lines[0]]
-
-    prev = None
-    while masks_ind < len(masks_key) or lines_ind < len(lines):
-        #if both indexes are still going
-        
-        if masks_ind < len(masks_key) and lines_ind < len(lines): 
-            mask_start = masks_key[masks_ind]
-            mask_end =  masks[mask_start]
-            line = lines[lines_ind]
-            line_start = int(lines[lines_ind][1])
-            line_end = int(lines[lines_ind][1])+int(lines[lines_ind][2])
-            
-
-            '''
-            DEBUG logging.debugS
-            logging.debug('mask_start', mask_start, type(mask_start))
-            logging.debug('mask_end', mask_end, type(mask_end))
-            logging.debug('line',line)
-            logging.debug('line_start', line_start, type(line_start))
-            logging.debug('line end', line_end, type(line_end))
-            '''
-
-            if line_start >= mask_start and line_end <= mask_end:
-                #line and mask fully overlap with line inside
-                logging.debug('full overlap: line inside')
-                
-                if prev != None:
-                    overlap,change,newline = check_prev_line(prev, ['-', mask_start, mask_end-mask_start])
-                    if overlap == True and change != None:
-                        logging.debug(f'change {change}')
-                        #all_sites[change[0]] = change[1]
-                    if newline != None:
-                        all_lines.append(newline)
-                        logging.debug(f'append!!!! {newline}')
-                if prev == None or overlap == False:
-                    all_lines.append(['-', str(mask_start), str(mask_end-mask_start)])
-
-                masks_ind += 1
-                lines_ind += 1
-
-            #need to make sure that if snps overlap they get masked
-            elif line_start <= mask_start and line_end >= mask_end:
-                #full overlap of line and mask with mask inside
-                logging.debug(f'full overlap mask inside mask: {mask_start} {mask_end} line:{line}')
-                if prev != None:
-                    logging.debug(f'prev: {prev} line:{line}')
-                    overlap,change, newline = check_prev_line(prev, line)
-                    if overlap == True and change != None:
-                        logging.debug(f'change {change}')
-                        #all_sites[change[0]] = change[1]
-                    if newline != None:
-                        all_lines.append(newline)
-                        logging.debug(f'append!!!! {newline}')
-                if prev == None or overlap == False:
-                    
-                    all_lines.append(line)
-                masks_ind += 1
-                lines_ind += 1
-        
-            elif line_start < mask_start:
-                logging.debug('line less than mask')
-                if line_end <= mask_start:
-                    #no overlap, line completely to left
-                    #logging.debug(f'line{lines_ind} is below mask{masks_ind}')
-                    logging.debug('no overlap line to left')
-                    
-                    if prev != None:
-                        overlap,change,newline = check_prev_line(prev, line)
-                        if overlap == True and change != None:
-                            logging.debug(f'change {change}')
-                            logging.debug(f'change {all_lines[-1]}')
-                            #change does this help?
-                            
-                            all_lines[-1][2] = change[2]
-                            logging.debug(f'after {all_lines[-1]}')
-                        if newline != None:
-                            all_lines.append(newline)
-                            logging.debug(f'append!!!! {newline}')
-                    if prev == None or overlap == False:
-                        all_lines.append(line)
-                    lines_ind += 1
-                
-                elif line_end > mask_start:
-                    #if line overlaps mask on the left
-                    logging.debug('left overlap')
-                    logging.debug(f'line: {line_start} {line_end} tb: {mask_start} {mask_end}')
-                    
-                    if prev != None:
-                        overlap,change,newline = check_prev_line(prev, line)
-                        if overlap == True and change != None:
-                            logging.debug(f'change {change}')
-                            #all_sites[change[0]] = change[1]
-                        if newline != None:
-                            all_lines.append(newline)
-                            logging.debug(f'append!!!! {newline}')
-                    if prev == None or overlap == False:
-                        all_lines.append(['-', str(line_start), str(mask_end-line_end)])
-                    masks_ind += 1
-                    lines_ind += 1
-
-            elif line_start >= mask_end:
-                #if line is completely to the right of mask
-                logging.debug(f'no overlap, line: {line_start}, {line_end}, mask: {mask_start} {mask_end}' )
-                if prev != None:
-                    #change here
-                    overlap,change, newline = check_prev_line(prev, ['-',mask_start,mask_end-mask_start])
-                    if overlap == True and change != None:
-                        logging.debug(f'change {change}')
-                        #all_sites[change[0]] = change[1]
-                    if newline != None:
-                        all_lines.append(newline)
-                        logging.debug(f'append!!!! {newline}')
-                if prev == None or overlap == False:
-                    all_lines.append(['-', str(mask_start), str(mask_end-mask_start)])
-                masks_ind += 1
-            
-            #need to figure out whatn happens if snp is sticking out 
-            elif line_start < mask_end and line_end > mask_end:
-                #line overlaps mask on the right 
-                logging.debug(f'right over lap: line: {line_start} {line_end} mask: {mask_start} {mask_end}')
-                assert line_start > mask_start
-
-                if prev != None:
-                    logging.debug(f'prev: {prev} line:["-", {mask_start}, {line_end-mask_start}]')
-                    overlap,change,newline = check_prev_line(prev, ['-', str(mask_start), str(line_end-mask_start)])
-                    if overlap == True and change != None:
-                        logging.debug(f'change {change}')
-                        #all_sites[change[0]] = change[1]
-                    if newline != None:
-                        all_lines.append(newline)
-                        logging.debug(f'append!!!! {newline}')
-                if prev == None or overlap == False:
-                
-                    all_lines.append(['-', str(mask_start), str(line_end-mask_start)])
-                masks_ind += 1
-                lines_ind += 1
-
-            else:
-                logging.debug('other... what else could happen?')
-                #logging.debug('low_depth_sites',ld_start, ld_end, 'tb', tb_start, tb_end)
-                #all_sites[tb_start]
-
-
-                #logging.debug(f'ld{ld_keys_ind} is not below tb{tb_keys_ind}')
-                #logging.debug('ld', ld_start, ld_end)
-                #logging.debug('tb', tb_start, tb_end)
-            #logging.debug('tb',tb_keys[tb_keys_ind], tb_sites[tb_keys[tb_keys_ind]])
-            #logging.debug('ld',ld_keys[ld_keys_ind], low_depth_sites[ld_keys[ld_keys_ind]])
-        
-        elif masks_ind >= len(masks_key) and lines_ind < len(lines):
-            #after mask list is completely read
-            logging.info('no more masks, lines only')
-
-            line = lines[lines_ind]
-            line_start = line[1]
-
-            if prev != None:
-                    #change here
-                    overlap,change,newline = check_prev_line(prev, line)
-                    if overlap == True and change != None:
-                        #do i need to change this?
-                        logging.debug('change!!!!! {change}')
-                        #all_lines[change[0]] = change[1]
-                    if newline != None:
-                        all_lines.append(newline)
-                        logging.debug('append!!!! {newline}')
-            if prev == None or overlap == False:
-                logging.debug(f'add as is!!!!!! line {line} prev {prev}')
-                all_lines.append(line)
-            lines_ind += 1
-
-
-        elif lines_ind >= len(lines) and masks_ind < len(masks_key):
-            #after lines list is completely read and masks are left 
-            logging.info('no more lines, masks only')
-
-            mask_start = masks_key[masks_ind]
-            mask_end =  masks[mask_start]
-
-            if prev != None:
-                #change here
-                overlap,change,newline = check_prev_line(prev, ['-', str(mask_start), str(mask_end-mask_start)])
-                if overlap == True and change != None:
-                    #do i need to change this?
-                    logging.debug(f'change!!!!! {change}')
-                    #all_lines[change[0]] = change[1]
-                if newline != None:
-                    all_lines.append(newline)
-                    logging.debug(f'append!!!! {newline}')
-            if prev == None or overlap == False:
-                #all_lines.append(['-', str(mask_start), str(mask_end-mask_start)])    
-                logging.debug(f'add mask as is!!!!!! mask {mask_start} {mask_end} prev {prev}' )
-                all_lines.append(['-', str(mask_start), str(mask_end-mask_start)])
-                
-
-            #all_lines.append(['-', str(mask_start), str(mask_end-mask_start)])
-            masks_ind += 1 
-        
-        
-        prev = all_lines[-1]
-        logging.debug(f'prev {prev}')
-
-    #need to add final prev?  
-    logging.debug(f'final prev {prev}')
-    return all_lines
+    return interval_sweep.override(lines, iter(low_depth_sites), MISSING)
 
 def mask2ref(lines, tb_masks):
-    logging.debug(f"tb_masks are as follows: {tb_masks}")
-    final = [lines[0]]
-    #editing thought: would likely benefit from being a list rather than a dictionary 
-    tb_keys = sorted(tb_masks.keys())
-    logging.debug(f'all lines: {lines}')
-    tb_keys_ind = 0
-    lines_ind = 1
-    cont = 0
-    #track previous line in all_sites
-    prev = None
-    #iterate through tb_keys and ld_keys exactly 1 time, track index of keys as you iterate
-    while tb_keys_ind < len(tb_keys) or lines_ind < len(lines):
-        #if still iterating through both lists
-        if tb_keys_ind < len(tb_keys) and lines_ind < len(lines): 
-            tb_start = tb_keys[tb_keys_ind]
-            tb_end =  tb_masks[tb_keys[tb_keys_ind]]
-            line_start = int(lines[lines_ind][1])
-            line_end = line_start+int(lines[lines_ind][2])
-            logging.debug(f'tb start {tb_start} tb_end {tb_end} line start {line_start } line end {line_end}')
-            #print('tb_keys_ind', tb_keys_ind, 'len tb masks', len(tb_keys), 'lines ind', lines_ind, 'len(lines)', len(lines))
-
-            if line_end <= tb_start:
-                #logging.debug('THIS ONE')
-                #print('THIS ONE')
-                '''
-                #line is completely to the left of the universal site
-                #if prev != None:
-                    #before adding to all_sites, make sure it doesn't overlap prev
-                    #overlap, change = check_prev_mask(prev, [ld_start, ld_end])
-                        #if overlap is detected AND requires prev to be updated
-                        if overlap == True and change != None:
-                            #update prev in all_sites
-                            all_sites[change[0]] = change[1]
-                    if prev == None or overlap == False:
-                        #add new site to all_sites
-                        all_sites[ld_start] = ld_end
-                    #update ld index because site was processed
-                    '''
-                final.append(lines[lines_ind])
-                lines_ind += 1
-            
-            elif line_start >= tb_end:
-                logging.debug('dont add to final yet')
-                tb_keys_ind += 1
-                #final.append(lines[lines_ind])
-            
-            elif line_start >= tb_start and line_end <= tb_end:
-                logging.debug('full overlap')
-                lines_ind += 1
-            
-            elif line_start < tb_start and line_end > tb_end:
-                logging.debug(f'full overlap OPPOSITE: line {lines[lines_ind]} tb {tb_start} {tb_end}')
-                #first segment of line before TB mask
-                new_line = [lines[lines_ind][0], str(line_start), str(tb_start-line_start)]
-                #update line after first segment AND TB mask
-                lines[lines_ind][1] = str(tb_end)
-                lines[lines_ind][2] = str(line_end-tb_end)
-                logging.debug('  OP - new line {new_line}')
-                logging.debug('  OP - update line {lines[lines_ind]}')
-                final.append(new_line)
-                tb_keys_ind += 1
-
-            elif line_start <= tb_start and line_end > tb_start and line_end <= tb_end:
-                logging.debug('left overlap')
-                new_line = [lines[lines_ind][0], str(line_start), str(tb_start-line_start)]
-                logging.debug('  LO - old line {lines[lines_ind]}')
-                logging.debug('  LO - new line {new_line}')
-                final.append(new_line)
-                lines_ind += 1
-
-            elif line_start >= tb_start and line_start < tb_end and line_end > tb_end:
-                logging.debug('right overlap')
-                new_line = [lines[lines_ind][0], str(tb_end), str(line_end-tb_end)]
-                logging.debug(f'  RO - new line {new_line}')
-                final.append(new_line)
-                tb_keys_ind += 1
-                lines_ind += 1
-
-
-
-            else:
-                logging.debug('overlap?' )
-        
-
-        elif tb_keys_ind == len(tb_keys) and lines_ind < len(lines):
-            logging.debug(lines[lines_ind])
-            final.append(lines[lines_ind])
-            lines_ind += 1
-
-        #elif tb_keys_ind < len(tb_keys) and lines_ind == len(lines):
-        #    logging.debug(lines[lines_ind])
-        #    final.append(lines[lines_ind])
-        #    lines_ind += 1
-
-        
-
-            """
-                elif ld_end >= tb_start:
-                    #this accounts for ld overlapping tb on the left
-                    if prev != None:
-                        overlap, change = check_prev_mask(prev, [ld_start, tb_end])
-                        if overlap == True and change != None:
-                            #if new region overlaps, update prev
-                            all_sites[change[0]] = change[1]
-                    #if there is no overlap, add new region to all_sites
-                    if prev == None or overlap == False:
-                        all_sites[ld_start] = tb_end
-                    #since both regions are added at the same time, update index for both lists
-                    tb_keys_ind += 1
-                    ld_keys_ind += 1
-            
-            elif ld_start <= tb_end and ld_end > tb_end:
-                #if ld overlaps tb on the right
-                if prev != None:
-                    #before adding to all_sites, make sure it doesn't overlap prev
-                    overlap,change = check_prev_mask(prev, [tb_start, ld_end])
-                    if overlap == True and change != None:
-                        all_sites[change[0]] = change[1]
-                #if there is no overlap, add new region to all_sites
-                if prev == None or overlap == False:
-                    all_sites[tb_start] = ld_end
-                #since both regions are added at the same time, update index for both lists
-                tb_keys_ind += 1
-                ld_keys_ind += 1
-
-            elif ld_start > tb_end:
-                #if there is no overlap between ld and tb, and ld is on the right
-                if prev != None:
-                    #before adding to all_sites, make sure it doesn't overlap prev
-                    overlap,change = check_prev_mask(prev, [tb_start, tb_end])
-                    if overlap == True and change != None:
-                        all_sites[change[0]] = change[1]
-                if prev == None or overlap == False:
-                    #if there is no overlap, add new region to all_sites
-                    all_sites[tb_start] = tb_end
-                tb_keys_ind += 1
-
-            elif ld_start >= tb_start and ld_end <= tb_end:
-                # if tb and ld fully overlap with ld inside
-                if prev != None:
-                    #make sure tb doesnt overlap prev 
-                    overlap,change = check_prev_mask(prev, [tb_start, tb_end])
-                    if overlap == True and change != False:
-                        all_sites[change[0]] = change[1]
-                if prev == None or overlap == False:
-                    all_sites[tb_start] = tb_end
-                tb_keys_ind += 1
-                ld_keys_ind += 1
-
-            
-            elif ld_start <= tb_start and ld_end >= tb_end:
-                #if ld and tb fully overlap with tb inside
-                if prev != None:
-                    #make sure ld doesnt overlap prev
-                    overlap,change = check_prev_mask(prev, [ld_start, ld_end])
-                    if overlap == True and change != None:
-                        all_sites[change[0]] = change[1]
-                if prev == None or overlap == False:
-                    all_sites[ld_start] = ld_end
-                tb_keys_ind += 1
-                ld_keys_ind += 1
-                
-            #covered all 6 possible positions of the two regions
-            '''
-            DEBUG
-            logging.debug('ld',ld_keys[ld_keys_ind], low_depth_sites[ld_keys[ld_keys_ind]])
-            '''
-
-        #possible bug: prev overlaps with one list the first time the other list expires
-        elif tb_keys_ind >= len(tb_keys) and ld_keys_ind < len(ld_keys):
-            #if reach end of tb_masks process ld only
-            ld_start = ld_keys[ld_keys_ind]
-            ld_end = low_depth_sites[ld_keys[ld_keys_ind]]
-            all_sites[ld_start] = ld_end
-            ld_keys_ind += 1
-
-        #possible bug: prev overlaps with one list the first time the other list expires
-        elif ld_keys_ind >= len(ld_keys) and tb_keys_ind < len(tb_keys):
-            #if reach end of ld masks process tb only
-            tb_start = tb_keys[tb_keys_ind]
-            tb_end = tb_sites[tb_keys[tb_keys_ind]]
-            all_sites[tb_start] = tb_end
-            tb_keys_ind += 1 
-
-        #keep all sites sorted
-        if len(all_sites) > 0:
-            all_sites_keys = sorted(all_sites.keys())
-        #track last site for every iteration
-        prev = [all_sites_keys[-1],all_sites[all_sites_keys[-1]]]
-        """
-        #cont += 1
-        #if cont == 1000:
-        #    break
-        elif tb_keys_ind < len(tb_keys) and lines_ind == len(lines):
-            #if lines finish before masks, end while loop
-            #we are masking to ref so we don't have to keep going through masks
-            #break
-            #logging.debug(lines[lines_ind])
-            #final.append(lines[lines_ind])
-            #tb_keys_ind += 1
-            break
-        else:
-            logging.warning('this probably should not happen')
-            #print('tb_keys_ind', tb_keys_ind, 'len tb masks', len(tb_keys), 'lines ind', lines_ind, 'len(lines)', len(lines))
-        logging.debug(f'end: {len(lines)}, {len(tb_keys)} tb')
-        logging.debug(f'tb {tb_keys_ind} lines {lines_ind}')
-
-    
-    #return all_sites
-    return final
-    
-
+    '''
+    removes the parts of diff records that fall inside universally masked regions (they become reference)
+    only the masks are held in memory, diff records are read and yielded one at a time
+    Args:
+        lines: an iterable of [allele code, start, length] diff records sorted by start
+        tb_masks: Intervals of universally masked regions sorted by start (they may overlap)
+    Output:
+        yields [allele code, start, length] diff records outside the masked regions
+    '''
+    #positions from a memory-mapped mask index are numpy integers
+    masks = ((allele, int(start), int(length)) for allele, start, length in tb_masks)
+    return interval_sweep.subtract(lines, interval_sweep.coalesce(masks))
 
 #determine if low-coverage samples exceed 5% of genome length
 #note: future iterations of this software may include missing sites in VCF but that is not currently included
@@ -1253,7 +652,7 @@ def missing_check(lenref, low_depth_sites):
     determine what percentage of genome length is low-coverage
     Args:
         lenref: len of reference genome 
-        low_depth_sites: dictionary of low-depth regions 
+        low_depth_sites: Intervals of low-depth regions 
     Out:
         amount_low_coverage_sites: a float value <1 indicating the percentage of genome 
     '''
@@ -1277,9 +676,7 @@ def missing_check(lenref, low_depth_sites):
 
 
     #how many low depth mask regions are there
-    missing_count = 0
-    for l in low_depth_sites:
-        missing_count += int(low_depth_sites[l])-int(l)
+    missing_count = low_depth_sites.total_length()
 
 
     #rules out samples that could never pass quality check no matter what 
@@ -1300,122 +697,297 @@ def missing_check(lenref, low_depth_sites):
                 
 
 
-#SCRIPT STARTS HERE
-#notes: MAKE SURE that all of your data is in the same coordinates (i think this is all 0-coords)<-- double check this
-if __name__ == "__main__":
-
-    binary = True
-    with gzip.open(vcf, 'r') as test:
-        try:
-            test.read(1)
-        except OSError:
-            binary = False
+def convert_sample(vcf, wd, smf=None, bed=None, min_coverage=10, masks=None, offsets=None, compact=False, jobs=1, metrics=None, bam=None, reference=None, lengths=None):
+    '''
+    converts one single-sample vcf into a masked diff file
+    Args:
+        vcf: path to single-sample vcf (sample name is the file name without .vcf.gz)
+        wd: directory for the diff file
+        smf: path to bed file of commonly masked regions of genome
+        bed: path to bed coverage file (bedgraph) for vcf, per contig or merged by merge_contigs_bed.py
+        min_coverage: minimum coverage depth for any given call before that call is considered dubious
+        masks: species masks already read with load_species_mask (batch runs read smf once instead of once per sample)
+        offsets: contig offset table from contig_offsets.load_offsets (default: built-in C. auris contigs)
+        compact: if True, combine adjacent missing-data records into one line after masking (see squish)
+        jobs: if more than 1 and the vcf is bgzipped with a .tbi/.csi index, contigs are converted in parallel
+        metrics: stage_metrics.SampleMetrics to fill with timings and counters of every stage (or None)
+        bam: path to the sorted, indexed BAM/CRAM of the sample, low-depth regions are read from it when there is no bed
+             (contigs are read by up to jobs workers)
+        reference: reference fasta for a CRAM bam
+        lengths: contig lengths the offsets were made from (contig_offsets.load_lengths), needed with bam
+    Output:
+        diff_file: path to the diff file that was written
+    '''
+    #makes sure input path wont cause error
+    if wd[-1] != '/':
+        wd = wd+'/'
 
     logging.info("Reading vcf...")
-    #DEPRECATED: not dealing with large VCFs anymore
-    #if binary == True:
-    #    lenRow, samps = count_samples_bin(vcf)
-    #else:
-    #    lenRow, samps = count_samples(vcf)
-
-    #be careful w dictionaries!!!
-    #files = make_files(samps, wd)
-    #print(files)
-    #print('files', files)
-
-    #if binary == True:
-    #    read_VCF_bin()
-    #else:
-    #    read_VCF(vcf, files)
 
     #TB specific, leaving code here in case masking known low-quality sites is relevant
     logging.info("Masking known-to-be-ornery sites...")
-    if smf != None:
-        masks = mask_TB(smf)
-    else:
-        masks = {}
-    #this is not parallelized, the more samples in the vcf the longer this will take
-    #note if a multisample VCF is submitted to this script, there is no way to mask low-depth
-
-    #for f in files:
-    #    print('files', files)
-    #    print(files)
-    #    logging.debug(f"For {f} in {files}")
+    if masks == None:
+        if smf != None:
+            with stage_metrics.step(metrics, 'species_mask'):
+                masks = load_species_mask(smf)
+        else:
+            masks = Intervals()
 
-        #find low coverage regions for each sample 
+    #find low coverage regions for the sample
+    if offsets == None:
+        if lengths == None:
+            lengths = load_lengths()
+        offsets = offsets_from_lengths(lengths)
     if bed != None:
-        low_depth_sites = mask_low_depth(bed,min_coverage)
+        with stage_metrics.step(metrics, 'mask_low_depth'):
+            low_depth_sites = Intervals.from_regions(*mask_low_depth(bed,min_coverage,offsets))
+    elif bam != None:
+        if lengths == None:
+            raise Exception('the contig lengths are needed to read the depth from a BAM/CRAM')
+        with stage_metrics.step(metrics, 'bam_low_depth'):
+            low_depth_sites = Intervals.from_regions(*bam_low_depth(bam, lengths, min_coverage, jobs, reference))
     else:
         low_depth_sites = None
 
     # sample names: sample.vcf.gz
     sample = os.path.basename(vcf)[:-7]
-    # print(sample)
+    if metrics != None:
+        metrics.sample = sample
     logging.info(f'Working on sample {sample}')
-    #filepath = files[f]
-    #
-    subprocess.run(f"bcftools annotate -x ^FORMAT/GT -O v -o {wd}{sample}.filt.vcf {vcf}", shell=True, check=True)
-    myfile = f'{wd}{sample}.filt.vcf'
-    
-    #import merge_ontigs_vcf.py
-    output_file = f'{wd}{sample}_merged.vcf'
-    subprocess.run(["python", "scripts/merge_contigs_vcf.py", "-i", myfile, "-o", output_file])
 
-   
-    
+    #read the vcf once: keep GT only and merge the contigs on the fly (no filtered/merged VCFs written)
+    diff_records = None
+    if jobs > 1:
+        with stage_metrics.step(metrics, 'indexed_vcf_to_diff'):
+            diff_records = indexed_records(vcf, offsets, jobs)
+    if diff_records == None:
+        diff_records = records_to_diff(stream_gt_records(vcf, offsets))
+
     #currently quality assessment requires a coverage file, if coverage not provided the script will fail 
-    #if low_depth_sites != None:
-    #    low_coverage_as_fraction = missing_check(len_ref, low_depth_sites)
-    #else: 
-    #    low_coverage_as_fraction = 'N/A'
-    
+    if low_depth_sites != None and metrics != None and metrics.genome_length != None:
+        metrics.extra['missing_fraction'] = missing_check(metrics.genome_length, low_depth_sites)
+
+    return write_diff(sample, diff_records, wd, masks, low_depth_sites, compact, metrics)
+
+def write_diff(sample, diff_records, wd, masks, low_depth_sites=None, compact=False, metrics=None):
+    '''
+    masks the diff records of one sample and writes them to its diff file
+    Args:
+        sample: sample name (the diff file is {wd}{sample}.diff)
+        diff_records: iterable of [allele code, start, length] diff records sorted by start
+        wd: directory for the diff file (ending in '/')
+        masks: Intervals of species masks
+        low_depth_sites: Intervals of low coverage regions of the sample (or None)
+        compact: if True, combine adjacent missing-data records into one line after masking (see squish)
+        metrics: stage_metrics.SampleMetrics to fill with timings and counters of every stage (or None)
+    Output:
+        diff_file: path to the diff file that was written
+    '''
+    diff_records = stage_metrics.stream(metrics, 'vcf_to_diff', diff_records)
+    #every stage is a generator: records flow from the vcf through the masks into the diff file one at a time,
+    #so only the masks are held in memory
+
     #if there is a provided coverage file it will be used to mask low coverage (less than min_coverage) regions 
     #note that only one coverage file can be provided and it will result in an error if the vcf has more samples than coverage files 
-    #print('files[f]', files[f])
-    diff_formatted_lines = vcf_to_diff(output_file, sample)
-    #subprocess.run(['rm', f'{filepath}.filt'], check=True)
-    # print(diff_formatted_lines)
-    
     if low_depth_sites != None:
-        all_lines = mask_and_write_diff(low_depth_sites, masks, diff_formatted_lines)
-    else: 
-        all_lines = diff_formatted_lines
-    
-    logging.info('Masking to reference...')
-    if masks != {}:
-        final_lines = mask2ref(all_lines, masks)
-        #can I delete all_lines
-        logging.info('Writing results...')
-    else: 
-        final_lines = all_lines
-
-    #with open(f'{wd}{sample}.report','w') as o:
-    #    o.write(f'{sample}.diff\t{low_coverage_as_fraction}\t{min_coverage}\n')
+        diff_records = stage_metrics.stream(metrics, 'mask_and_write_diff', mask_and_write_diff(low_depth_sites, masks, diff_records))
     
+    if len(masks) > 0:
+        logging.info('Masking to reference...')
+        diff_records = stage_metrics.stream(metrics, 'mask2ref', mask2ref(diff_records, masks))
+
+    #compress adjacent diff lines where possible 
+    if compact:
+        diff_records = stage_metrics.stream(metrics, 'squish', squish(diff_records))
+
+    logging.info('Writing results...')
     diff_file = f'{wd}{sample}.diff'
-    with open(diff_file,'w') as o:
-        for line in final_lines:
-            o.write('\t'.join(line)+'\n')
-            
-    # try:
-    #     # Remove unneeded files (if any)
-    #     os.remove(output_file)
-    #     os.remove(myfile)
-
-    # except OSError as e:
-    #     print(f"Error removing temporary files: {e}") 
-               
+    #write to a temporary file and rename it once finished, so an interrupted run never leaves a truncated diff
+    tmp_file = temp_path(diff_file)
+    try:
+        with open(tmp_file,'w', buffering=1<<20) as o, stage_metrics.step(metrics, 'write'):
+            write_records(o, diff_records, sample)
+        os.replace(tmp_file, diff_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return diff_file
+
+def find_bedgraph(bd, sample):
+    '''
+    Args:
+        bd: directory of bedgraphs
+        sample: sample name
+    Output:
+        path to the merged bedgraph of sample ({sample}_merged.bed) or else its per-contig bedgraph 
+        (aligned_{sample}.bed or .bed.gz, shifted while it is read), None if there is neither
+    '''
+    for name in (f'{sample}_merged.bed', f'aligned_{sample}.bed', f'aligned_{sample}.bed.gz'):
+        path = os.path.join(bd, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+def convert_columns(vcf, wd, columns, smf=None, bedgraphs=None, min_coverage=10, offsets=None, compact=False):
+    '''
+    converts some sample columns of a multi-sample vcf to diff files, reading the vcf once
+    the diff records of every sample are collected in memory (Intervals) while the vcf is read and masked 
+    and written per sample afterwards, nothing else is written per sample
+    Args:
+        vcf: path to multi-sample vcf (.vcf or .vcf.gz)
+        wd: directory for the diff files (ending in '/')
+        columns: column numbers of the samples to convert (the first sample is column 9)
+        smf: path to bed file of commonly masked regions of genome (or its .npy index)
+        bedgraphs: dictionary where key is sample name and value is its bedgraph (samples without one are not masked for depth)
+        min_coverage: minimum coverage depth for any given call before that call is considered dubious
+        offsets: contig offset table from contig_offsets.load_offsets (default: built-in C. auris contigs)
+        compact: if True, combine adjacent missing-data records into one line after masking (see squish)
+    Output:
+        diff_files: list of paths to the diff files that were written
+    '''
+    if offsets == None:
+        offsets = load_offsets()
+    if smf != None:
+        masks = load_species_mask(smf)
+    else:
+        masks = Intervals()
+    if bedgraphs == None:
+        bedgraphs = {}
+
+    records = stream_gt_columns(vcf, offsets, columns)
+    #'/' is not allowed in file names
+    samples = [s.replace('/', '-') for s in next(records)[9:]]
+    diffs = [Intervals() for s in samples]
+    for line in records:
+        site = line[:8]
+        for diff, gt in zip(diffs, line[9:]):
+            if gt != '0/0':
+                for record in records_to_diff((site + ['GT', gt],)):
+                    diff.append(*record)
+
+    diff_files = []
+    for sample, diff in zip(samples, diffs):
+        logging.info(f'Working on sample {sample}')
+        #every line was converted on its own, so the records of an MNP or deletion can be after those of the next positions
+        diff.sort()
+        bed = bedgraphs.get(sample)
+        if bed != None:
+            low_depth_sites = Intervals.from_regions(*mask_low_depth(bed, min_coverage, offsets))
+        else:
+            low_depth_sites = None
+        diff_files.append(write_diff(sample, diff, wd, masks, low_depth_sites, compact))
+    return diff_files
+
+def convert_multi_sample(vcf, wd, smf=None, bd=None, min_coverage=10, offsets=None, compact=False, jobs=1):
+    '''
+    converts every sample of a joint-called vcf straight to diff files without writing per-sample VCFs 
+    the sample columns are split into one chunk per worker, each worker reads the vcf once for its chunk
+    Args:
+        vcf: path to multi-sample vcf (.vcf or .vcf.gz)
+        wd: directory for the diff files
+        smf: path to bed file of commonly masked regions of genome (or its .npy index)
+        bd: directory of bedgraphs named {sample}_merged.bed or aligned_{sample}.bed(.gz) (or None, see find_bedgraph)
+        min_coverage: minimum coverage depth for any given call before that call is considered dubious
+        offsets: contig offset table from contig_offsets.load_offsets (default: built-in C. auris contigs)
+        compact: if True, combine adjacent missing-data records into one line after masking (see squish)
+        jobs: number of workers
+    Output:
+        diff_files: list of paths to the diff files that were written, in vcf column order
+    '''
+    #makes sure input path wont cause error
+    if wd[-1] != '/':
+        wd = wd+'/'
+    if is_gzipped(vcf):
+        lenRow, samps = count_samples_bin(vcf)
+    else:
+        lenRow, samps = count_samples(vcf)
+    bedgraphs = {}
+    if bd != None:
+        for s in samps:
+            s = s.replace('/', '-')
+            bed = find_bedgraph(bd, s)
+            if bed != None:
+                bedgraphs[s] = bed
+            else:
+                logging.warning(f'no bedgraph for {s} in {bd}, low depth sites are not masked')
+
+    columns = list(range(9, lenRow))
+    jobs = max(1, min(jobs, len(columns)))
+    size = -(-len(columns) // jobs)
+    chunks = [columns[i:i+size] for i in range(0, len(columns), size)]
+    logging.info(f'{vcf} has {len(columns)} samples, converting them in {len(chunks)} chunks')
+    if len(chunks) == 1:
+        return convert_columns(vcf, wd, columns, smf, bedgraphs, min_coverage, offsets, compact)
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        futures = [pool.submit(convert_columns, vcf, wd, chunk, smf, bedgraphs, min_coverage, offsets, compact) for chunk in chunks]
+        return [diff_file for f in futures for diff_file in f.result()]
+
+
+#SCRIPT STARTS HERE
+#notes: MAKE SURE that all of your data is in the same coordinates (i think this is all 0-coords)<-- double check this
+if __name__ == "__main__":
+
+    #this script requires individual VCFs
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', '--VCF', required=True, type=str,help='path to single-sample VCF (or joint-called VCF with -m)')
+    parser.add_argument('-d', '--working_directory', required=True, type=str, help='directory for all outputs (make sure this directory will have enough space!!!!)')
+    parser.add_argument('-smf', '--species_maskfile', required=False, type=str, help='path to bed file of commonly masked regions of genome (or its .npy index from compile_mask.py)')
+    parser.add_argument('-bed', '--bedgraph', required=False, type=str, help="path to bed coverage file (bedgraph) for vcf, per contig (plain or gzipped) or merged by merge_contigs_bed.py")
+    parser.add_argument('-bam', '--alignment', required=False, type=str, help="sorted, indexed BAM/CRAM of the sample: low-depth regions are read from it with samtools depth when there is no -bed")
+    parser.add_argument('-ref', '--reference', required=False, type=str, help="reference fasta, for a CRAM -bam")
+    parser.add_argument('-cd', '--coverage_depth', required=False, default=10, type=int, help="minimum coverage depth for any given call before that call is considered dubious")
+    parser.add_argument('-fai', '--reference_index', required=False, type=str, help='reference.fasta.fai with the contig lengths (default: built-in C. auris contigs)')
+    parser.add_argument('-c', '--compact', required=False, action='store_true', help="combine adjacent missing-data ('-') diff lines into one line")
+    parser.add_argument('-m', '--multi_sample', required=False, action='store_true', help="VCF has many samples: write one diff per sample column (-bed is then a directory of {sample}_merged.bed files)")
+    parser.add_argument('-j', '--jobs', required=False, default=1, type=int, help='number of workers: with -m they convert chunks of sample columns, otherwise the contigs of a vcf.gz with a .tbi/.csi index (and of -bam)')
+    parser.add_argument('-ml', '--metrics_log', required=False, type=str, default=None, help='append per-stage timings and counters of the sample to this JSON lines file')
+    parser.add_argument('-l', '--logging', required=False, default=True, type=bool, help="if True, logging.debug verbose logging to diff.log, else suppress most logging")
+    parser.add_argument('-lf', '--log_file', required=False, type=str, default=None, help="file the verbose log is written to (default: {sample}.vcf.log in -d)")
+
+    args = parser.parse_args()
+    vcf = args.VCF
+    wd = args.working_directory
+    smf = args.species_maskfile
+    bed = args.bedgraph
+    min_coverage = args.coverage_depth
+    #makes sure input path wont cause error
+    if wd[-1] != '/':
+        wd = wd+'/'
+
+    #sample.vcf.gz logs to sample.vcf.log
+    log_file = args.log_file if args.log_file != None else f"{wd}{os.path.basename(vcf[:-4])}.log"
+    if args.logging is True:
+        logging.basicConfig(filename=log_file, filemode='a', level=logging.DEBUG,
+            format="%(asctime)s %(funcName)s@%(lineno)d::%(levelname)s: %(message)s", datefmt="%I:%M:%S %p")
+        logging.info(f"Arguments:\n\tvcf = {vcf}\n\twd = {wd}\n\tsmf={smf}\n\tbed={bed}\n\tbam={args.alignment}\n\tmin_coverage={min_coverage}\n\tl={args.logging}")
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    lengths = load_lengths(fai=args.reference_index)
+    offsets = offsets_from_lengths(lengths)
+    if args.multi_sample:
+        diff_files = convert_multi_sample(vcf, wd, smf=smf, bd=bed, min_coverage=min_coverage, offsets=offsets, compact=args.compact, jobs=args.jobs)
+        logging.info("Finished")
+        print(f"Wrote {len(diff_files)} diff files to {wd}")
+        exit(0)
+    metrics = None
+    if args.metrics_log != None:
+        metrics = SampleMetrics(genome_length=sum(length for contig, length in lengths))
+    diff_file = convert_sample(vcf, wd, smf=smf, bed=bed, min_coverage=min_coverage, offsets=offsets, compact=args.compact, jobs=args.jobs, metrics=metrics,
+                               bam=args.alignment, reference=args.reference, lengths=lengths)
+    if metrics != None:
+        stage_metrics.write_metrics(args.metrics_log, [metrics.summary()])
+
     logging.info("Finished")
-    
-    log_file = os.path.splitext(diff_file)[0] + ".vc.log"
-    
-    with open(log_file, 'r') as log_file_content:
-        if "Finished" in log_file_content.read():
-            try:
-                os.remove(log_file)
-                os.remove(output_file)
-                os.remove(myfile)
-                print("Files deleted successfully.")
-            except OSError as e:
-                print(f"Error deleting files: {e}")
+
+    #the log of a finished run is removed, only logs of failed runs are kept
+    if args.logging is True:
+        with open(log_file, 'r') as log_file_content:
+            if "Finished" in log_file_content.read():
+                try:
+                    os.remove(log_file)
+                    print("Files deleted successfully.")
+                except OSError as e:
+                    print(f"Error deleting files: {e}")
     
\ No newline at end of file
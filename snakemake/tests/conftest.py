@@ -0,0 +1,7 @@
+# conftest.py
+# the scripts import each other as siblings (they are run from snakemake/), so the tests do the same
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
@@ -0,0 +1,59 @@
+# test_bam_coverage.py
+
+import os
+import sys
+
+import pytest
+
+from vcf_to_diff_script import bam_low_depth
+
+#prints the lines of {bam}.depth for the -r contig, like a samtools depth that leaves out positions without reads
+STAND_IN = '''#!{python}
+import sys
+contig = sys.argv[sys.argv.index('-r') + 1]
+with open(sys.argv[-1] + '.depth') as f:
+    sys.stdout.writelines(line for line in f if line.split('\\t')[0] == contig)
+'''
+
+
+@pytest.fixture
+def samtools(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    stand_in = bin_dir / 'samtools'
+    stand_in.write_text(STAND_IN.format(python=sys.executable))
+    stand_in.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def write_bam(tmp_path, depth_lines):
+    bam = tmp_path / 'aligned_S.bam'
+    bam.write_bytes(b'')
+    (tmp_path / 'aligned_S.bam.bai').write_bytes(b'')
+    (tmp_path / 'aligned_S.bam.depth').write_text(''.join(f'{contig}\t{pos}\t{depth}\n' for contig, pos, depth in depth_lines))
+    return str(bam)
+
+
+def regions(starts, ends):
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def test_contig_without_reads_is_low_depth(tmp_path, samtools):
+    lengths = [('c1', 5), ('c2', 8), ('c3', 5)]
+    bam = write_bam(tmp_path, [('c1', p, 20) for p in range(1, 6)] + [('c3', p, 20) for p in range(1, 6)])
+    assert regions(*bam_low_depth(bam, lengths, 10)) == [(6, 14)]
+    assert regions(*bam_low_depth(bam, lengths, 10, jobs=2)) == [(6, 14)]
+
+
+def test_left_out_positions_and_tail_are_low_depth(tmp_path, samtools):
+    lengths = [('c1', 10), ('c2', 5)]
+    #c1: 1-2 left out, 3-6 covered, 7 left out, 8 covered, 9-10 left out; c2: covered from 2
+    depth = [('c1', 3, 20), ('c1', 4, 20), ('c1', 5, 3), ('c1', 6, 20), ('c1', 8, 20)] + [('c2', p, 20) for p in range(2, 6)]
+    bam = write_bam(tmp_path, depth)
+    #the tail of c1 runs into the first position of c2
+    assert regions(*bam_low_depth(bam, lengths, 10)) == [(1, 3), (5, 6), (7, 8), (9, 12)]
+
+
+def test_failing_samtools_raises(tmp_path, samtools):
+    with pytest.raises(Exception, match='samtools depth failed'):
+        bam_low_depth(write_bam(tmp_path, []) + '.missing', [('c1', 5)], 10)
@@ -0,0 +1,147 @@
+# test_cohort_store.py
+
+import os
+import gzip
+
+import numpy as np
+import pytest
+
+import cohort_store
+from cohort_store import ingest, append_store, export, CohortStore, mutation_counts
+from combine_diffs import combine_diffs, index_path
+
+
+def write_diffs(directory, n, first=0, far=False):
+    '''
+    writes n per-sample diffs with a few SNPs and missing regions each
+    (far puts a record past the int32 range)
+    '''
+    rng = np.random.default_rng(first)
+    diffs = []
+    for i in range(first, first + n):
+        starts = np.sort(rng.choice(np.arange(1, 100000), size=int(rng.integers(0, 20)), replace=False))
+        lines = []
+        for start in starts.tolist():
+            if rng.random() < 0.3:
+                lines.append(f'-\t{start}\t{int(rng.integers(1, 500))}')
+            else:
+                lines.append(f'{"ACGT"[int(rng.integers(0, 4))]}\t{start}\t1')
+        if far:
+            lines.append(f'-\t{(1 << 31) + 10}\t5')
+        path = os.path.join(directory, f'S{i}.diff')
+        with open(path, 'w') as f:
+            f.write(f'>S{i}\n')
+            f.writelines(f'{line}\n' for line in lines)
+        diffs.append(path)
+    return diffs
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def store_arrays(store):
+    cohort = CohortStore(store)
+    return cohort.samples, [np.asarray(a) for a in (cohort.rows, cohort.alleles, cohort.starts, cohort.lengths)]
+
+
+def assert_same_store(a, b):
+    samples_a, arrays_a = store_arrays(a)
+    samples_b, arrays_b = store_arrays(b)
+    assert samples_a == samples_b
+    for x, y in zip(arrays_a, arrays_b):
+        assert x.dtype == y.dtype
+        assert np.array_equal(x, y)
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_ingest_then_export_is_combine_diffs(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(cohort_store, 'FILES_PER_TASK', 2)
+    diffs = write_diffs(tmp_path, 7)
+    combined = str(tmp_path / 'combined.diff')
+    combine_diffs(diffs, combined)
+    store = str(tmp_path / 'cohort.store')
+    assert ingest(diffs, store, jobs) == 7
+    exported = str(tmp_path / 'exported.diff')
+    export(store, None, exported)
+    assert read(exported) == read(combined)
+    assert read(index_path(exported)) == read(index_path(combined))
+
+
+def test_export_subset_compressed(tmp_path):
+    diffs = write_diffs(tmp_path, 4)
+    store = str(tmp_path / 'cohort.store')
+    ingest(diffs, store)
+    subset = str(tmp_path / 'subset.diff')
+    combine_diffs([diffs[2], diffs[0]], subset)
+    exported = str(tmp_path / 'exported.diff.gz')
+    export(store, ['S2', 'S0'], exported)
+    assert gzip.decompress(read(exported)) == read(subset)
+
+
+def test_ingest_a_combined_diff(tmp_path):
+    diffs = write_diffs(tmp_path, 3)
+    combined = str(tmp_path / 'combined.diff')
+    combine_diffs(diffs, combined)
+    a = str(tmp_path / 'a.store')
+    b = str(tmp_path / 'b.store')
+    ingest(diffs, a)
+    ingest([combined], b)
+    assert_same_store(a, b)
+
+
+def test_ingest_rejects_repeated_samples(tmp_path):
+    diffs = write_diffs(tmp_path, 2)
+    with pytest.raises(Exception, match='more than once'):
+        ingest(diffs + diffs[:1], str(tmp_path / 'cohort.store'))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_append_matches_a_fresh_ingest(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(cohort_store, 'FILES_PER_TASK', 1)
+    diffs = write_diffs(tmp_path, 6)
+    fresh = str(tmp_path / 'fresh.store')
+    ingest(diffs, fresh)
+    store = str(tmp_path / 'cohort.store')
+    ingest(diffs[:2], store)
+    assert append_store(store, diffs[2:5], jobs) == 3
+    assert append_store(store, diffs[5:], jobs) == 1
+    assert np.load(os.path.join(store, 'starts.npy')).dtype == np.int32
+    assert_same_store(store, fresh)
+    assert mutation_counts(store) == mutation_counts(fresh)
+
+
+def test_append_rejects_samples_already_stored(tmp_path):
+    diffs = write_diffs(tmp_path, 3)
+    store = str(tmp_path / 'cohort.store')
+    ingest(diffs, store)
+    with pytest.raises(Exception, match='already in'):
+        append_store(store, diffs[1:2])
+    assert CohortStore(store).samples == ['S0', 'S1', 'S2']
+
+
+def test_append_past_int32_rewrites_the_store(tmp_path):
+    diffs = write_diffs(tmp_path, 3) + write_diffs(tmp_path, 2, first=3, far=True)
+    store = str(tmp_path / 'cohort.store')
+    ingest(diffs[:3], store)
+    assert np.load(os.path.join(store, 'starts.npy')).dtype == np.int32
+    append_store(store, diffs[3:])
+    assert np.load(os.path.join(store, 'starts.npy')).dtype == np.int64
+    fresh = str(tmp_path / 'fresh.store')
+    ingest(diffs, fresh)
+    assert_same_store(store, fresh)
+    combined = str(tmp_path / 'combined.diff')
+    combine_diffs(diffs, combined)
+    exported = str(tmp_path / 'exported.diff')
+    export(store, None, exported)
+    assert read(exported) == read(combined)
+
+
+def test_zstd_combined_diff_needs_zstandard(tmp_path, monkeypatch):
+    pytest.importorskip('zstandard')
+    combined = str(tmp_path / 'combined.diff.zst')
+    combine_diffs(write_diffs(tmp_path, 2), combined)
+    monkeypatch.setattr(cohort_store, 'zstandard', None)
+    with pytest.raises(Exception, match='zstandard package'):
+        ingest([combined], str(tmp_path / 'cohort.store'))
@@ -0,0 +1,83 @@
+# test_combine_diffs.py
+
+import os
+
+import pytest
+
+from combine_diffs import combine_diffs, append_diffs, read_index, index_path, read_block, compression_of, extract
+
+
+def write_diff(path, sample, lines=('A\t10\t1', '-\t20\t5')):
+    with open(path, 'w') as f:
+        f.write(f'>{sample}\n')
+        f.writelines(f'{line}\n' for line in lines)
+    return str(path)
+
+
+@pytest.mark.parametrize('name', ['combined.diff', 'combined.diff.gz'])
+def test_combine_and_read_back(tmp_path, name):
+    diffs = [write_diff(tmp_path / f'S{i}.diff', f'S{i}', [f'A\t{i + 1}\t1']) for i in range(3)]
+    output = str(tmp_path / name)
+    combine_diffs(diffs, output)
+    index = read_index(output)
+    assert list(index) == ['S0', 'S1', 'S2']
+    for i, (offset, size) in enumerate(index.values()):
+        assert read_block(output, offset, size, compression_of(output)) == f'>S{i}\nA\t{i + 1}\t1\n'.encode()
+
+
+def test_combine_adds_missing_newline(tmp_path):
+    a = tmp_path / 'A.diff'
+    a.write_text('>A\nA\t1\t1')
+    output = str(tmp_path / 'combined.diff')
+    combine_diffs([str(a), write_diff(tmp_path / 'B.diff', 'B')], output)
+    assert open(output).read().startswith('>A\nA\t1\t1\n>B\n')
+
+
+def test_combine_rejects_a_file_with_two_samples(tmp_path):
+    two = tmp_path / 'two.diff'
+    two.write_text('>A\nA\t10\t1\n>B\nC\t10\t1\n')
+    output = str(tmp_path / 'combined.diff')
+    with pytest.raises(Exception, match='more than one >sample header'):
+        combine_diffs([write_diff(tmp_path / 'S.diff', 'S'), str(two)], output)
+    assert not os.path.exists(output)
+
+
+def test_combine_rejects_a_second_header_right_after_the_first(tmp_path):
+    two = tmp_path / 'two.diff'
+    two.write_text('>A\n>B\nC\t10\t1\n')
+    with pytest.raises(Exception, match='more than one >sample header'):
+        combine_diffs([str(two)], str(tmp_path / 'combined.diff'))
+
+
+def test_combine_rejects_repeated_samples(tmp_path):
+    a = write_diff(tmp_path / 'A.diff', 'A')
+    #same sample name in another file
+    b = write_diff(tmp_path / 'A_again.diff', 'A')
+    output = str(tmp_path / 'combined.diff')
+    with pytest.raises(Exception, match='A is in the diffs more than once'):
+        combine_diffs([a, b], output)
+    assert not os.path.exists(output) and not os.path.exists(index_path(output))
+    with pytest.raises(Exception, match='A is in the diffs more than once'):
+        combine_diffs([a, a], output)
+
+
+def test_read_index_rejects_repeated_samples(tmp_path):
+    output = str(tmp_path / 'combined.diff')
+    combine_diffs([write_diff(tmp_path / 'A.diff', 'A')], output)
+    with open(index_path(output), 'a') as f:
+        f.write('A\t0\t10\n')
+    with pytest.raises(Exception, match='A is in .* more than once'):
+        read_index(output)
+
+
+def test_append_and_extract(tmp_path):
+    output = str(tmp_path / 'combined.diff.gz')
+    combine_diffs([write_diff(tmp_path / 'A.diff', 'A')], output)
+    append_diffs([write_diff(tmp_path / 'B.diff', 'B')], output)
+    assert list(read_index(output)) == ['A', 'B']
+    with pytest.raises(Exception, match='B is already in'):
+        append_diffs([write_diff(tmp_path / 'B.diff', 'B')], output)
+    assert list(read_index(output)) == ['A', 'B']
+    subset = str(tmp_path / 'subset.diff')
+    extract(output, ['B'], subset)
+    assert open(subset).read() == '>B\nA\t10\t1\n-\t20\t5\n'
@@ -0,0 +1,24 @@
+# test_contig_offsets.py
+
+import gzip
+
+from contig_offsets import read_fasta_lengths, read_fai, scatter_intervals
+
+
+def test_fasta_lengths_match_the_fai(tmp_path):
+    fasta = tmp_path / 'ref.fasta'
+    fasta.write_text('>c1 first contig\nACGTACGTAC\nACG\n>c2\nAC\r\n\n>c3\n')
+    (tmp_path / 'ref.fasta.fai').write_text('c1\t13\t18\t10\t11\nc2\t2\t43\t2\t4\nc3\t0\t50\t0\t1\n')
+    assert read_fasta_lengths(str(fasta)) == read_fai(str(tmp_path / 'ref.fasta.fai')) == [('c1', 13), ('c2', 2), ('c3', 0)]
+    with gzip.open(tmp_path / 'ref.fasta.gz', 'wb') as f:
+        f.write(fasta.read_bytes())
+    assert read_fasta_lengths(str(tmp_path / 'ref.fasta.gz')) == [('c1', 13), ('c2', 2), ('c3', 0)]
+
+
+def test_shards_of_a_reference_without_fai(tmp_path):
+    #the Snakefile scatters a reference that is not C. auris by its own contigs
+    fasta = tmp_path / 'ref.fasta'
+    fasta.write_text('>chrA\n' + 'A' * 60 + '\n>chrB\n' + 'C' * 40 + '\n')
+    lengths = read_fasta_lengths(str(fasta))
+    assert scatter_intervals(lengths) == [[('chrA', 1, 60)], [('chrB', 1, 40)]]
+    assert scatter_intervals(lengths, 2) == [[('chrA', 1, 50)], [('chrA', 51, 60), ('chrB', 1, 40)]]
@@ -0,0 +1,105 @@
+# test_interval_sweep.py
+
+import numpy as np
+import pytest
+
+from intervals import Intervals, MISSING
+from interval_sweep import coalesce, subtract, first_wins, clusters, override
+from vcf_to_diff_script import mask_and_write_diff, mask2ref
+
+A = ord('A')
+C = ord('C')
+M = MISSING
+
+
+def as_tuples(records):
+    return [tuple(record) for record in records]
+
+
+def test_coalesce_merges_overlapping_records_of_one_allele():
+    records = [(M, 1, 5), (M, 3, 10), (M, 12, 2), (M, 20, 1)]
+    assert as_tuples(coalesce(records)) == [(M, 1, 13), (M, 20, 1)]
+
+
+def test_coalesce_keeps_touching_records_and_other_alleles_apart():
+    records = [(M, 1, 5), (M, 6, 5), (A, 8, 1), (A, 8, 1)]
+    assert as_tuples(coalesce(records)) == [(M, 1, 5), (M, 6, 5), (A, 8, 1)]
+
+
+def test_coalesce_keeps_a_record_inside_the_previous_one():
+    assert as_tuples(coalesce([(M, 1, 20), (M, 5, 2), (M, 15, 10)])) == [(M, 1, 24)]
+
+
+def test_subtract_cuts_and_splits_records():
+    records = [(M, 1, 10), (A, 15, 1), (M, 20, 20), (C, 50, 1)]
+    regions = [(M, 5, 3), (M, 15, 1), (M, 25, 2), (M, 30, 2)]
+    assert as_tuples(subtract(records, regions)) == [(M, 1, 4), (M, 8, 3), (M, 20, 5), (M, 27, 3), (M, 32, 8), (C, 50, 1)]
+
+
+def test_subtract_without_regions():
+    records = [(M, 1, 10), (A, 15, 1)]
+    assert as_tuples(subtract(records, [])) == records
+
+
+def test_first_wins():
+    records = [(A, 10, 3), (C, 11, 1), (C, 12, 4), (A, 20, 1)]
+    assert as_tuples(first_wins(records)) == [(A, 10, 3), (C, 13, 3), (A, 20, 1)]
+
+
+def test_clusters():
+    records = [(A, 1, 5), (C, 4, 1), (A, 6, 1), (M, 10, 10), (A, 15, 1)]
+    assert [as_tuples(cluster) for cluster in clusters(records)] == [[(A, 1, 5), (C, 4, 1)], [(A, 6, 1)], [(M, 10, 10), (A, 15, 1)]]
+
+
+def test_override_regions_win_over_other_alleles():
+    records = [(A, 5, 1), (C, 12, 1), (A, 30, 1), (M, 40, 5)]
+    regions = [(M, 10, 5), (M, 42, 6)]
+    assert as_tuples(override(records, regions)) == [(A, 5, 1), (M, 10, 5), (A, 30, 1), (M, 40, 8)]
+
+
+def test_override_cuts_a_record_a_region_covers_in_part():
+    records = [(A, 8, 4)]
+    regions = [(M, 10, 5)]
+    assert as_tuples(override(records, regions)) == [(A, 8, 2), (M, 10, 5)]
+
+
+def test_low_depth_over_the_left_edge_of_a_missing_record():
+    #regression: this was written as (M, 5, 5), mask end - record end, instead of the union
+    low_depth = Intervals.from_regions([10], [20])
+    lines = [[M, 5, 10]]
+    assert as_tuples(mask_and_write_diff(low_depth, Intervals(), iter(lines))) == [(M, 5, 15)]
+
+
+def test_missing_record_at_a_snp_is_kept():
+    #regression: a missing record starting at the position of a SNP was dropped along with the SNP
+    low_depth = Intervals.from_regions([100], [110])
+    lines = [[A, 10, 1], [M, 10, 5], [C, 50, 1]]
+    assert as_tuples(mask_and_write_diff(low_depth, Intervals(), iter(lines))) == [(M, 10, 5), (C, 50, 1), (M, 100, 10)]
+
+
+def test_mask2ref_keeps_masking_after_a_right_overlap():
+    #regression: the rest of a record that overlapped a mask on the right was written without the next masks
+    masks = Intervals.from_arrays(np.array([10, 22, 50], dtype=np.int64), np.array([10, 8, 10], dtype=np.int64))
+    lines = [[M, 15, 20], [A, 55, 1], [M, 58, 5], [C, 70, 1]]
+    assert as_tuples(mask2ref(iter(lines), masks)) == [(M, 20, 2), (M, 30, 5), (M, 60, 3), (C, 70, 1)]
+
+
+def test_mask2ref_with_overlapping_masks():
+    masks = Intervals.from_regions([10, 12, 30], [20, 25, 31])
+    lines = [[M, 5, 30], [A, 40, 1]]
+    assert as_tuples(mask2ref(iter(lines), masks)) == [(M, 5, 5), (M, 25, 5), (M, 31, 4), (A, 40, 1)]
+
+
+def test_unsorted_input_fails():
+    with pytest.raises(Exception, match='not sorted'):
+        list(subtract([(A, 13, 1), (A, 11, 1)], [(M, 11, 1)]))
+    with pytest.raises(Exception, match='not sorted'):
+        list(subtract([(A, 11, 1), (A, 30, 1)], [(M, 20, 1), (M, 10, 1)]))
+    with pytest.raises(Exception, match='not sorted'):
+        list(override([(A, 10, 4), (A, 13, 1), (A, 11, 1)], []))
+
+
+def test_intervals_sort_keeps_ties_in_order():
+    diff = Intervals.from_records([(A, 10, 1), (C, 13, 1), (A, 11, 1), (M, 13, 2)])
+    diff.sort()
+    assert as_tuples(diff) == [(A, 10, 1), (A, 11, 1), (C, 13, 1), (M, 13, 2)]
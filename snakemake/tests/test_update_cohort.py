@@ -0,0 +1,50 @@
+# test_update_cohort.py
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from contig_offsets import default_contig_lengths
+from cohort_store import export, read_diff
+from test_vcf_to_diff import write_vcf
+
+zstandard = pytest.importorskip('zstandard')
+
+UPDATE_COHORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'update_cohort.py')
+CONTIG1, LENGTH1 = default_contig_lengths[0]
+
+
+def write_samples(tmp_path, samples):
+    '''
+    writes a vcf and a bedgraph (low depth at the start of contig 1) for every sample
+    '''
+    for i, sra in enumerate(samples):
+        write_vcf(tmp_path / 'vcfs' / f'{sra}.vcf.gz', [(CONTIG1, 100 + i, 'A', 'G', '1/1'), (CONTIG1, 200, 'A', 'T', '1/1')], samples=(sra,))
+        (tmp_path / 'beds' / f'aligned_{sra}.bed').write_text(f'{CONTIG1}\t0\t{10 + i}\t2\n{CONTIG1}\t{10 + i}\t{LENGTH1}\t30\n')
+
+
+def update(tmp_path, samples, *extra):
+    sl = tmp_path / 'sra_list.txt'
+    sl.write_text(''.join(f'{sra}\n' for sra in samples))
+    cmd = [sys.executable, UPDATE_COHORT, '-vd', str(tmp_path / 'vcfs'), '-bd', str(tmp_path / 'beds'), '-wd', str(tmp_path / 'diffs'),
+           '-sl', str(sl), '-o', str(tmp_path / 'out' / 'combined.diff.zst'), '-j', '1', *extra]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def test_store_started_from_a_zstd_combined_diff(tmp_path):
+    (tmp_path / 'vcfs').mkdir()
+    (tmp_path / 'beds').mkdir()
+    write_samples(tmp_path, ['S0', 'S1', 'S2'])
+    combined = str(tmp_path / 'out' / 'combined.diff.zst')
+    update(tmp_path, ['S0', 'S1'])
+    #the store is built from the zstd combined diff, then S2 is appended to both
+    store = str(tmp_path / 'cohort.store')
+    update(tmp_path, ['S0', 'S1', 'S2'], '-s', store)
+    exported = str(tmp_path / 'exported.diff')
+    export(store, None, exported)
+    with open(exported, 'rb') as f:
+        assert f.read() == read_diff(combined)
+    headers = [line for line in read_diff(combined).split(b'\n') if line.startswith(b'>')]
+    assert headers == [b'>S0', b'>S1', b'>S2']
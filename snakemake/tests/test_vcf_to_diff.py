@@ -0,0 +1,133 @@
+# test_vcf_to_diff.py
+
+import os
+import sys
+import gzip
+import subprocess
+
+from contig_offsets import default_contig_lengths, load_offsets, merged_contig
+from vcf_to_diff_script import stream_gt_records, records_to_diff, convert_sample, convert_multi_sample
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'vcf_to_diff_script.py')
+CONTIG1, LENGTH1 = default_contig_lengths[0]
+CONTIG2 = default_contig_lengths[1][0]
+
+
+def write_vcf(path, records, samples=('S',)):
+    '''
+    writes a gzipped vcf, records are (contig, pos, ref, alt, genotype of every sample)
+    '''
+    with gzip.open(path, 'wt') as v:
+        v.write('##fileformat=VCFv4.2\n')
+        v.write('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', *samples]) + '\n')
+        for contig, pos, ref, alt, *gts in records:
+            v.write('\t'.join([contig, str(pos), '.', ref, alt, '50', 'PASS', '.', 'GT:DP', *(f'{gt}:30' for gt in gts)]) + '\n')
+    return str(path)
+
+
+def read_diff(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def test_first_base_of_contig_2(tmp_path):
+    #regression: the streaming reader put every record of contigs 2-7 one base too low
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', [(CONTIG1, LENGTH1, 'A', 'C', '1/1'), (CONTIG2, 1, 'A', 'G', '1/1')])
+    records = list(records_to_diff(stream_gt_records(vcf, load_offsets())))
+    assert records == [[ord('C'), LENGTH1, 1], [ord('G'), LENGTH1 + 1, 1]]
+
+
+def test_first_base_of_contig_2_lines_up_with_the_bedgraph(tmp_path):
+    #the vcf and the per-contig bedgraph are shifted by the same offsets, so the low depth first base of contig 2 masks its SNP
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', [(CONTIG2, 1, 'A', 'G', '1/1'), (CONTIG2, 3, 'A', 'T', '1/1')])
+    bed = tmp_path / 'aligned_S.bed'
+    bed.write_text(f'{CONTIG1}\t0\t{LENGTH1}\t30\n{CONTIG2}\t0\t1\t2\n{CONTIG2}\t1\t100\t30\n')
+    diff = convert_sample(vcf, str(tmp_path), bed=str(bed))
+    assert read_diff(diff) == ['>S', f'-\t{LENGTH1 + 1}\t1', f'T\t{LENGTH1 + 3}\t1']
+
+
+def test_genotypes(tmp_path):
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', [
+        (CONTIG1, 10, 'A', 'G', './.'),
+        (CONTIG1, 20, 'A', 'G', '0|1'),
+        (CONTIG1, 30, 'A', 'G,T', '1|2'),
+        (CONTIG1, 40, 'A', 'G', '0'),
+        (CONTIG1, 50, 'A', 'G', '1'),
+        (CONTIG1, 60, 'A', 'G', './1'),
+        (CONTIG1, 70, 'ACG', 'A', './.'),
+        (CONTIG1, 80, 'A', 'C,T', '2/2'),
+    ])
+    diff = convert_sample(vcf, str(tmp_path))
+    assert read_diff(diff) == [
+        '>S',
+        #missing calls mask the whole reference allele
+        '-\t10\t1',
+        #heterozygous SNPs become IUPAC codes, phased or not
+        'R\t20\t1',
+        'K\t30\t1',
+        #a haploid 0 is reference, a haploid 1 is the ALT
+        'G\t50\t1',
+        #partly missing is missing
+        '-\t60\t1',
+        '-\t70\t3',
+        'T\t80\t1',
+    ]
+
+
+def test_mnp_and_deletion_records_come_out_sorted(tmp_path):
+    #the SNPs of an MNP and a deletion after its anchor base start after the next vcf records
+    records = [
+        (CONTIG1, 10, 'ACGT', 'TCGA', '1/1'),
+        (CONTIG1, 11, 'C', 'G', '1/1'),
+        (CONTIG1, 20, 'AC', 'A', '1/1'),
+        (CONTIG1, 21, 'C', 'T', '1/1'),
+    ]
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', records)
+    starts = [start for allele, start, length in records_to_diff(stream_gt_records(vcf, load_offsets()))]
+    assert starts == [10, 11, 13, 21, 21]
+    #a species mask on 11 has to remove the SNP there, after the MNP's SNP at 13 was read
+    mask = tmp_path / 'mask.bed'
+    mask.write_text(f'{CONTIG1}\t10\t11\n')
+    diff = convert_sample(vcf, str(tmp_path), smf=str(mask))
+    assert read_diff(diff) == ['>S', 'T\t10\t1', 'A\t13\t1', '-\t21\t1', 'T\t21\t1']
+
+
+def test_multi_sample_mnp_records_come_out_sorted(tmp_path):
+    vcf = write_vcf(tmp_path / 'joint.vcf.gz', [(CONTIG1, 10, 'ACGT', 'TCGA', '1/1', '0/0'), (CONTIG1, 11, 'C', 'G', '1/1', '1/1')], samples=('S1', 'S2'))
+    mask = tmp_path / 'mask.bed'
+    mask.write_text(f'{CONTIG1}\t10\t11\n')
+    diffs = convert_multi_sample(vcf, str(tmp_path), smf=str(mask))
+    assert [read_diff(diff) for diff in diffs] == [['>S1', 'T\t10\t1', 'A\t13\t1'], ['>S2']]
+
+
+def test_contig_not_in_the_offsets_is_dropped_from_vcf_and_bedgraph(tmp_path):
+    #the plasmid's low depth run and its SNP must not land on the first contig
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', [(CONTIG1, 20, 'A', 'G', '1/1'), ('plasmid', 30, 'A', 'T', '1/1')])
+    bed = tmp_path / 'aligned_S.bed'
+    bed.write_text(f'{CONTIG1}\t0\t5\t2\n{CONTIG1}\t5\t{LENGTH1}\t30\nplasmid\t0\t50\t0\n')
+    diff = convert_sample(vcf, str(tmp_path), bed=str(bed))
+    assert read_diff(diff) == ['>S', '-\t1\t5', 'G\t20\t1']
+
+
+def test_merged_bedgraph_is_read_as_it_is(tmp_path):
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', [(CONTIG1, 20, 'A', 'G', '1/1'), (CONTIG2, 2, 'A', 'T', '1/1')])
+    bed = tmp_path / 'S_merged.bed'
+    bed.write_text(f'{merged_contig}\t0\t{LENGTH1}\t30\n{merged_contig}\t{LENGTH1}\t{LENGTH1 + 5}\t1\n')
+    diff = convert_sample(vcf, str(tmp_path), bed=str(bed))
+    assert read_diff(diff) == ['>S', 'G\t20\t1', f'-\t{LENGTH1 + 1}\t5']
+
+
+def test_log_file_stays_out_of_the_diff_directory(tmp_path):
+    vcf = write_vcf(tmp_path / 'S.vcf.gz', [(CONTIG1, 10, 'A', 'G', '1/1')])
+    wd = tmp_path / 'diffs'
+    wd.mkdir()
+    log = tmp_path / 'S.log'
+    #a failed run keeps its log where -lf says
+    failed = subprocess.run([sys.executable, SCRIPT, '-v', vcf, '-d', str(wd), '-bed', str(tmp_path / 'missing.bed'), '-lf', str(log)], capture_output=True)
+    assert failed.returncode != 0
+    assert 'Arguments' in log.read_text()
+    assert os.listdir(wd) == []
+    #a finished run removes it
+    subprocess.run([sys.executable, SCRIPT, '-v', vcf, '-d', str(wd), '-lf', str(log)], check=True, capture_output=True)
+    assert not log.exists()
+    assert os.listdir(wd) == ['S.diff']